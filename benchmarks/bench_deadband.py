@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Compares storing every sample with deadband storage on a synthetic week-long trace.
+
+The trace is a UPS on line power with realistic jitter (line voltage
+wandering by a volt or so, load drifting, battery voltage flickering) and a
+few short outages. Both modes write through storage.SampleWriter; the
+deadband mode filters samples with sampling.AdaptiveSampler first. The
+benchmark reports rows written, database size, write time and the time of
+/api/history-sized queries, with step-wise reconstruction in deadband mode.
+
+Usage: python benchmarks/bench_deadband.py [--days N] [--interval SECONDS]
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import storage  # noqa: E402
+from sample import UPSSample, UPSStatus  # noqa: E402
+from sampling import AdaptiveSampler  # noqa: E402
+
+# Deadbands used for the deadband mode, matching the suggestions in config.ini.example
+DEADBANDS = {"loadpct": 1.0, "linev": 1.0, "battv": 0.1}
+HEARTBEAT = 300.0
+# Average number of outages per day and the length of each, in seconds
+OUTAGES_PER_DAY = 0.5
+OUTAGE_SECONDS = 600
+
+
+def make_trace(days: int, interval: int, seed: int = 1) -> list[UPSSample]:
+    """Builds `days` of samples every `interval` seconds ending now."""
+    rng = random.Random(seed)
+    count = days * 24 * 60 * 60 // interval
+    start = int(time.time()) - count * interval
+    outages = sorted(rng.randrange(count) for _ in range(int(days * OUTAGES_PER_DAY)))
+    samples = []
+    bcharge, load = 100.0, 20.0
+    outage_left = 0
+    for i in range(count):
+        if outages and i >= outages[0]:
+            outages.pop(0)
+            outage_left = OUTAGE_SECONDS // interval
+        on_battery = outage_left > 0
+        outage_left = max(0, outage_left - 1)
+        if on_battery:
+            bcharge = max(0.0, bcharge - 0.1 * interval)
+        else:
+            bcharge = min(100.0, bcharge + 0.02 * interval)
+        load = min(90.0, max(5.0, load + rng.choice((-0.1, 0.0, 0.0, 0.0, 0.1))))
+        samples.append(UPSSample(
+            status=UPSStatus.ONBATT if on_battery else UPSStatus.ONLINE,
+            bcharge=round(bcharge, 1),
+            loadpct=round(load, 1),
+            timeleft=round(bcharge * 0.6, 1),
+            linev=0.0 if on_battery else round(120.0 + rng.gauss(0, 0.4), 1),
+            battv=round(13.5 + rng.choice((-0.1, 0.0, 0.0, 0.0, 0.0, 0.1)), 1),
+            timestamp=start + i * interval,
+            monotonic=float(i * interval),
+        ))
+    return samples
+
+
+def write(path: Path, samples: list[UPSSample], sampler: AdaptiveSampler | None) -> tuple[int, float]:
+    """Writes the trace and returns (rows stored, seconds taken)."""
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    storage.enable_wal(conn)
+    writer = storage.SampleWriter(conn, flush_interval=float("inf"))
+    started = time.perf_counter()
+    for sample in samples:
+        if sampler is not None:
+            sampler.observe(sample)
+            if not sampler.should_store(sample):
+                continue
+        writer.add(sample)
+    writer.flush()
+    elapsed = time.perf_counter() - started
+    rows = conn.execute("SELECT COUNT(*) FROM ups_data").fetchone()[0]
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+    return rows, elapsed
+
+
+def query_times(path: Path, end: int, hold: int, repeat: int = 5) -> dict[str, float]:
+    """Returns the best time in ms of a 500-point history query per range."""
+    conn = sqlite3.connect(path)
+    times = {}
+    for name, seconds in (("1h", 3600), ("24h", 24 * 3600), ("7d", 7 * 24 * 3600)):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            storage.query_history(conn.cursor(), end - seconds, end, 500, now=end, hold=hold)
+            best = min(best, time.perf_counter() - started)
+        times[name] = best * 1000
+    conn.close()
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = make_trace(args.days, args.interval)
+    end = int(samples[-1].timestamp)
+    hold = int(HEARTBEAT + args.interval)
+    with tempfile.TemporaryDirectory() as tmp:
+        full, deadband = Path(tmp) / "full.db", Path(tmp) / "deadband.db"
+        full_rows, full_write = write(full, samples, None)
+        sampler = AdaptiveSampler(args.interval, store_on_change=True, heartbeat=HEARTBEAT, deadbands=DEADBANDS)
+        deadband_rows, deadband_write = write(deadband, samples, sampler)
+        full_size, deadband_size = full.stat().st_size, deadband.stat().st_size
+        full_queries = query_times(full, end, hold=0)
+        deadband_queries = query_times(deadband, end, hold=hold)
+
+    print(f"{len(samples)} samples over {args.days} days every {args.interval}s")
+    print(f"{'':22}{'rows':>10}{'size KiB':>10}{'write s':>9}" + "".join(f"{r + ' ms':>9}" for r in full_queries))
+    for name, rows, size, written, queries in (
+        ("every sample", full_rows, full_size, full_write, full_queries),
+        ("deadband + heartbeat", deadband_rows, deadband_size, deadband_write, deadband_queries),
+    ):
+        print(
+            f"{name:22}{rows:>10}{size / 1024:>10.0f}{written:>9.2f}"
+            + "".join(f"{ms:>9.2f}" for ms in queries.values())
+        )
+    print(f"rows: {full_rows / deadband_rows:.1f}x fewer, size: {full_size / deadband_size:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Load-tests /api/history with and without the pooled read-only connections.
+
+Seeds a temporary database with synthetic samples, serves web_app on a
+local threaded server and reports p50/p99 latency for concurrent clients.
+"Before" opens and closes a connection per request, as api_history() used
+to; "after" uses storage.ReadConnectionPool.
+
+Usage: python benchmarks/bench_history_load.py [--days N] [--clients N] [--requests N]
+"""
+
+import argparse
+import logging
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import storage  # noqa: E402
+import web_app  # noqa: E402
+
+
+class ConnectPerRequest:
+    """Stand-in for the pool that reproduces the old connect/close per request."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self._path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def seed(path: Path, days: int, interval: int) -> None:
+    """Writes `days` of synthetic samples at `interval` seconds and compacts them."""
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    storage.enable_wal(conn)
+    now = int(time.time())
+    count = days * 24 * 60 * 60 // interval
+    conn.executemany(
+        storage.INSERT_SAMPLE,
+        ((now - (count - i) * interval, storage.DEFAULT_UPS_ID, "ONLINE", 100.0, 10.0 + i % 7, 60.0, 120.0 + i % 3, 13.5, None)
+         for i in range(count)),
+    )
+    conn.commit()
+    storage.compact(conn, now=now)
+    conn.close()
+
+
+def run(url: str, clients: int, requests: int) -> list[float]:
+    """Issues `requests` GETs from each of `clients` threads and returns latencies in ms."""
+    def worker() -> list[float]:
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        futures = [pool.submit(worker) for _ in range(clients)]
+        return [latency for future in futures for latency in future.result()]
+
+
+def report(label: str, latencies: list[float]) -> None:
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{label:<22} p50 {percentiles[49]:8.2f} ms   p99 {percentiles[98]:8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between synthetic samples")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--timerange", default="1h", choices=sorted(web_app.HISTORY_RANGES))
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        seed(path, args.days, args.interval)
+
+        server = make_server("127.0.0.1", 0, web_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/api/history?timerange={args.timerange}"
+
+        for label, pool in (
+            ("connect per request", ConnectPerRequest(path)),
+            ("ReadConnectionPool", storage.ReadConnectionPool(path)),
+        ):
+            web_app.read_pool = pool
+            run(url, args.clients, 2)  # warm up
+            report(label, run(url, args.clients, args.requests))
+
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Measures cold-start import time of the app with `python -X importtime`.
+
+Each scenario imports what one way of running apcmagic needs, in a fresh
+interpreter: the headless monitor alone, with the web server, with SSH
+(needed once a shutdown starts) and with runtime prediction. Reports the
+best total import time and process wall time over several runs, and the
+heaviest modules imported by the headless monitor.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--top N]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Code run by each scenario, after `import app`
+SCENARIOS = {
+    "headless monitor": "",
+    "+ web server": "import web_app, web_server",
+    "+ SSH": "app.paramiko.SSHClient",
+    "+ prediction": "import prediction; prediction.np.zeros",
+    "everything": "import web_app, web_server; app.paramiko.SSHClient; import prediction; prediction.np.zeros",
+}
+
+
+def measure(code: str) -> tuple[float, float, dict[str, int]]:
+    """Runs `code` in a fresh interpreter and returns (import ms, wall ms, cumulative µs per module app imports)."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import app\n{code}"],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True,
+    )
+    wall = (time.perf_counter() - started) * 1000
+    total, direct = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented two spaces per level under the module that triggered them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            total += int(cumulative)
+        elif depth == 1:
+            direct[name.strip()] = int(cumulative)
+    return total / 1000, wall, direct
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="runs per scenario; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="heaviest modules of the headless monitor to list")
+    args = parser.parse_args()
+
+    print(f"{'':20}{'imports ms':>12}{'wall ms':>10}")
+    headless_imports = {}
+    for name, code in SCENARIOS.items():
+        runs = [measure(code) for _ in range(args.runs)]
+        imports, wall = min(run[0] for run in runs), min(run[1] for run in runs)
+        if not code:
+            headless_imports = min(runs)[2]
+        print(f"{name:20}{imports:>12.1f}{wall:>10.1f}")
+
+    print("\nHeaviest modules imported by the headless monitor:")
+    for module, cumulative in sorted(headless_imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {module:30}{cumulative / 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Runs the reproducible benchmark suite and writes its results as JSON.
+
+Every scenario runs against local fakes, so no UPS, apcupsd or network
+device is needed:
+
+  monitor    polls a fake apcupsd with a scripted outage from many UPS
+             targets through PollScheduler, storing samples with
+             SampleWriter and power events with EventRecorder, and reports
+             throughput, poll latency and schedule lag
+  history    /api/history latency (cold and cached) for ranges from 1h to
+             90d against synthetic databases of growing size
+  dashboard  concurrent dashboard clients (status, history, events and
+             metrics requests) against the production web server
+  shutdown   shutdown_ubiquiti_devices() fan-out time against fake SSH
+             servers
+
+The JSON holds the parameters, the environment (Python, platform, git
+commit) and one object per scenario, so results from two releases can be
+diffed or tracked over time.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--scenario NAME ...] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "src"))
+
+import storage  # noqa: E402
+from events import EventRecorder  # noqa: E402
+from fake_apcupsd import FakeAPCUPSD, Outage  # noqa: E402
+from metrics import polls_skipped  # noqa: E402
+from nis_client import NISClient  # noqa: E402
+from sample import DEFAULT_UPS_ID  # noqa: E402
+from scheduler import PollScheduler, UPSTarget  # noqa: E402
+from status_cache import configure_caches, make_fetcher  # noqa: E402
+from synthetic_history import generate  # noqa: E402
+
+# Format version of the JSON document, bumped when its layout changes
+RESULTS_VERSION = 1
+# /api/history ranges measured, in days
+HISTORY_RANGES = {"1h": 1 / 24, "24h": 1, "7d": 7, "30d": 30, "90d": 90}
+# Requests each dashboard client cycles through
+DASHBOARD_PATHS = ("/api/status", "/api/history?timerange=24h", "/api/events", "/metrics")
+
+
+def summarize(values: list[float]) -> dict:
+    """Returns count, mean, p50, p99 and max of a list of measurements, rounded for the report."""
+    if not values:
+        return {"count": 0}
+    percentiles = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else [values[0]] * 99
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 3),
+        "p50": round(percentiles[49], 3),
+        "p99": round(percentiles[98], 3),
+        "max": round(max(values), 3),
+    }
+
+
+def bench_monitor(args: argparse.Namespace, tmp: Path) -> dict:
+    """Runs the monitoring pipeline against a fake apcupsd for args.monitor_seconds."""
+    fake = FakeAPCUPSD((Outage(1.0, 2.0),), runtime_minutes=0.05).start()
+    targets = [
+        UPSTarget(ups_id=f"ups{i}", host=fake.host, port=fake.port, interval=args.monitor_interval)
+        for i in range(args.monitor_targets)
+    ]
+    clients = {target.ups_id: NISClient(target.host, target.port) for target in targets}
+    poll_ms = []
+
+    async def poll(target: UPSTarget, scheduled: float):
+        started = time.perf_counter()
+        sample = await clients[target.ups_id].sample(target.ups_id, scheduled)
+        poll_ms.append((time.perf_counter() - started) * 1000)
+        return sample
+
+    conn = sqlite3.connect(tmp / "monitor.db")
+    storage.migrate(conn)
+    storage.enable_wal(conn)
+    writer = storage.SampleWriter(conn)
+    recorder = EventRecorder(conn)
+    skipped = sum(polls_skipped.value(ups=target.ups_id) for target in targets)
+    scheduler = PollScheduler(targets, poll, jitter=0)
+    lag_ms, handle_ms, errors = [], [], 0
+    started = time.monotonic()
+    for _, sample, error in scheduler.results():
+        if error is not None:
+            errors += 1
+        else:
+            handled = time.perf_counter()
+            writer.add(sample)
+            recorder.observe(sample)
+            handle_ms.append((time.perf_counter() - handled) * 1000)
+            lag_ms.append((sample.timestamp - sample.scheduled) * 1000)
+        if time.monotonic() - started >= args.monitor_seconds:
+            break
+    elapsed = time.monotonic() - started
+    scheduler.shutdown()
+    writer.flush()
+    events = conn.execute("SELECT kind, COUNT(*) FROM power_events GROUP BY kind").fetchall()
+    conn.close()
+    fake.stop()
+    return {
+        "targets": len(targets),
+        "interval_seconds": args.monitor_interval,
+        "samples": len(handle_ms),
+        "errors": errors,
+        "samples_per_second": round(len(handle_ms) / elapsed, 1),
+        "skipped_polls": sum(polls_skipped.value(ups=target.ups_id) for target in targets) - skipped,
+        "poll_ms": summarize(poll_ms),
+        "schedule_lag_ms": summarize(lag_ms),
+        "store_and_detect_ms": summarize(handle_ms),
+        "events": dict(events),
+    }
+
+
+def bench_history(args: argparse.Namespace, tmp: Path) -> dict:
+    """Measures /api/history for each range against databases of each size in args.history_days."""
+    import web_app
+
+    results = {}
+    for days in args.history_days:
+        path = tmp / f"history-{days}d.db"
+        generated = time.perf_counter()
+        rows = generate(path, days, interval=args.history_interval)
+        generated = time.perf_counter() - generated
+        web_app.read_pool = storage.ReadConnectionPool(path)
+        client = web_app.app.test_client()
+        now = int(time.time())
+        by_range = {}
+        for name, range_days in HISTORY_RANGES.items():
+            if range_days > days:
+                continue
+            url = f"/api/history?start={now - int(range_days * 86400)}&end={now}&points=500"
+            cold, cached = [], []
+            for _ in range(args.history_requests):
+                web_app.history_bodies.clear()
+                started = time.perf_counter()
+                assert client.get(url).status_code == 200
+                cold.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                client.get(url)
+                cached.append((time.perf_counter() - started) * 1000)
+            by_range[name] = {"cold_ms": summarize(cold), "cached_ms": summarize(cached)}
+        web_app.read_pool.close_all()
+        results[f"{days}d"] = {
+            "samples_generated": rows,
+            "generate_seconds": round(generated, 2),
+            "database_bytes": path.stat().st_size,
+            "ranges": by_range,
+        }
+    return results
+
+
+def bench_dashboard(args: argparse.Namespace, tmp: Path) -> dict:
+    """Measures concurrent dashboard clients against the production web server."""
+    import web_app
+    from web_server import MODE_PRODUCTION, WebServer
+
+    path = tmp / "dashboard.db"
+    generate(path, 7, interval=args.history_interval)
+    web_app.read_pool = storage.ReadConnectionPool(path)
+    fake = FakeAPCUPSD().start()
+    configure_caches({DEFAULT_UPS_ID: make_fetcher(NISClient(fake.host, fake.port))}, ttl=1.0)
+    server = WebServer(web_app.app, mode=MODE_PRODUCTION, port=0, threads=args.threads)
+    server.start()
+    base = f"http://127.0.0.1:{server.port}"
+
+    def worker() -> tuple[list[float], int]:
+        latencies, failures = [], 0
+        for i in range(args.dashboard_requests):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base + DASHBOARD_PATHS[i % len(DASHBOARD_PATHS)], timeout=30) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                failures += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies, failures
+
+    results = {}
+    for clients in args.dashboard_clients:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            outcomes = [future.result() for future in [pool.submit(worker) for _ in range(clients)]]
+        elapsed = time.perf_counter() - started
+        latencies = [latency for outcome in outcomes for latency in outcome[0]]
+        results[f"{clients}_clients"] = {
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "failures": sum(outcome[1] for outcome in outcomes),
+            "latency_ms": summarize(latencies),
+        }
+    server.stop()
+    fake.stop()
+    web_app.read_pool.close_all()
+    return {"threads": args.threads, "paths": list(DASHBOARD_PATHS), "concurrency": results}
+
+
+def bench_shutdown(args: argparse.Namespace, tmp: Path) -> dict:
+    """Times shutdown_ubiquiti_devices() against fake SSH servers, for each device count."""
+    import app
+    from fake_ssh import FakeSSHServer
+
+    # app sets up its own INFO logging on import, which would log every device
+    app.logger.setLevel(logging.WARNING)
+    results = {}
+    for count in args.shutdown_devices:
+        servers = [
+            FakeSSHServer(handshake_latency=args.ssh_handshake_latency, command_latency=args.ssh_command_latency).start()
+            for _ in range(count)
+        ]
+        app.UBIQUITI_DEVICES[:] = [server.device() for server in servers]
+        started = time.perf_counter()
+        app.shutdown_ubiquiti_devices()
+        elapsed = time.perf_counter() - started
+        results[f"{count}_devices"] = {
+            "seconds": round(elapsed, 3),
+            "powered_off": sum(server.commands == ["poweroff"] for server in servers),
+        }
+        for server in servers:
+            server.stop()
+    app.UBIQUITI_DEVICES.clear()
+    return {
+        "handshake_latency_seconds": args.ssh_handshake_latency,
+        "command_latency_seconds": args.ssh_command_latency,
+        "fanout": results,
+    }
+
+
+SCENARIOS = {
+    "monitor": bench_monitor,
+    "history": bench_history,
+    "dashboard": bench_dashboard,
+    "shutdown": bench_shutdown,
+}
+
+
+def environment() -> dict:
+    """Describes where the suite ran, so results are only compared like for like."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpus": os.cpu_count(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke run in well under a minute")
+    parser.add_argument("--output", type=Path, help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--monitor-targets", type=int, default=20)
+    parser.add_argument("--monitor-interval", type=float, default=0.05)
+    parser.add_argument("--monitor-seconds", type=float, default=10.0)
+    parser.add_argument("--history-days", type=int, nargs="+", default=[7, 30, 90])
+    parser.add_argument("--history-interval", type=int, default=10, help="seconds between synthetic samples")
+    parser.add_argument("--history-requests", type=int, default=20, help="requests per range")
+    parser.add_argument("--dashboard-clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--dashboard-requests", type=int, default=40, help="requests per client")
+    parser.add_argument("--threads", type=int, default=16, help="web server worker threads")
+    parser.add_argument("--shutdown-devices", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--ssh-handshake-latency", type=float, default=0.05)
+    parser.add_argument("--ssh-command-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    if args.quick:
+        args.monitor_targets, args.monitor_seconds = 5, 3.0
+        args.history_days, args.history_requests = [1, 7], 5
+        args.dashboard_clients, args.dashboard_requests = [1, 8], 10
+        args.shutdown_devices = [1, 5]
+
+    for name in ("apcmagic", "werkzeug", "paramiko"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    results = {
+        "version": RESULTS_VERSION,
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "parameters": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        # app is imported by the shutdown scenario; keep its log out of the checkout
+        os.environ["APCMAGIC_LOG_FILE"] = str(Path(tmp) / "apcmagic.log")
+        for name in args.scenario or SCENARIOS:
+            print(f"Running {name}...", file=sys.stderr)
+            started = time.perf_counter()
+            results["scenarios"][name] = SCENARIOS[name](args, Path(tmp))
+            results["scenarios"][name]["wall_seconds"] = round(time.perf_counter() - started, 2)
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(document + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(document)
+
+
+if __name__ == "__main__":
+    main()
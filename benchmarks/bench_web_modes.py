@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Load-tests the dashboard API in the production and development serving modes.
+
+Seeds a temporary database with synthetic samples, serves web_app through
+web_server.WebServer in each mode and reports requests/sec with p50/p99
+latency for /api/status and /api/history under concurrent clients. The
+status cache is fed a fixed sample, so no apcupsd is needed.
+
+Usage: python benchmarks/bench_web_modes.py [--days N] [--clients N] [--requests N]
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import storage  # noqa: E402
+import web_app  # noqa: E402
+from bench_history_load import seed  # noqa: E402
+from sample import DEFAULT_UPS_ID, UPSSample, UPSStatus  # noqa: E402
+from status_cache import configure_caches  # noqa: E402
+from web_server import MODE_DEVELOPMENT, MODE_PRODUCTION, WebServer  # noqa: E402
+
+SAMPLE = UPSSample(status=UPSStatus.ONLINE, bcharge=100.0, loadpct=12.0, timeleft=60.0, linev=120.0, battv=13.5)
+
+
+def run(url: str, clients: int, requests: int) -> tuple[float, list[float]]:
+    """Issues `requests` GETs from each of `clients` threads and returns (requests/sec, latencies in ms)."""
+    def worker() -> list[float]:
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        futures = [pool.submit(worker) for _ in range(clients)]
+        latencies = [latency for future in futures for latency in future.result()]
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between synthetic samples")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--threads", type=int, default=16, help="worker threads in production mode")
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    configure_caches({DEFAULT_UPS_ID: lambda: SAMPLE}, ttl=5.0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        seed(path, args.days, args.interval)
+        web_app.read_pool = storage.ReadConnectionPool(path)
+
+        print(f"{args.clients} clients x {args.requests} requests")
+        print(f"{'':30}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+        # Development mode turns on Flask's debug flag for the process, so it goes last
+        for mode in (MODE_PRODUCTION, MODE_DEVELOPMENT):
+            server = WebServer(web_app.app, mode=mode, port=0, threads=args.threads, backlog=args.clients * 2)
+            server.start()
+            for path_query in ("/api/status", "/api/history?timerange=24h"):
+                url = f"http://127.0.0.1:{server.port}{path_query}"
+                run(url, args.clients, 2)  # warm up
+                rate, latencies = run(url, args.clients, args.requests)
+                percentiles = statistics.quantiles(latencies, n=100)
+                print(
+                    f"{mode + ' ' + path_query.split('?')[0]:30}{rate:>9.0f}"
+                    f"{percentiles[49]:>9.2f}{percentiles[98]:>9.2f}"
+                )
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
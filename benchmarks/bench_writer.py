@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Compares sample logging throughput of the old and new write paths.
+
+The old path commits every INSERT on a rollback-journal connection, as
+monitor_ups() used to. The new path uses WAL with synchronous=NORMAL and
+the batching storage.SampleWriter.
+
+Usage: python benchmarks/bench_writer.py [--samples N] [--batch-size N]
+"""
+
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import storage  # noqa: E402
+from sample import UPSSample, UPSStatus  # noqa: E402
+
+
+def make_samples(count: int) -> list[UPSSample]:
+    """Builds a steady on-line trace of `count` one-second samples."""
+    start = int(time.time()) - count
+    return [
+        UPSSample(
+            status=UPSStatus.ONLINE, bcharge=100.0, loadpct=10.0 + i % 5, timeleft=60.0,
+            linev=120.0, battv=13.5, timestamp=start + i, monotonic=float(i),
+        )
+        for i in range(count)
+    ]
+
+
+def bench_commit_per_sample(path: Path, samples: list[UPSSample]) -> float:
+    """Returns samples/sec for one INSERT + commit per sample on a rollback journal."""
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    started = time.perf_counter()
+    for sample in samples:
+        conn.execute(storage.INSERT_SAMPLE, storage.sample_row(sample))
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return len(samples) / elapsed
+
+
+def bench_sample_writer(path: Path, samples: list[UPSSample], batch_size: int) -> float:
+    """Returns samples/sec for the WAL + batched SampleWriter path."""
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    storage.enable_wal(conn)
+    writer = storage.SampleWriter(conn, batch_size=batch_size, flush_interval=float("inf"))
+    started = time.perf_counter()
+    for sample in samples:
+        writer.add(sample)
+    writer.flush()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return len(samples) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=storage.DEFAULT_WRITE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    samples = make_samples(args.samples)
+    with tempfile.TemporaryDirectory() as tmp:
+        before = bench_commit_per_sample(Path(tmp) / "before.db", samples)
+        after = bench_sample_writer(Path(tmp) / "after.db", samples, args.batch_size)
+
+    print(f"commit per sample (rollback journal): {before:10.0f} samples/sec")
+    print(f"SampleWriter (WAL, batch {args.batch_size:>3}):      {after:10.0f} samples/sec")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
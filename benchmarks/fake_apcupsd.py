@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""A local fake apcupsd Network Information Server with scripted outages.
+
+Answers "status" requests like apcupsd does, with readings that follow a
+script: on line power the UPS reports a stable line voltage and recharges,
+during each scripted outage it runs on battery and drains at the load's
+rate, raising LOWBATT near empty. Used by bench_suite.py, and handy for
+pointing a real apcmagic at (add an [ups:<id>] section with its port).
+
+Usage: python benchmarks/fake_apcupsd.py [--port N] [--outage START:DURATION ...] [--delay S]
+"""
+
+import argparse
+import asyncio
+import math
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from nis_client import BackgroundLoop  # noqa: E402
+
+_LENGTH = struct.Struct(">H")
+# Charge below which LOWBATT is reported, in percent
+LOW_BATTERY_PERCENT = 10.0
+# Percent of charge regained per minute on line power
+RECHARGE_PER_MINUTE = 2.0
+
+
+@dataclass(frozen=True)
+class Outage:
+    """A scripted loss of line power, in seconds after the server started."""
+
+    start: float
+    duration: float
+
+    @classmethod
+    def parse(cls, text: str) -> "Outage":
+        """Parses "START:DURATION" in seconds."""
+        start, duration = text.split(":")
+        return cls(float(start), float(duration))
+
+
+class FakeAPCUPSD:
+    """A NIS server whose status follows a script of outages, running on its own event loop thread.
+
+    runtime_minutes is how long a full battery lasts at the load; delay
+    stalls every response, to mimic a slow daemon.
+    """
+
+    def __init__(
+        self,
+        outages: tuple[Outage, ...] = (),
+        host: str = "127.0.0.1",
+        port: int = 0,
+        load: float = 25.0,
+        runtime_minutes: float = 30.0,
+        nominal_voltage: float = 120.0,
+        nominal_power: float = 900.0,
+        delay: float = 0.0,
+    ) -> None:
+        self.outages = tuple(sorted(outages, key=lambda outage: outage.start))
+        self.host = host
+        self.port = port
+        self.load = load
+        self.runtime_minutes = runtime_minutes
+        self.nominal_voltage = nominal_voltage
+        self.nominal_power = nominal_power
+        self.delay = delay
+        self.requests = 0
+        self._loop = BackgroundLoop()
+        self._server: asyncio.AbstractServer | None = None
+        self._started = 0.0
+
+    def start(self) -> "FakeAPCUPSD":
+        """Starts serving; the port is known once this returns."""
+        self._server = self._loop.run(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.monotonic()
+        return self
+
+    def stop(self) -> None:
+        async def close() -> None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._loop.run(close())
+
+    def charge(self, elapsed: float) -> float:
+        """Returns the battery charge `elapsed` seconds into the script."""
+        charge, clock = 100.0, 0.0
+        drain_per_second = 100.0 / (self.runtime_minutes * 60)
+        for outage in self.outages:
+            if outage.start >= elapsed:
+                break
+            charge = min(100.0, charge + (outage.start - clock) * RECHARGE_PER_MINUTE / 60)
+            on_battery = min(elapsed, outage.start + outage.duration) - outage.start
+            charge = max(0.0, charge - on_battery * drain_per_second)
+            clock = outage.start + on_battery
+        return min(100.0, charge + (elapsed - clock) * RECHARGE_PER_MINUTE / 60)
+
+    def on_battery(self, elapsed: float) -> bool:
+        return any(outage.start <= elapsed < outage.start + outage.duration for outage in self.outages)
+
+    def status_lines(self, elapsed: float) -> list[str]:
+        """Returns the status report `elapsed` seconds into the script."""
+        charge = self.charge(elapsed)
+        on_battery = self.on_battery(elapsed)
+        status = "ONBATT" if on_battery else "ONLINE"
+        if on_battery and charge < LOW_BATTERY_PERCENT:
+            status += " LOWBATT"
+        # A line voltage that wanders by a volt or so, like a real supply
+        linev = 0.0 if on_battery else self.nominal_voltage + math.sin(elapsed / 7) * 1.5
+        battv = 12.0 + charge / 100 * (1.3 if on_battery else 1.6)
+        return [
+            "APC      : 001,036,0879",
+            "UPSNAME  : fake",
+            "MODEL    : Back-UPS RS 1500MS2",
+            f"STATUS   : {status} ",
+            f"LINEV    : {linev:.1f} Volts",
+            f"LOADPCT  : {self.load:.1f} Percent",
+            f"BCHARGE  : {charge:.1f} Percent",
+            f"TIMELEFT : {charge / 100 * self.runtime_minutes:.1f} Minutes",
+            f"BATTV    : {battv:.1f} Volts",
+            f"NOMINV   : {self.nominal_voltage:.0f} Volts",
+            f"NOMPOWER : {self.nominal_power:.0f} Watts",
+            f"END APC  : {time.strftime('%Y-%m-%d %H:%M:%S +0000', time.gmtime())}",
+        ]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                (size,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+                command = await reader.readexactly(size)
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                lines = self.status_lines(time.monotonic() - self._started) if command == b"status" else []
+                for line in lines:
+                    data = f"{line}\n".encode()
+                    writer.write(_LENGTH.pack(len(data)) + data)
+                writer.write(_LENGTH.pack(0))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=3551)
+    parser.add_argument("--outage", type=Outage.parse, action="append", default=[], help="START:DURATION in seconds")
+    parser.add_argument("--load", type=float, default=25.0, help="load in percent")
+    parser.add_argument("--runtime", type=float, default=30.0, help="minutes a full battery lasts at the load")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to stall every response")
+    args = parser.parse_args()
+
+    server = FakeAPCUPSD(
+        tuple(args.outage), port=args.port, load=args.load, runtime_minutes=args.runtime, delay=args.delay
+    ).start()
+    print(f"Fake apcupsd listening on {server.host}:{server.port}; Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""A local fake SSH server standing in for a managed device during shutdown benchmarks.
+
+Accepts any password, and answers exec requests (poweroff) after a
+configurable latency, recording the commands it received. Handshake
+latency can be added too, to mimic a slow device.
+"""
+
+import socket
+import threading
+import time
+
+import paramiko
+
+# Generating an RSA key takes a while, so every fake server shares one
+_host_key: paramiko.RSAKey | None = None
+_host_key_lock = threading.Lock()
+
+
+def host_key() -> paramiko.RSAKey:
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+
+class _Device(paramiko.ServerInterface):
+    def __init__(self, server: "FakeSSHServer") -> None:
+        self.server = server
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel: paramiko.Channel, command: bytes) -> bool:
+        time.sleep(self.server.command_latency)
+        with self.server.lock:
+            self.server.commands.append(command.decode())
+        channel.send_exit_status(0)
+        return True
+
+
+class FakeSSHServer:
+    """An SSH server on 127.0.0.1 that every client may log in to with any password."""
+
+    def __init__(self, handshake_latency: float = 0.0, command_latency: float = 0.0) -> None:
+        self.handshake_latency = handshake_latency
+        self.command_latency = command_latency
+        self.commands: list[str] = []
+        self.lock = threading.Lock()
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._transports: list[paramiko.Transport] = []
+        self._closed = threading.Event()
+
+    def device(self, password: str = "bench") -> dict:
+        """Returns a device entry, as in app.UBIQUITI_DEVICES, that reaches this server."""
+        return {"host": "127.0.0.1", "port": self.port, "username": "ubnt", "password": password}
+
+    def start(self) -> "FakeSSHServer":
+        host_key()
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self) -> None:
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        time.sleep(self.handshake_latency)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key())
+        with self.lock:
+            self._transports.append(transport)
+        try:
+            transport.start_server(server=_Device(self))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+    def stop(self) -> None:
+        self._closed.set()
+        self._socket.close()
+        with self.lock:
+            for transport in self._transports:
+                transport.close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Generates months of reproducible synthetic UPS history in an apcmagic database.
+
+Writes raw samples to ups_data for each UPS at a fixed interval, with a
+wandering load and line voltage and randomly placed outages during which
+the UPS runs on battery and drains; each outage is also recorded in
+power_events. The same seed always yields the same database. Raw samples
+are then rolled up and pruned by storage.compact() under the usual
+retention, as a long-running install would have them.
+
+Usage: python benchmarks/synthetic_history.py PATH [--days N] [--interval S] [--ups ID ...] [--seed N]
+"""
+
+import argparse
+import itertools
+import math
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import storage  # noqa: E402
+from sample import DEFAULT_UPS_ID  # noqa: E402
+
+# Rows handed to executemany() at a time, so memory stays flat for any length of history
+INSERT_CHUNK_ROWS = 50_000
+# Outage length bounds in seconds
+MIN_OUTAGE_SECONDS = 30
+MAX_OUTAGE_SECONDS = 1800
+# Battery charge drained per second on battery and regained per second on line power, in percent
+DRAIN_PER_SECOND = 100 / 2400
+RECHARGE_PER_SECOND = 100 / 7200
+
+
+def outages(rng: random.Random, start: int, end: int, per_week: float) -> list[tuple[int, int]]:
+    """Returns (start, end) times of outages placed as a Poisson process of `per_week` outages a week."""
+    placed = []
+    t = start
+    while per_week > 0:
+        t += int(rng.expovariate(per_week / (7 * 24 * 60 * 60)))
+        if t >= end:
+            break
+        duration = int(rng.uniform(MIN_OUTAGE_SECONDS, MAX_OUTAGE_SECONDS))
+        placed.append((t, min(end, t + duration)))
+        t += duration
+    return placed
+
+
+def samples(ups_id: str, start: int, end: int, interval: int, outage_times: list[tuple[int, int]], rng: random.Random):
+    """Yields ups_data rows (as storage.INSERT_SAMPLE parameters) for one UPS."""
+    charge = 100.0
+    pending = iter(outage_times)
+    outage = next(pending, None)
+    load = 25.0
+    for t in range(start, end, interval):
+        while outage is not None and t >= outage[1]:
+            outage = next(pending, None)
+        on_battery = outage is not None and outage[0] <= t
+        # Load follows a daily cycle plus a random walk
+        load = min(90.0, max(10.0, load + rng.gauss(0, 0.3)))
+        loadpct = round(load + 8 * math.sin(t / 86400 * 2 * math.pi), 1)
+        if on_battery:
+            charge = max(0.0, charge - DRAIN_PER_SECOND * interval * loadpct / 25)
+            status = "ONBATT LOWBATT" if charge < 10 else "ONBATT"
+            linev = 0.0
+        else:
+            charge = min(100.0, charge + RECHARGE_PER_SECOND * interval)
+            status = "ONLINE"
+            linev = round(120.0 + 2 * math.sin(t / 3600) + rng.gauss(0, 0.4), 1)
+        yield (
+            t, ups_id, status, round(charge, 1), loadpct, round(charge / 100 * 40 * 25 / loadpct, 1), linev,
+            round(12.0 + charge / 100 * (1.3 if on_battery else 1.6), 2), float(t),
+        )
+
+
+def generate(
+    path: Path | str,
+    days: float,
+    interval: int = 10,
+    ups_ids: tuple[str, ...] = (DEFAULT_UPS_ID,),
+    outages_per_week: float = 2.0,
+    seed: int = 0,
+    now: int | None = None,
+    compact: bool = True,
+) -> int:
+    """Fills the database at `path` with `days` of history ending at `now` and returns the raw rows written."""
+    rng = random.Random(seed)
+    end = int(time.time()) if now is None else now
+    start = end - int(days * 24 * 60 * 60)
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    storage.enable_wal(conn)
+    written = 0
+    for ups_id in ups_ids:
+        outage_times = outages(rng, start, end, outages_per_week)
+        rows = samples(ups_id, start, end, interval, outage_times, rng)
+        while chunk := list(itertools.islice(rows, INSERT_CHUNK_ROWS)):
+            conn.executemany(storage.INSERT_SAMPLE, chunk)
+            written += len(chunk)
+        conn.executemany(
+            "INSERT INTO power_events (ups_id, kind, start_time, end_time) VALUES (?, 'onbatt', ?, ?)",
+            ((ups_id, outage_start, outage_end) for outage_start, outage_end in outage_times),
+        )
+        conn.commit()
+    if compact:
+        storage.compact(conn, now=end)
+    conn.close()
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--days", type=float, default=90)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between samples")
+    parser.add_argument("--ups", action="append", help="UPS id to generate (repeatable; default: default)")
+    parser.add_argument("--outages-per-week", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-compact", action="store_true", help="keep every raw sample instead of rolling up")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = generate(
+        args.path, args.days, args.interval, tuple(args.ups or [DEFAULT_UPS_ID]), args.outages_per_week,
+        args.seed, compact=not args.no_compact,
+    )
+    print(f"Wrote {written} samples to {args.path} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,11 @@ setup(
     package_dir={'': 'src'},
     include_package_data=True,
     install_requires=[
-        'apcaccess',
         'Flask',
-        'rumps',
+        # The menu bar app is macOS-only; elsewhere run apcmagic --headless
+        'rumps; sys_platform == "darwin"',
         'paramiko',
+        'numpy',
     ],
     entry_points={
         'console_scripts': [
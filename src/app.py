@@ -1,29 +1,72 @@
 #!/usr/bin/env python3
 
+import argparse
 import configparser
 import logging
+import multiprocessing
+import os
+import signal
 import sqlite3
 import subprocess
 import sys
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-
-from apcaccess.status import get, parse
-import paramiko
-import apcaccess
-
-from rumps_app import APCApp
-from web_app import app as flask_app
+from typing import TYPE_CHECKING
+
+import storage
+from broadcast import sample_broadcaster
+from events import DEFAULT_LINE_TOLERANCE, EventRecorder
+from lazy_import import lazy_import
+from metrics import nis_poll_errors, nis_poll_seconds, ssh_poweroff_seconds
+from nis_client import DEFAULT_NIS_PORT, NISClient
+from prediction import DEFAULT_HISTORY_DECAY, DEFAULT_MIN_FIT_SECONDS, RuntimePredictor, load_discharge_history
+from sample import DEFAULT_UPS_ID, UPSSample, UPSStatus
+from sampling import (
+    DEFAULT_FAST_HOLD_SECONDS,
+    DEFAULT_RATE_THRESHOLDS,
+    DEFAULT_STORE_HEARTBEAT_SECONDS,
+    STORED_METRICS,
+    AdaptiveSampler,
+)
+from scheduler import (
+    DEFAULT_JITTER,
+    DEFAULT_MAX_CATCH_UP,
+    DEFAULT_POLL_DEADLINE,
+    DEFAULT_POLL_TIMEOUT,
+    OVERRUN_POLICIES,
+    OVERRUN_SKIP,
+    PollScheduler,
+    UPSTarget,
+)
+from shared_status import SharedStatusFollower, SharedStatusReader, SharedStatusWriter, initialize_status_file
+from ssh_pool import connect_device, device_pool
+from status_cache import DEFAULT_TTL_SECONDS, configure_caches, make_fetcher, status_caches
+
+# The menu bar app (rumps), the web stack (Flask) and SSH (paramiko) are only
+# imported once they are used, so a headless restart after a power event is quick
+paramiko = lazy_import("paramiko")
+if TYPE_CHECKING:
+    from web_server import WebServer
 
 # Constants
 BASE_DIR = Path(__file__).parent.parent
 DATABASE_FILE = BASE_DIR / "data" / "apc_data.db"
 CONFIG_FILE = BASE_DIR / "config.ini"
-LOG_FILE = BASE_DIR / "logs" / "apcmagic.log"
+# APCMAGIC_LOG_FILE moves the log elsewhere, e.g. out of the checkout for test and benchmark runs
+LOG_FILE = Path(os.environ.get("APCMAGIC_LOG_FILE", BASE_DIR / "logs" / "apcmagic.log"))
+# Seconds before a monitor process that died is restarted
+MONITOR_RESTART_DELAY = 5.0
+# Exit code of the monitor once the shutdown sequence is complete; a monitor process exiting with any other code is restarted
+MONITOR_SHUTDOWN_EXIT = 3
+# Seconds a stopping monitor loop or process gets to write buffered samples before it is abandoned or killed
+MONITOR_STOP_TIMEOUT = 10.0
+# Polling intervals without a new sample after which the UIs report a UPS's status as stale
+STALE_AFTER_INTERVALS = 3
 
 # Create logs directory if it doesn't exist
-LOG_FILE.parent.mkdir(exist_ok=True)
+LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
 # --- Logging Setup ---
 logger = logging.getLogger(__name__)
@@ -50,11 +93,88 @@ logger.addHandler(console_handler)
 # Global variables (will be set by _load_configuration)
 SHUTDOWN_THRESHOLD: int = 0
 MONITOR_INTERVAL: int = 0
+COMPACTION_INTERVAL: int = 300
+WRITE_BATCH_SIZE: int = storage.DEFAULT_WRITE_BATCH_SIZE
+WRITE_FLUSH_INTERVAL: float = storage.DEFAULT_WRITE_FLUSH_SECONDS
 UBIQUITI_DEVICES: list[dict] = []
+SHUTDOWN_DEADLINE: float = 30.0
+SSH_PREARM: bool = False
+SSH_PERSISTENT: bool = False
+SSH_HEALTH_CHECK_INTERVAL: float = 60.0
+UPS_TARGETS: list[UPSTarget] = []
+# NIS client of each UPS by id, shared by the monitoring loop and the status caches
+NIS_CLIENTS: dict[str, NISClient] = {}
+POLL_JITTER: float = DEFAULT_JITTER
+POLL_DEADLINE: float | None = DEFAULT_POLL_DEADLINE
+# How polls that come due while a UPS's previous poll is still running are handled (see scheduler.PollScheduler)
+OVERRUN_POLICY: str = OVERRUN_SKIP
+MAX_CATCH_UP: int = DEFAULT_MAX_CATCH_UP
+# Whether polls land on wall-clock multiples of the interval, so samples line up across machines
+ALIGN_POLLS: bool = False
+FAST_INTERVAL: float | None = None
+RATE_THRESHOLDS: dict[str, float] = dict(DEFAULT_RATE_THRESHOLDS)
+FAST_HOLD_SECONDS: float = DEFAULT_FAST_HOLD_SECONDS
+STORE_ON_CHANGE: bool = False
+STORE_HEARTBEAT_SECONDS: float = DEFAULT_STORE_HEARTBEAT_SECONDS
+STORE_DEADBANDS: dict[str, float] = {}
+PREDICTION_ENABLED: bool = False
+PREDICTION_HISTORY_DECAY: float = DEFAULT_HISTORY_DECAY
+PREDICTION_MIN_FIT_SECONDS: float = DEFAULT_MIN_FIT_SECONDS
+PREDICTION_SAFETY_MARGIN: float = 0.1
+PREDICTION_CUTOFF_BATTV: float | None = None
+# Seconds the devices and this machine need to power off once told to
+SHUTDOWN_DURATION: float = 60.0
+EVENTS_ENABLED: bool = True
+EVENT_LINE_TOLERANCE: float = DEFAULT_LINE_TOLERANCE
+# Overrides for the NOMINV and NOMPOWER apcupsd reports, used to detect sags/swells and compute energy
+EVENT_NOMINAL_VOLTAGE: float | None = None
+EVENT_NOMINAL_POWER: float | None = None
+WEB_ENABLED: bool = True
+# Options set in [web], as keyword arguments of web_server.WebServer
+WEB_OPTIONS: dict = {}
+WEB_MAX_STREAMS: int | None = None
+# Whether the monitor loop runs in its own process, publishing samples to STATUS_FILE for the UIs to read
+MONITOR_PROCESS: bool = False
+STATUS_FILE: Path = BASE_DIR / "data" / "status.shm"
+
+def _load_ups_targets(config: configparser.ConfigParser) -> list[UPSTarget]:
+    """Builds the polled UPS list from [ups:<id>] sections, or the local apcupsd if there are none."""
+    targets = []
+    for section in config.sections():
+        if not section.startswith("ups:"):
+            continue
+        triggers_shutdown = config.getboolean(section, "triggers_shutdown", fallback=True)
+        targets.append(UPSTarget(
+            ups_id=section[len("ups:"):].strip(),
+            host=config.get(section, "host", fallback="localhost"),
+            port=config.getint(section, "port", fallback=DEFAULT_NIS_PORT),
+            interval=config.getfloat(section, "interval_seconds", fallback=MONITOR_INTERVAL),
+            fast_interval=config.getfloat(section, "fast_interval_seconds", fallback=FAST_INTERVAL),
+            timeout=config.getfloat(section, "timeout_seconds", fallback=DEFAULT_POLL_TIMEOUT),
+            deadline=config.getfloat(section, "deadline_seconds", fallback=POLL_DEADLINE) or None,
+            shutdown_threshold=(
+                config.getfloat(section, "shutdown_threshold", fallback=SHUTDOWN_THRESHOLD)
+                if triggers_shutdown else None
+            ),
+        ))
+    return targets or [UPSTarget(
+        interval=MONITOR_INTERVAL,
+        fast_interval=FAST_INTERVAL,
+        deadline=POLL_DEADLINE,
+        shutdown_threshold=SHUTDOWN_THRESHOLD,
+    )]
 
 def _load_configuration() -> None:
     """Loads configuration from config.ini and populates global variables."""
-    global SHUTDOWN_THRESHOLD, MONITOR_INTERVAL, UBIQUITI_DEVICES
+    global SHUTDOWN_THRESHOLD, MONITOR_INTERVAL, COMPACTION_INTERVAL, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL
+    global POLL_DEADLINE, OVERRUN_POLICY, MAX_CATCH_UP, ALIGN_POLLS
+    global UPS_TARGETS, POLL_JITTER, FAST_INTERVAL, FAST_HOLD_SECONDS, STORE_ON_CHANGE, STORE_HEARTBEAT_SECONDS
+    global UBIQUITI_DEVICES, SHUTDOWN_DEADLINE, SSH_PREARM, SSH_PERSISTENT, SSH_HEALTH_CHECK_INTERVAL
+    global PREDICTION_ENABLED, PREDICTION_HISTORY_DECAY, PREDICTION_MIN_FIT_SECONDS, PREDICTION_SAFETY_MARGIN
+    global PREDICTION_CUTOFF_BATTV, SHUTDOWN_DURATION
+    global WEB_ENABLED, WEB_MAX_STREAMS
+    global EVENTS_ENABLED, EVENT_LINE_TOLERANCE, EVENT_NOMINAL_VOLTAGE, EVENT_NOMINAL_POWER
+    global MONITOR_PROCESS, STATUS_FILE
 
     config = configparser.ConfigParser()
     if not CONFIG_FILE.is_file():
@@ -67,13 +187,97 @@ def _load_configuration() -> None:
     try:
         SHUTDOWN_THRESHOLD = config.getint("apcmagic", "shutdown_threshold")
         MONITOR_INTERVAL = config.getint("apcmagic", "monitor_interval_seconds")
+        status_cache_ttl = config.getfloat("apcmagic", "status_cache_ttl_seconds", fallback=DEFAULT_TTL_SECONDS)
+        POLL_JITTER = config.getfloat("apcmagic", "poll_jitter", fallback=DEFAULT_JITTER)
+        # 0 turns the hard per-poll deadline off
+        POLL_DEADLINE = config.getfloat("apcmagic", "poll_deadline_seconds", fallback=DEFAULT_POLL_DEADLINE) or None
+        OVERRUN_POLICY = config.get("apcmagic", "overrun_policy", fallback=OVERRUN_SKIP)
+        MAX_CATCH_UP = config.getint("apcmagic", "max_catch_up_polls", fallback=DEFAULT_MAX_CATCH_UP)
+        ALIGN_POLLS = config.getboolean("apcmagic", "align_polls", fallback=False)
+        MONITOR_PROCESS = config.getboolean("apcmagic", "monitor_process", fallback=False)
+        # Relative paths are taken from the project directory
+        STATUS_FILE = BASE_DIR / Path(config.get("apcmagic", "status_file", fallback="data/status.shm")).expanduser()
+        FAST_INTERVAL = config.getfloat("sampling", "fast_interval_seconds", fallback=None)
+        for metric, option in (
+            ("loadpct", "load_change_per_minute"),
+            ("linev", "line_voltage_change_per_minute"),
+            ("bcharge", "charge_change_per_minute"),
+        ):
+            RATE_THRESHOLDS[metric] = config.getfloat("sampling", option, fallback=DEFAULT_RATE_THRESHOLDS[metric])
+        FAST_HOLD_SECONDS = config.getfloat("sampling", "fast_hold_seconds", fallback=DEFAULT_FAST_HOLD_SECONDS)
+        STORE_ON_CHANGE = config.getboolean("sampling", "store_on_change", fallback=False)
+        STORE_HEARTBEAT_SECONDS = config.getfloat(
+            "sampling", "store_heartbeat_seconds", fallback=DEFAULT_STORE_HEARTBEAT_SECONDS
+        )
+        for metric in STORED_METRICS:
+            STORE_DEADBANDS[metric] = config.getfloat("sampling", f"{metric}_deadband", fallback=0.0)
+        PREDICTION_ENABLED = config.getboolean("prediction", "enabled", fallback=False)
+        PREDICTION_HISTORY_DECAY = config.getfloat("prediction", "history_decay", fallback=DEFAULT_HISTORY_DECAY)
+        PREDICTION_MIN_FIT_SECONDS = config.getfloat(
+            "prediction", "min_fit_seconds", fallback=DEFAULT_MIN_FIT_SECONDS
+        )
+        PREDICTION_SAFETY_MARGIN = config.getfloat("prediction", "safety_margin", fallback=0.1)
+        PREDICTION_CUTOFF_BATTV = config.getfloat("prediction", "cutoff_battv", fallback=None)
+        SHUTDOWN_DURATION = config.getfloat("prediction", "shutdown_duration_seconds", fallback=60.0)
+        UPS_TARGETS = _load_ups_targets(config)
+        EVENTS_ENABLED = config.getboolean("events", "enabled", fallback=True)
+        EVENT_LINE_TOLERANCE = config.getfloat("events", "line_tolerance", fallback=DEFAULT_LINE_TOLERANCE)
+        EVENT_NOMINAL_VOLTAGE = config.getfloat("events", "nominal_voltage", fallback=None)
+        EVENT_NOMINAL_POWER = config.getfloat("events", "nominal_power_watts", fallback=None)
+        WEB_ENABLED = config.getboolean("web", "enabled", fallback=True)
+        WEB_OPTIONS.clear()
+        for option, keyword, get in (
+            ("mode", "mode", config.get),
+            ("host", "host", config.get),
+            ("port", "port", config.getint),
+            ("threads", "threads", config.getint),
+            ("backlog", "backlog", config.getint),
+            ("request_timeout_seconds", "request_timeout", config.getfloat),
+            ("drain_seconds", "drain_seconds", config.getfloat),
+        ):
+            value = get("web", option, fallback=None)
+            if value is not None:
+                WEB_OPTIONS[keyword] = value
+        WEB_MAX_STREAMS = config.getint("web", "max_streams", fallback=None)
+        WRITE_BATCH_SIZE = config.getint("storage", "write_batch_size", fallback=storage.DEFAULT_WRITE_BATCH_SIZE)
+        WRITE_FLUSH_INTERVAL = config.getfloat(
+            "storage", "write_flush_seconds", fallback=storage.DEFAULT_WRITE_FLUSH_SECONDS
+        )
+        COMPACTION_INTERVAL = config.getint("retention", "compaction_interval_seconds", fallback=300)
+        for table, option in (
+            ("ups_data", "raw_days"),
+            ("ups_rollup_1m", "minute_rollup_days"),
+            ("ups_rollup_1h", "hour_rollup_days"),
+            ("ups_rollup_1d", "day_rollup_days"),
+        ):
+            storage.RETENTION_DAYS[table] = config.getint("retention", option, fallback=storage.RETENTION_DAYS[table])
         ubiquiti_hosts_str = config.get("ubiquiti", "hosts")
         ubiquiti_username = config.get("ubiquiti", "username")
         ubiquiti_password = config.get("ubiquiti", "password", fallback=None)
         ubiquiti_ssh_key_path = config.get("ubiquiti", "ssh_key_path", fallback=None)
+        SHUTDOWN_DEADLINE = config.getfloat("ubiquiti", "shutdown_deadline_seconds", fallback=30.0)
+        SSH_PREARM = config.getboolean("ubiquiti", "prearm_on_battery", fallback=False)
+        SSH_PERSISTENT = config.getboolean("ubiquiti", "persistent_sessions", fallback=False)
+        SSH_HEALTH_CHECK_INTERVAL = config.getfloat("ubiquiti", "health_check_interval_seconds", fallback=60.0)
     except (configparser.NoSectionError, configparser.NoOptionError) as e:
         logger.error(f"Error in configuration file: {e}")
         sys.exit(1) # Keep sys.exit for direct execution, tests will mock this.
+    if OVERRUN_POLICY not in OVERRUN_POLICIES:
+        logger.error(f"Error in configuration file: overrun_policy must be one of {', '.join(OVERRUN_POLICIES)}")
+        sys.exit(1)
+
+    # Hold each stored value until the next one is due at the latest, so history fills the gaps step-wise
+    storage.HOLD_SECONDS = (
+        int(STORE_HEARTBEAT_SECONDS + max(target.interval for target in UPS_TARGETS)) if STORE_ON_CHANGE else 0
+    )
+
+    NIS_CLIENTS.clear()
+    for target in UPS_TARGETS:
+        NIS_CLIENTS[target.ups_id] = NISClient(target.host, target.port, target.timeout, target.timeout)
+    configure_caches(
+        {ups_id: make_fetcher(client, ups_id) for ups_id, client in NIS_CLIENTS.items()},
+        status_cache_ttl,
+    )
 
     # Create UBIQUITI_DEVICES list from config
     UBIQUITI_DEVICES.clear() # Clear existing list for re-runs in tests
@@ -99,26 +303,14 @@ def _load_configuration() -> None:
                     **auth_method,
                 })
 
+    device_pool.configure(UBIQUITI_DEVICES)
+
 # Database setup
 def setup_database() -> None:
-    """Sets up the SQLite database for storing UPS data. Creates the table if it doesn't exist."""
+    """Sets up the SQLite database for storing UPS data. Creates missing tables and migrates older databases."""
     try:
         conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS ups_data (
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT,
-                bcharge REAL,
-                loadpct REAL,
-                timeleft REAL,
-                linev REAL,
-                battv REAL
-            )
-            """
-        )
-        conn.commit()
+        storage.migrate(conn)
         conn.close()
         logger.info("Database setup complete.")
     except sqlite3.Error as e:
@@ -127,94 +319,391 @@ def setup_database() -> None:
 
 
 # Ubiquiti shutdown
+def prearm_ubiquiti_sessions() -> None:
+    """Opens and authenticates SSH sessions to every device ahead of a possible shutdown."""
+    device_pool.connect_all()
+
+
+def release_prearmed_sessions() -> None:
+    """Closes pre-armed SSH sessions once line power is restored, unless they are kept persistently."""
+    if not SSH_PERSISTENT:
+        device_pool.close_all()
+
+
+def _shutdown_ubiquiti_device(device: dict) -> None:
+    """Sends poweroff to one device, reusing its pooled session when it is still alive."""
+    if not (device.get("password") or device.get("key_filename")):
+        # Same check as _load_configuration(), for devices added to UBIQUITI_DEVICES some other way
+        logger.warning(f"No SSH key or password provided for {device['host']}. Skipping.")
+        return
+    ssh = device_pool.take(device["host"])
+    try:
+        if ssh is None:
+            logger.info(f"Connecting to {device['host']} for shutdown...")
+            ssh = connect_device(device)
+        logger.info(f"Sending shutdown command to {device['host']}")
+        with ssh_poweroff_seconds.time(host=device["host"]):
+            ssh.exec_command("poweroff")
+        ssh.close()
+        logger.info(f"Successfully shut down {device['host']}")
+    except paramiko.AuthenticationException:
+        logger.error(f"Authentication failed for {device['host']}. Please check your credentials in config.ini.")
+    except Exception as e:
+        logger.error(f"Error shutting down {device['host']}: {e}")
+
+
 def shutdown_ubiquiti_devices() -> None:
-    """Shuts down configured Ubiquiti devices via SSH."""
+    """Shuts down configured Ubiquiti devices via SSH, all in parallel within SHUTDOWN_DEADLINE seconds."""
     if not UBIQUITI_DEVICES:
         logger.info("No Ubiquiti devices configured for shutdown.")
         return
 
-    for device in UBIQUITI_DEVICES:
-        try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            logger.info(f"Connecting to {device['host']} for shutdown...")
-            ssh.connect(
-                device["host"],
-                username=device["username"],
-                password=device.get("password"),
-                key_filename=device.get("key_filename"),
-                timeout=10,
-            )
-            logger.info(f"Sending shutdown command to {device['host']}")
-            ssh.exec_command("poweroff")
-            ssh.close()
-            logger.info(f"Successfully shut down {device['host']}")
-        except paramiko.AuthenticationException:
-            logger.error(f"Authentication failed for {device['host']}. Please check your credentials in config.ini.")
-        except Exception as e:
-            logger.error(f"Error shutting down {device['host']}: {e}")
+    executor = ThreadPoolExecutor(max_workers=len(UBIQUITI_DEVICES))
+    futures = {executor.submit(_shutdown_ubiquiti_device, device): device for device in UBIQUITI_DEVICES}
+    _, pending = wait(futures, timeout=SHUTDOWN_DEADLINE)
+    for future in pending:
+        logger.error(f"Shutdown of {futures[future]['host']} did not finish within {SHUTDOWN_DEADLINE}s. Giving up.")
+    # Don't let an unreachable device hold up the local shutdown
+    executor.shutdown(wait=False, cancel_futures=True)
 
 
 # Monitoring loop
-def monitor_ups() -> None:
-    """Monitors the UPS status, logs data, and initiates shutdown if necessary."""
+def _describe(target: UPSTarget) -> str:
+    """Returns " <id>" to name a UPS in log messages, or "" when only the default UPS is monitored."""
+    return "" if target.ups_id == DEFAULT_UPS_ID else f" {target.ups_id}"
+
+
+def _shutdown_budget() -> float:
+    """Returns the seconds a shutdown takes: reaching every device, as measured on its SSH session, then powering off."""
+    reach = 0.0
+    for device in device_pool.health():
+        latency_ms = device["probe_latency_ms"] if device["connected"] else device["connect_latency_ms"]
+        # A device never reached yet may take up to the whole deadline
+        reach = max(reach, SHUTDOWN_DEADLINE if latency_ms is None else latency_ms / 1000)
+    return reach + SHUTDOWN_DURATION
+
+
+def _should_shut_down(target: UPSTarget, sample: UPSSample, predictor: RuntimePredictor | None) -> bool:
+    """Returns whether an on-battery sample calls for the shutdown sequence under the target's policy.
+
+    With a trusted runtime prediction, shutdown starts once waiting for the next
+    poll would leave less runtime than the shutdown takes; otherwise, at the
+    charge threshold.
+    """
+    runtime = predictor.time_to_empty(sample) if predictor is not None else None
+    if runtime is None:
+        return sample.bcharge is not None and sample.bcharge < target.shutdown_threshold
+    spare = runtime * (1 - PREDICTION_SAFETY_MARGIN) - _shutdown_budget()
+    logger.debug(f"UPS{_describe(target)} predicted runtime {runtime:.0f}s, {spare:.0f}s to spare.")
+    return spare <= (target.fast_interval or target.interval) or UPSStatus.LOWBATT in sample.status
+
+
+async def poll_ups(target: UPSTarget, scheduled: float | None = None) -> UPSSample:
+    """Polls one UPS for the poll scheduled at `scheduled` and feeds the sample into the shared cache read by the UIs."""
+    client = NIS_CLIENTS.get(target.ups_id)
+    if client is None:
+        client = NIS_CLIENTS[target.ups_id] = NISClient(target.host, target.port, target.timeout, target.timeout)
+    try:
+        with nis_poll_seconds.time(ups=target.ups_id):
+            sample = await client.sample(target.ups_id, scheduled)
+    except Exception:
+        nis_poll_errors.inc(ups=target.ups_id)
+        raise
+    status_caches[target.ups_id].update(sample)
+    return sample
+
+
+def _broadcast(sample: UPSSample) -> None:
+    """Hands a sample to the /api/stream subscribers."""
+    sample_broadcaster.publish({
+        "timestamp": time.strftime(storage.API_TIME_FORMAT, time.gmtime(sample.timestamp)),
+        "ups_id": sample.ups_id,
+        **sample.to_dict(include_raw=False),
+    })
+
+
+def monitor_ups(status_writer: SharedStatusWriter | None = None, stop: threading.Event | None = None) -> None:
+    """Polls every configured UPS, logs data, and initiates shutdown if a UPS's policy calls for it.
+
+    When the loop runs in its own process, each sample is published through
+    status_writer for the web and menu bar app to read. Setting stop ends the
+    loop after writing the samples still buffered.
+    """
     setup_database()
     conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    storage.enable_wal(conn)
+    writer = storage.SampleWriter(conn, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL)
+    # Shutdown-relevant UPSes currently on battery
+    on_battery: set[str] = set()
+    targets = UPS_TARGETS or [UPSTarget(
+        interval=MONITOR_INTERVAL,
+        fast_interval=FAST_INTERVAL,
+        deadline=POLL_DEADLINE,
+        shutdown_threshold=SHUTDOWN_THRESHOLD,
+    )]
+    samplers = {
+        target.ups_id: AdaptiveSampler(
+            target.interval,
+            target.fast_interval,
+            rate_thresholds=RATE_THRESHOLDS,
+            fast_hold=FAST_HOLD_SECONDS,
+            store_on_change=STORE_ON_CHANGE,
+            heartbeat=STORE_HEARTBEAT_SECONDS,
+            deadbands=STORE_DEADBANDS,
+        )
+        for target in targets
+    }
+    predictors: dict[str, RuntimePredictor] = {}
+    if PREDICTION_ENABLED:
+        for target in targets:
+            if target.shutdown_threshold is None:
+                continue
+            predictor = predictors[target.ups_id] = RuntimePredictor(
+                PREDICTION_HISTORY_DECAY, PREDICTION_MIN_FIT_SECONDS, PREDICTION_CUTOFF_BATTV
+            )
+            try:
+                predictor.fit_history(*load_discharge_history(conn.cursor(), target.ups_id))
+            except sqlite3.Error as e:
+                logger.error(f"Database error while loading discharge history: {e}")
+    recorder = None
+    if EVENTS_ENABLED:
+        try:
+            recorder = EventRecorder(conn, EVENT_LINE_TOLERANCE, EVENT_NOMINAL_VOLTAGE, EVENT_NOMINAL_POWER)
+        except sqlite3.Error as e:
+            logger.error(f"Database error while setting up power event detection: {e}")
+    scheduler = PollScheduler(
+        targets,
+        poll_ups,
+        jitter=POLL_JITTER,
+        overrun=OVERRUN_POLICY,
+        max_catch_up=MAX_CATCH_UP,
+        align=ALIGN_POLLS,
+        stop=stop,
+    )
 
-    while True:
+    try:
+        for target, sample, error in scheduler.results():
+            try:
+                if error is not None:
+                    raise error
+                logger.debug(f"UPS Status: {sample}")
+                if status_writer is not None:
+                    status_writer.publish(sample)
+                sampler = samplers[target.ups_id]
+                scheduler.set_interval(target, sampler.observe(sample))
+                try:
+                    if sampler.should_store(sample):
+                        writer.add(sample)
+                except sqlite3.Error as e:
+                    # Keep monitoring; the shutdown check must not depend on the database
+                    logger.error(f"Database error in monitoring loop: {e}")
+                if recorder is not None:
+                    try:
+                        recorder.observe(sample)
+                    except sqlite3.Error as e:
+                        logger.error(f"Database error while recording power events: {e}")
+                _broadcast(sample)
+
+                if target.shutdown_threshold is None:
+                    continue
+                predictor = predictors.get(target.ups_id)
+                if predictor is not None:
+                    predictor.observe(sample)
+
+                # Open SSH sessions as soon as power is lost so a shutdown needs no handshake
+                if sample.on_battery and not on_battery and SSH_PREARM:
+                    threading.Thread(target=prearm_ubiquiti_sessions, daemon=True).start()
+                if sample.on_battery:
+                    on_battery.add(target.ups_id)
+                elif target.ups_id in on_battery:
+                    on_battery.discard(target.ups_id)
+                    if not on_battery:
+                        release_prearmed_sessions()
+
+                # Check for power loss and remaining runtime
+                if sample.on_battery and _should_shut_down(target, sample, predictor):
+                    logger.warning(
+                        f"UPS{_describe(target)} power lost and battery threshold reached. Initiating shutdown sequence..."
+                    )
+                    shutdown_ubiquiti_devices()
+                    logger.info("Shutting down local machine...")
+                    # Uncomment the following line to enable shutdown
+                    # subprocess.run(["shutdown", "-h", "now"])
+                    logger.info("Shutdown sequence complete. Exiting.")
+                    sys.exit(MONITOR_SHUTDOWN_EXIT)
+
+            except Exception as e:
+                logger.error(f"Failed to get status from apcupsd{_describe(target)}. Is it running? Error: {e}")
+            except sqlite3.Error as e:
+                logger.error(f"Database error in monitoring loop: {e}")
+            except Exception as e:
+                logger.error(f"An unexpected error occurred in the monitoring loop: {e}")
+    finally:
+        scheduler.shutdown()
+        # Commit whatever is still buffered when the loop exits for any reason
         try:
-            raw_status = get()
-            status = parse(raw_status)
-            logger.debug(f"UPS Status: {status}")
-            cursor.execute(
-                "INSERT INTO ups_data (status, bcharge, loadpct, timeleft, linev, battv) VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    status["STATUS"],
-                    status["BCHARGE"],
-                    status["LOADPCT"],
-                    status["TIMELEFT"],
-                    status["LINEV"],
-                    status["BATTV"],
-                ),
-            )
-            conn.commit()
-
-            # Check for power loss and battery threshold
-            if status["STATUS"] == "ONBATT" and float(status["BCHARGE"]) < SHUTDOWN_THRESHOLD:
-                logger.warning("UPS power lost and battery threshold reached. Initiating shutdown sequence...")
-                shutdown_ubiquiti_devices()
-                logger.info("Shutting down local machine...")
-                # Uncomment the following line to enable shutdown
-                # subprocess.run(["shutdown", "-h", "now"])
-                logger.info("Shutdown sequence complete. Exiting.")
-                sys.exit(0)
-
-        except Exception as e:
-            logger.error("Failed to get status from apcupsd. Is it running? Error: %s" % e)
+            writer.flush()
         except sqlite3.Error as e:
-            logger.error(f"Database error in monitoring loop: {e}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred in the monitoring loop: {e}")
+            logger.error(f"Database error while flushing samples: {e}")
 
-        time.sleep(MONITOR_INTERVAL)
+# Rollup compaction loop
+def compact_database() -> None:
+    """Periodically rolls raw samples up into the rollup tiers and prunes expired data."""
+    conn = sqlite3.connect(DATABASE_FILE)
+    storage.enable_wal(conn)
 
-def main() -> None:
+    while True:
+        time.sleep(COMPACTION_INTERVAL)
+        try:
+            # Leave buckets open until every UPS's buffered samples have been written
+            storage.compact(conn, settle=int(WRITE_FLUSH_INTERVAL + max(
+                (target.interval for target in UPS_TARGETS), default=MONITOR_INTERVAL
+            )))
+            logger.debug("Database compaction complete.")
+        except sqlite3.Error as e:
+            logger.error(f"Database error during compaction: {e}")
+
+# Out-of-process monitoring
+def _run_monitor_process(status_file: Path) -> None:
+    """Entry point of the monitor process: runs the monitor loop, publishing every sample to status_file."""
+    # The parent decides when to stop and sends SIGTERM; exit cleanly on it so buffered samples are written
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    _load_configuration()
+    # Sessions for the shutdown sequence live where it runs
+    if SSH_PERSISTENT:
+        device_pool.start(SSH_HEALTH_CHECK_INTERVAL)
+    status_writer = SharedStatusWriter(status_file)
+    try:
+        monitor_ups(status_writer)
+    finally:
+        status_writer.close()
+
+def _supervise_monitor(stop: threading.Event) -> None:
+    """Runs the monitor process until stop is set, restarting it whenever it exits.
+
+    It is only left stopped once it exits with MONITOR_SHUTDOWN_EXIT, after the
+    shutdown sequence. Any other exit, including a clean one on a SIGTERM that
+    this process did not send, gets it restarted.
+    """
+    # Spawned rather than forked, since this process already runs threads
+    context = multiprocessing.get_context("spawn")
+    while True:
+        process = context.Process(target=_run_monitor_process, args=(STATUS_FILE,), name="apcmagic-monitor", daemon=True)
+        process.start()
+        logger.info(f"Monitor process {process.pid} started.")
+        while process.is_alive():
+            if stop.wait(1):
+                process.terminate()
+                process.join(MONITOR_STOP_TIMEOUT)
+                if process.is_alive():
+                    process.kill()
+                return
+        if process.exitcode == MONITOR_SHUTDOWN_EXIT:
+            logger.info("Monitor process exited after the shutdown sequence.")
+            return
+        logger.error(f"Monitor process exited with code {process.exitcode}; restarting in {MONITOR_RESTART_DELAY}s.")
+        if stop.wait(MONITOR_RESTART_DELAY):
+            return
+
+def _on_published_sample(sample: UPSSample) -> None:
+    """Feeds a sample published by the monitor process to this process's status caches and stream."""
+    cache = status_caches.get(sample.ups_id)
+    if cache is not None:
+        cache.update(sample)
+    _broadcast(sample)
+
+def _follow_monitor() -> SharedStatusFollower:
+    """Serves status reads from the samples the monitor process publishes instead of polling apcupsd."""
+    # Created up front so the UIs can attach before the monitor process publishes its first sample, and emptied
+    # so samples left by an earlier run are never served as current
+    initialize_status_file(STATUS_FILE, reset=True)
+    reader = SharedStatusReader(STATUS_FILE)
+    for target in UPS_TARGETS:
+        status_caches[target.ups_id].fetcher = reader.fetcher(target.ups_id, STALE_AFTER_INTERVALS * target.interval)
+    follower = SharedStatusFollower(reader, _on_published_sample)
+    follower.start()
+    return follower
+
+def _start_web_server() -> "WebServer":
+    """Imports the web stack and serves the dashboard from a background thread."""
+    from web_app import app as flask_app
+    from web_app import configure_streams
+    from web_server import DEFAULT_THREADS, WebServer
+
+    # Leave at least half the workers for API requests by default
+    configure_streams(WEB_MAX_STREAMS or max(1, WEB_OPTIONS.get("threads", DEFAULT_THREADS) // 2))
+    web_server = WebServer(flask_app, **WEB_OPTIONS)
+    web_server.start()
+    return web_server
+
+def _wait_for_signal() -> None:
+    """Blocks until SIGTERM or SIGINT is received."""
+    stop = threading.Event()
+    def handle(signum: int, frame) -> None:
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down.")
+        stop.set()
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+    stop.wait()
+
+def main(argv: list[str] | None = None) -> None:
     """Main function to start the monitoring, web, and rumps applications."""
+    parser = argparse.ArgumentParser(prog="apcmagic", description="Monitors APC UPSes and shuts down devices on low battery.")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run without the menu bar app (e.g. as a daemon on Linux) until SIGTERM or Ctrl-C",
+    )
+    args = parser.parse_args(argv)
     _load_configuration()
 
-    # Start the monitoring loop in a separate thread
-    monitor_thread = threading.Thread(target=monitor_ups)
+    if not args.headless:
+        try:
+            from rumps_app import APCApp
+        except ImportError as e:
+            logger.error(f"The menu bar app is unavailable ({e}); run with --headless on systems without rumps.")
+            sys.exit(1)
+
+    # Start the monitoring loop in a separate thread, or in its own process so UI load can't delay a shutdown
+    stop_monitor = threading.Event()
+    if MONITOR_PROCESS:
+        # SSH sessions live in the monitor process, so this one has no device health to report
+        device_pool.configure([])
+        follower = _follow_monitor()
+        monitor_thread = threading.Thread(target=_supervise_monitor, args=(stop_monitor,))
+    else:
+        follower = None
+        monitor_thread = threading.Thread(target=monitor_ups, kwargs={"stop": stop_monitor})
     monitor_thread.daemon = True
     monitor_thread.start()
 
-    # Start the Flask app in a separate thread
-    flask_thread = threading.Thread(target=lambda: flask_app.run(debug=True, use_reloader=False))
-    flask_thread.daemon = True
-    flask_thread.start()
+    # Keep SSH sessions to the managed devices open and health-checked
+    if SSH_PERSISTENT and not MONITOR_PROCESS:
+        device_pool.start(SSH_HEALTH_CHECK_INTERVAL)
+
+    # Start the rollup compaction job in a separate thread
+    compaction_thread = threading.Thread(target=compact_database)
+    compaction_thread.daemon = True
+    compaction_thread.start()
 
-    # Start the rumps app
-    APCApp().run()
+    web_server = _start_web_server() if WEB_ENABLED else None
+
+    # Run until the menu bar app quits or, headless, until told to stop; then let in-flight web requests finish
+    try:
+        if args.headless:
+            logger.info("Running headless.")
+            _wait_for_signal()
+        else:
+            APCApp().run()
+    finally:
+        if web_server is not None:
+            web_server.stop()
+        # Let the monitor write the samples it still buffers; the supervisor bounds how long its process takes
+        stop_monitor.set()
+        monitor_thread.join(None if MONITOR_PROCESS else MONITOR_STOP_TIMEOUT)
+        if follower is not None:
+            follower.stop()
 
 if __name__ == "__main__":
     main()
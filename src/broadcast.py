@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger("apcmagic")
+
+# Samples buffered per subscriber before the oldest are dropped for a slow client
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class SampleBroadcaster:
+    """Fans out each sample recorded by the monitor loop to every subscriber.
+
+    Each subscriber gets its own bounded queue, so a stalled client only ever
+    loses its own oldest samples and never blocks the monitor loop.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers: set[queue.Queue] = set()
+        self._latest: dict | None = None
+        self._latest_by_ups: dict[str | None, dict] = {}
+
+    @property
+    def latest(self) -> dict | None:
+        """The most recently published sample, if any."""
+        return self._latest
+
+    @property
+    def latest_by_ups(self) -> list[dict]:
+        """The most recently published sample of each UPS."""
+        with self._lock:
+            return list(self._latest_by_ups.values())
+
+    def subscribe(self) -> queue.Queue:
+        """Registers a new subscriber and returns the queue it should read from."""
+        subscription: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: queue.Queue) -> None:
+        """Removes a subscriber previously returned by subscribe()."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, sample: dict) -> None:
+        """Delivers a sample to all current subscribers without blocking."""
+        with self._lock:
+            self._latest = sample
+            self._latest_by_ups[sample.get("ups_id")] = sample
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            self._deliver(subscription, sample)
+
+    def clear(self) -> None:
+        """Forgets the latest samples, so new subscribers are not sent them."""
+        with self._lock:
+            self._latest = None
+            self._latest_by_ups.clear()
+
+    def disconnect_all(self) -> None:
+        """Tells every current subscriber to stop by delivering None, e.g. so the web server can drain."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            self._deliver(subscription, None)
+
+    @staticmethod
+    def _deliver(subscription: queue.Queue, item: dict | None) -> None:
+        while True:
+            try:
+                subscription.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    subscription.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+# Process-wide broadcaster fed by monitor_ups() and read by /api/stream
+sample_broadcaster = SampleBroadcaster()
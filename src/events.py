@@ -0,0 +1,257 @@
+import logging
+import sqlite3
+from dataclasses import dataclass
+
+from sample import DEFAULT_UPS_ID, UPSSample, UPSStatus
+
+logger = logging.getLogger("apcmagic")
+
+# Kinds of power event; each is the span of consecutive samples in that condition
+EVENT_ONBATT = "onbatt"
+EVENT_LOWBATT = "lowbatt"
+EVENT_OVERLOAD = "overload"
+EVENT_SAG = "sag"
+EVENT_SWELL = "swell"
+EVENT_KINDS = (EVENT_ONBATT, EVENT_LOWBATT, EVENT_OVERLOAD, EVENT_SAG, EVENT_SWELL)
+# Status flag that marks each flag-based kind
+_EVENT_FLAGS = {
+    EVENT_ONBATT: UPSStatus.ONBATT,
+    EVENT_LOWBATT: UPSStatus.LOWBATT,
+    EVENT_OVERLOAD: UPSStatus.OVERLOAD,
+}
+# Fraction of the nominal input voltage the line may deviate by before it counts as a sag or swell
+DEFAULT_LINE_TOLERANCE = 0.1
+# Longest gap between two samples whose load is still integrated into an event's energy
+MAX_ENERGY_GAP_SECONDS = 300.0
+
+_EVENT_COLUMNS = "id, ups_id, kind, start_time, end_time, min_bcharge, min_linev, max_linev, max_loadpct, energy_wh"
+
+
+def _lower(current: float | None, value: float | None) -> float | None:
+    return value if current is None else current if value is None else min(current, value)
+
+
+def _higher(current: float | None, value: float | None) -> float | None:
+    return value if current is None else current if value is None else max(current, value)
+
+
+@dataclass(slots=True)
+class PowerEvent:
+    """One outage, low-battery spell, overload or line sag/swell of a UPS, with its extremes and energy drawn."""
+
+    ups_id: str
+    kind: str
+    start_time: int
+    end_time: int | None = None
+    min_bcharge: float | None = None
+    min_linev: float | None = None
+    max_linev: float | None = None
+    max_loadpct: float | None = None
+    # Energy delivered to the load, if the UPS reports its nominal power
+    energy_wh: float | None = None
+    # Row id in power_events once stored
+    id: int | None = None
+
+    def add(self, sample: UPSSample) -> None:
+        """Folds a sample taken during the event into its extremes."""
+        self.min_bcharge = _lower(self.min_bcharge, sample.bcharge)
+        self.min_linev = _lower(self.min_linev, sample.linev)
+        self.max_linev = _higher(self.max_linev, sample.linev)
+        self.max_loadpct = _higher(self.max_loadpct, sample.loadpct)
+
+    def to_dict(self) -> dict:
+        """Returns the event as served by /api/events; duration is None while it is ongoing."""
+        return {
+            "id": self.id,
+            "ups_id": self.ups_id,
+            "kind": self.kind,
+            "start": self.start_time,
+            "end": self.end_time,
+            "duration": None if self.end_time is None else self.end_time - self.start_time,
+            "min_bcharge": self.min_bcharge,
+            "min_linev": self.min_linev,
+            "max_linev": self.max_linev,
+            "max_loadpct": self.max_loadpct,
+            "energy_wh": self.energy_wh,
+        }
+
+
+class EventDetector:
+    """Turns one UPS's samples into power events as they arrive.
+
+    ONBATT, LOWBATT and OVERLOAD events follow the status flags. Sags and
+    swells start when the line voltage is off the nominal input voltage by
+    more than line_tolerance while on line power (on battery, the outage is
+    the event) and end once it is back within half the tolerance. The nominal
+    voltage and output power default to what apcupsd reports (NOMINV,
+    NOMPOWER); without a nominal power, energy is not tracked.
+    """
+
+    def __init__(
+        self,
+        line_tolerance: float = DEFAULT_LINE_TOLERANCE,
+        nominal_voltage: float | None = None,
+        nominal_power: float | None = None,
+    ) -> None:
+        self.line_tolerance = line_tolerance
+        self.nominal_voltage = nominal_voltage
+        self.nominal_power = nominal_power
+        self.open: dict[str, PowerEvent] = {}
+        self._previous: UPSSample | None = None
+
+    def _kinds(self, sample: UPSSample) -> set[str]:
+        kinds = {kind for kind, flag in _EVENT_FLAGS.items() if flag in sample.status}
+        nominal = self.nominal_voltage or sample.number("NOMINV")
+        if nominal and sample.linev is not None and not sample.on_battery:
+            # Once started, a sag or swell lasts until the line is back within half the tolerance,
+            # so a voltage hovering at the limit does not record a burst of tiny events
+            sag = self.line_tolerance / 2 if EVENT_SAG in self.open else self.line_tolerance
+            swell = self.line_tolerance / 2 if EVENT_SWELL in self.open else self.line_tolerance
+            if sample.linev < nominal * (1 - sag):
+                kinds.add(EVENT_SAG)
+            elif sample.linev > nominal * (1 + swell):
+                kinds.add(EVENT_SWELL)
+        return kinds
+
+    def observe(self, sample: UPSSample) -> tuple[list[PowerEvent], list[PowerEvent]]:
+        """Returns the events (started, ended) by a new sample; open events are updated in place."""
+        previous, self._previous = self._previous, sample
+        if previous is not None and self.open:
+            # The load between two samples counts towards every event open at the first
+            dt = sample.monotonic - previous.monotonic
+            power = self.nominal_power or sample.number("NOMPOWER")
+            if power and 0 < dt <= MAX_ENERGY_GAP_SECONDS and None not in (previous.loadpct, sample.loadpct):
+                energy = (previous.loadpct + sample.loadpct) / 200 * power * dt / 3600
+                for event in self.open.values():
+                    event.energy_wh = (event.energy_wh or 0.0) + energy
+
+        kinds = self._kinds(sample)
+        timestamp = int(sample.timestamp)
+        ended = [self.open.pop(kind) for kind in list(self.open) if kind not in kinds]
+        for event in ended:
+            event.end_time = timestamp
+        started = []
+        for kind in kinds:
+            if kind not in self.open:
+                event = self.open[kind] = PowerEvent(sample.ups_id, kind, timestamp)
+                started.append(event)
+            self.open[kind].add(sample)
+        return started, ended
+
+
+class EventRecorder:
+    """Detects the power events of every UPS inline with monitoring and keeps power_events up to date.
+
+    An event's row is inserted when it starts and completed when it ends, so
+    an outage shows up in /api/events while it is still going on. Rows left
+    open by a previous run are closed from the stored samples on startup.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        line_tolerance: float = DEFAULT_LINE_TOLERANCE,
+        nominal_voltage: float | None = None,
+        nominal_power: float | None = None,
+    ) -> None:
+        self._conn = conn
+        self._detectors: dict[str, EventDetector] = {}
+        self._options = (line_tolerance, nominal_voltage, nominal_power)
+        closed = close_interrupted_events(conn)
+        if closed:
+            logger.info(f"Closed {closed} power event(s) left open by the previous run.")
+
+    def observe(self, sample: UPSSample) -> None:
+        """Feeds a sample to its UPS's detector and stores any event it starts or ends."""
+        detector = self._detectors.get(sample.ups_id)
+        if detector is None:
+            detector = self._detectors[sample.ups_id] = EventDetector(*self._options)
+        started, ended = detector.observe(sample)
+        if not started and not ended:
+            return
+        try:
+            for event in started:
+                event.id = self._conn.execute(
+                    "INSERT INTO power_events (ups_id, kind, start_time) VALUES (?, ?, ?)",
+                    (event.ups_id, event.kind, event.start_time),
+                ).lastrowid
+                logger.info(f"Power event started on UPS '{event.ups_id}': {event.kind}.")
+            for event in ended:
+                if event.id is None:
+                    continue
+                self._conn.execute(
+                    "UPDATE power_events SET end_time = ?, min_bcharge = ?, min_linev = ?, max_linev = ?, "
+                    "max_loadpct = ?, energy_wh = ? WHERE id = ?",
+                    (event.end_time, event.min_bcharge, event.min_linev, event.max_linev,
+                     event.max_loadpct, event.energy_wh, event.id),
+                )
+                logger.info(
+                    f"Power event ended on UPS '{event.ups_id}': {event.kind} "
+                    f"lasted {event.end_time - event.start_time}s."
+                )
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+
+
+def close_interrupted_events(conn: sqlite3.Connection) -> int:
+    """Ends events left open by a previous run at their UPS's last stored sample, with extremes from ups_data.
+
+    Returns the number of events closed. Energy is left unknown.
+    """
+    closed = conn.execute("SELECT id, ups_id, start_time FROM power_events WHERE end_time IS NULL").fetchall()
+    for event_id, ups_id, start in closed:
+        conn.execute(
+            """
+            UPDATE power_events SET (end_time, min_bcharge, min_linev, max_linev, max_loadpct) = (
+                SELECT COALESCE(MAX(timestamp), ?), MIN(bcharge), MIN(linev), MAX(linev), MAX(loadpct)
+                FROM ups_data WHERE ups_id = ? AND timestamp >= ?
+            ) WHERE id = ?
+            """,
+            (start, ups_id, start, event_id),
+        )
+    conn.commit()
+    return len(closed)
+
+
+def query_events(
+    cursor: sqlite3.Cursor,
+    start: int,
+    end: int,
+    ups_id: str = DEFAULT_UPS_ID,
+    kind: str | None = None,
+    limit: int | None = None,
+) -> list[PowerEvent]:
+    """Returns a UPS's events that started between start and end (inclusive), newest first."""
+    query = f"SELECT {_EVENT_COLUMNS} FROM power_events WHERE ups_id = ? AND start_time BETWEEN ? AND ?"
+    params: tuple = (ups_id, start, end)
+    if kind is not None:
+        query += " AND kind = ?"
+        params += (kind,)
+    query += " ORDER BY start_time DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    return [_event(row) for row in cursor.execute(query, params)]
+
+
+def _event(row: tuple) -> PowerEvent:
+    event_id, ups_id, kind, start, end, min_bcharge, min_linev, max_linev, max_loadpct, energy_wh = row
+    return PowerEvent(ups_id, kind, start, end, min_bcharge, min_linev, max_linev, max_loadpct, energy_wh, event_id)
+
+
+def event_summary(cursor: sqlite3.Cursor, start: int, end: int, ups_id: str = DEFAULT_UPS_ID) -> dict[str, dict]:
+    """Returns the count, total seconds and energy of a UPS's events that started between start and end, by kind.
+
+    Ongoing events count as lasting until `end`.
+    """
+    rows = cursor.execute(
+        """
+        SELECT kind, COUNT(*), SUM(MIN(COALESCE(end_time, ?), ?) - start_time), SUM(energy_wh)
+        FROM power_events WHERE ups_id = ? AND start_time BETWEEN ? AND ?
+        GROUP BY kind
+        """,
+        (end, end, ups_id, start, end),
+    )
+    return {kind: {"count": count, "seconds": seconds, "energy_wh": energy} for kind, count, seconds, energy in rows}
@@ -0,0 +1,133 @@
+import csv
+import io
+import struct
+import time
+import zlib
+from typing import BinaryIO, Iterable, Iterator
+
+import numpy as np
+
+from storage import METRICS
+
+# Columns of an export, matching the rows of storage.iter_samples(); both formats
+# are encoded one batch at a time, so exports of any length stream in constant memory
+EXPORT_COLUMNS = ("timestamp", "ups_id", "status") + METRICS
+
+# Leading bytes, version and media type of the columnar format (see columnar_chunks())
+COLUMNAR_MAGIC = b"APCX"
+COLUMNAR_VERSION = 1
+COLUMNAR_MIMETYPE = "application/vnd.apcmagic.columnar"
+# Column encodings, and the encoding of each export column
+KIND_DELTA, KIND_FLOAT, KIND_STRING = 0, 1, 2
+COLUMN_KINDS = (KIND_DELTA, KIND_STRING, KIND_STRING) + (KIND_FLOAT,) * len(METRICS)
+# String index written for NULL
+NULL_CODE = 0xFFFF
+
+_U8_PAIR = struct.Struct("<BB")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
+def csv_chunks(batches: Iterable[list[tuple]]) -> Iterator[str]:
+    """Encodes row batches as CSV with a header line, times as UTC "YYYY-MM-DD HH:MM:SS"."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp)), *rest) for timestamp, *rest in rows
+        )
+        yield buffer.getvalue()
+
+
+def _encode_column(kind: int, values: tuple) -> bytes:
+    if kind == KIND_DELTA:
+        return np.diff(np.array(values, dtype="<i8"), prepend=0).astype("<i8").tobytes()
+    if kind == KIND_FLOAT:
+        return np.array(values, dtype="<f8").tobytes()
+    distinct = {value: i for i, value in enumerate(dict.fromkeys(v for v in values if v is not None))}
+    parts = [_U16.pack(len(distinct))]
+    for value in distinct:
+        encoded = value.encode("utf-8")
+        parts += (_U16.pack(len(encoded)), encoded)
+    parts.append(np.array([NULL_CODE if v is None else distinct[v] for v in values], dtype="<u2").tobytes())
+    return b"".join(parts)
+
+
+def columnar_chunks(batches: Iterable[list[tuple]]) -> Iterator[bytes]:
+    """Encodes row batches in the columnar format, one row group per batch.
+
+    Each column of a row group is zlib-compressed on its own. All integers
+    are little-endian:
+
+        header     b"APCX", u8 version, u8 column count, then per column
+                   u8 kind, u8 name length and the UTF-8 name
+        row group  u32 row count, then per column u32 length and the
+                   zlib-compressed column data
+        end        u32 0 (a row group of no rows)
+
+    Column data by kind: KIND_DELTA is int64, the first value followed by the
+    differences between consecutive values; KIND_FLOAT is float64, NaN for
+    NULL; KIND_STRING is a u16 count of distinct values, each a u16 length
+    and UTF-8 bytes, followed by a u16 index into them per row (NULL_CODE for
+    NULL). read_columnar() decodes it.
+    """
+    header = [COLUMNAR_MAGIC, _U8_PAIR.pack(COLUMNAR_VERSION, len(EXPORT_COLUMNS))]
+    for name, kind in zip(EXPORT_COLUMNS, COLUMN_KINDS):
+        header += (_U8_PAIR.pack(kind, len(name)), name.encode("utf-8"))
+    yield b"".join(header)
+    for rows in batches:
+        parts = [_U32.pack(len(rows))]
+        for kind, values in zip(COLUMN_KINDS, zip(*rows)):
+            payload = zlib.compress(_encode_column(kind, values))
+            parts += (_U32.pack(len(payload)), payload)
+        yield b"".join(parts)
+    yield _U32.pack(0)
+
+
+def _read(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated columnar export")
+    return data
+
+
+def _decode_column(kind: int, data: bytes, rows: int) -> np.ndarray | list:
+    if kind == KIND_DELTA:
+        return np.cumsum(np.frombuffer(data, dtype="<i8"))
+    if kind == KIND_FLOAT:
+        return np.frombuffer(data, dtype="<f8")
+    (count,), offset = _U16.unpack_from(data), _U16.size
+    distinct = []
+    for _ in range(count):
+        (length,) = _U16.unpack_from(data, offset)
+        offset += _U16.size
+        distinct.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    codes = np.frombuffer(data, dtype="<u2", count=rows, offset=offset)
+    return [None if code == NULL_CODE else distinct[code] for code in codes.tolist()]
+
+
+def read_columnar(stream: BinaryIO) -> Iterator[dict[str, np.ndarray | list]]:
+    """Decodes a columnar export, yielding each row group as a dict of column name to values."""
+    if _read(stream, len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar export")
+    version, count = _U8_PAIR.unpack(_read(stream, _U8_PAIR.size))
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar export version {version}")
+    columns = []
+    for _ in range(count):
+        kind, length = _U8_PAIR.unpack(_read(stream, _U8_PAIR.size))
+        columns.append((_read(stream, length).decode("utf-8"), kind))
+    while True:
+        (rows,) = _U32.unpack(_read(stream, _U32.size))
+        if rows == 0:
+            return
+        group = {}
+        for name, kind in columns:
+            (length,) = _U32.unpack(_read(stream, _U32.size))
+            group[name] = _decode_column(kind, zlib.decompress(_read(stream, length)), rows)
+        yield group
@@ -0,0 +1,82 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from flask import Request, Response
+
+# Serialized bodies kept by a BodyCache before the least recently used is evicted
+DEFAULT_BODY_CACHE_ENTRIES = 64
+# Responses smaller than this are sent uncompressed; gzip would gain little
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+def make_etag(key: Hashable) -> str:
+    """Returns a short ETag value derived from a cache key."""
+    return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+
+def accepts_gzip(request: Request) -> bool:
+    """Returns whether the client accepts gzip-encoded responses."""
+    return "gzip" in request.accept_encodings
+
+
+def compress(response: Response, request: Request) -> Response:
+    """Gzips a response in place if the client accepts it and it is worth compressing.
+
+    Streamed, already encoded, non-200 and small responses are left alone.
+    """
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or not accepts_gzip(request)
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+class BodyCache:
+    """Memoizes serialized response bodies, and their gzip encoding, by key.
+
+    Keys include everything the body depends on (for history, the query and
+    the version of the data), so an entry never goes stale; it is only
+    evicted once max_entries newer keys have been used. Concurrent misses on
+    one key may each build the body, which is harmless since the results are
+    identical.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_BODY_CACHE_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[bytes, bytes | None]] = OrderedDict()
+
+    def get(self, key: Hashable, build: Callable[[], bytes]) -> tuple[bytes, bytes | None]:
+        """Returns (body, gzipped body or None if too small to compress), building them on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        body = build()
+        entry = (body, gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        """Drops every cached body."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,216 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+# Media type of the Prometheus text exposition format served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Histogram bucket upper bounds in seconds, from sub-millisecond SQLite work to multi-second SSH handshakes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    """Base of every metric: a name, help text and label names, rendered under one # HELP/# TYPE header."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, object]) -> tuple:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple, float]]:
+        """Yields (suffix, label names, label values, value) for every line of the metric."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """A monotonically increasing count per label set."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        # A counter without labels is exported as 0 before its first increment
+        self._values: dict[tuple, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: object) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", self.labelnames, key, value
+
+
+class Histogram(_Metric):
+    """Counts observations into fixed buckets per label set, with their sum.
+
+    Observing costs a bisect and a few additions under a lock, so it is cheap
+    enough for every poll, write and request; buckets are only accumulated
+    when the metric is rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [observations per bucket (the last one past every bound), sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        """Observes the seconds the block takes, whether or not it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: object) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return 0 if series is None else sum(series[0])
+
+    def _samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple, float]]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        names = self.labelnames + ("le",)
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", names, key + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, key, total
+            yield "_count", self.labelnames, key, cumulative
+
+
+class GaugeCallback(_Metric):
+    """A gauge whose values are read from a callback when rendered, so it never holds stale label sets.
+
+    The callback returns (label values, value) pairs; pairs with a value of
+    None are left out.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str],
+        collect: Callable[[], Iterable[tuple[tuple, float | None]]],
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self._collect = collect
+
+    def _samples(self) -> Iterator[tuple[str, tuple[str, ...], tuple, float]]:
+        for key, value in self._collect():
+            if value is not None:
+                yield "", self.labelnames, key, value
+
+
+class Registry:
+    """The metrics served by /metrics, in registration order."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+registry = Registry()
+
+# Instrumentation of the hot paths, observed by the modules doing the work
+nis_poll_seconds = registry.register(Histogram(
+    "apcmagic_nis_poll_seconds", "Time to poll apcupsd's NIS for one sample, including failed polls.", ["ups"]
+))
+nis_poll_errors = registry.register(Counter(
+    "apcmagic_nis_poll_errors_total", "Polls of apcupsd that failed or timed out.", ["ups"]
+))
+poll_drift_seconds = registry.register(Histogram(
+    "apcmagic_poll_drift_seconds",
+    "How late each poll was dispatched after its scheduled time, jitter excluded.",
+    ["ups"],
+))
+polls_skipped = registry.register(Counter(
+    "apcmagic_polls_skipped_total",
+    "Scheduled polls skipped because the previous poll was still running or the loop fell behind.",
+    ["ups"],
+))
+poll_deadlines_exceeded = registry.register(Counter(
+    "apcmagic_poll_deadline_exceeded_total", "Polls cancelled for exceeding their hard deadline.", ["ups"]
+))
+db_write_seconds = registry.register(Histogram(
+    "apcmagic_db_write_seconds", "Time to insert a batch of samples into SQLite, and to commit it.", ["operation"]
+))
+samples_written = registry.register(Counter("apcmagic_samples_written_total", "Samples committed to SQLite."))
+history_seconds = registry.register(Histogram(
+    "apcmagic_history_seconds", "Time /api/history spends querying SQLite and serializing the result.", ["stage"]
+))
+ssh_connect_seconds = registry.register(Histogram(
+    "apcmagic_ssh_connect_seconds", "Time to open and authenticate an SSH session to a managed device.", ["host"]
+))
+ssh_poweroff_seconds = registry.register(Histogram(
+    "apcmagic_ssh_poweroff_seconds", "Time to send poweroff to a managed device over its SSH session.", ["host"]
+))
@@ -0,0 +1,165 @@
+import asyncio
+import concurrent.futures
+import logging
+import struct
+import threading
+from typing import Awaitable, TypeVar
+
+from sample import DEFAULT_UPS_ID, NUMERIC_FIELDS, UPSSample
+
+logger = logging.getLogger("apcmagic")
+
+T = TypeVar("T")
+
+# apcupsd's default Network Information Server port
+DEFAULT_NIS_PORT = 3551
+# Seconds allowed to open a connection, and to wait for each part of a response
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 5.0
+
+# Unit suffixes apcupsd appends to values, stripped from the numeric fields by parse_status()
+UNITS = ("Minutes", "Seconds", "Percent", "Volts", "Watts", "Amps", "Hz", "C", "VA", "Percent Load Capacity")
+
+# NIS messages are a big-endian 16-bit length followed by that many bytes; length 0 ends a response
+_LENGTH = struct.Struct(">H")
+
+
+class NISError(Exception):
+    """Raised when apcupsd sends something that is not a valid NIS response."""
+
+
+def parse_status(lines: list[str], strip_units: bool = True) -> dict[str, str]:
+    """Parses the "KEY : value" lines of a status response into a dict, in the order reported.
+
+    With strip_units, unit suffixes are removed from the numeric fields
+    UPSSample reads; free-text fields such as MODEL are kept verbatim.
+    """
+    status = {}
+    for line in lines:
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key, value = key.strip(), value.strip()
+        if strip_units and key in NUMERIC_FIELDS:
+            for unit in UNITS:
+                if value.endswith(f" {unit}"):
+                    value = value[:-len(unit) - 1]
+        status[key] = value
+    return status
+
+
+class NISClient:
+    """An asyncio client for the apcupsd Network Information Server.
+
+    The connection is kept open between polls, since apcupsd answers any
+    number of commands on one connection; if a reused connection turns out to
+    be closed the request is retried once on a fresh one. Connecting and every
+    read are bounded by timeouts, so a hung daemon fails the poll instead of
+    stalling it.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = DEFAULT_NIS_PORT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock: asyncio.Lock | None = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.connect_timeout
+        )
+
+    async def _read_exactly(self, size: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(size), self.read_timeout)
+
+    async def _request(self, command: str) -> list[str]:
+        payload = command.encode("ascii")
+        self._writer.write(_LENGTH.pack(len(payload)) + payload)
+        await self._writer.drain()
+        lines = []
+        while True:
+            (size,) = _LENGTH.unpack(await self._read_exactly(_LENGTH.size))
+            if size == 0:
+                return lines
+            lines.append((await self._read_exactly(size)).decode("ascii", "replace").rstrip("\n"))
+
+    async def fetch(self, command: str = "status") -> list[str]:
+        """Sends a command (by default "status") and returns the response lines."""
+        # Created here rather than in __init__ so the lock binds to the loop the client runs on
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            reused = self._writer is not None
+            if not reused:
+                await self._connect()
+            try:
+                return await self._request(command)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                await self.close()
+                if not reused:
+                    raise ConnectionError(f"apcupsd at {self.host}:{self.port} closed the connection") from e
+            except BaseException:
+                # A timed-out or cancelled request leaves the stream mid-response
+                await self.close()
+                raise
+            # apcupsd dropped the idle connection; retry once on a fresh one
+            await self._connect()
+            try:
+                return await self._request(command)
+            except BaseException:
+                await self.close()
+                raise
+
+    async def sample(self, ups_id: str = DEFAULT_UPS_ID, scheduled: float | None = None) -> UPSSample:
+        """Polls the daemon's status and returns it as a typed sample, stamped with when it was scheduled."""
+        return UPSSample.from_status(parse_status(await self.fetch()), ups_id=ups_id, scheduled=scheduled)
+
+    async def close(self) -> None:
+        """Closes the connection, if one is open."""
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+class BackgroundLoop:
+    """An asyncio event loop running in a daemon thread, shared by all NIS clients.
+
+    Threaded code hands coroutines to the loop with submit() or run(), so any
+    number of UPSes are polled from this one thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _ensure_running(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="nis-loop", daemon=True).start()
+            return self._loop
+
+    def submit(self, coro: Awaitable[T]) -> concurrent.futures.Future:
+        """Schedules a coroutine on the loop and returns a future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_running())
+
+    def run(self, coro: Awaitable[T], timeout: float | None = None) -> T:
+        """Runs a coroutine on the loop and blocks the calling thread until it finishes."""
+        return self.submit(coro).result(timeout)
+
+
+# Process-wide loop the NIS clients run on
+nis_loop = BackgroundLoop()
@@ -0,0 +1,188 @@
+import logging
+import sqlite3
+
+from lazy_import import lazy_import
+from sample import DEFAULT_UPS_ID, UPSSample
+
+# Loaded on first use, so startup only pays for NumPy when prediction is enabled
+np = lazy_import("numpy")
+
+logger = logging.getLogger("apcmagic")
+
+# Longest gap between two on-battery readings that are still paired as one stretch of discharge
+MAX_SEGMENT_SECONDS = 300.0
+# Weight earlier outages keep each time a new one starts, so the fit follows an ageing battery
+DEFAULT_HISTORY_DECAY = 0.8
+# Seconds of observed discharge needed before predictions are trusted
+DEFAULT_MIN_FIT_SECONDS = 300.0
+# Spread (standard deviation, %) of observed load needed to fit how drain grows with load;
+# with less, drain is taken as proportional to load
+MIN_LOAD_SPREAD = 5.0
+
+
+def discharge_sums(
+    t: "np.ndarray", load: "np.ndarray", level: "np.ndarray", weight: "np.ndarray | None" = None
+) -> "np.ndarray":
+    """Returns the least-squares sums of a drain-versus-load fit over a series of on-battery readings.
+
+    Each pair of consecutive readings no more than MAX_SEGMENT_SECONDS apart
+    is one segment, whose drain rate (fall of `level` per second) is weighted
+    by its duration and `weight` (of its second reading). The sums are
+    [Σdt, Σdt·L, Σdt·L², Σdrop, Σdrop·L] and can be added across series.
+    """
+    dt = np.diff(t)
+    drop = -np.diff(level)
+    mean_load = (load[1:] + load[:-1]) / 2
+    keep = (dt > 0) & (dt <= MAX_SEGMENT_SECONDS) & np.isfinite(drop) & np.isfinite(mean_load)
+    terms = np.stack((dt, dt * mean_load, dt * mean_load**2, drop, drop * mean_load))[:, keep]
+    return terms @ (np.ones(terms.shape[1]) if weight is None else weight[1:][keep])
+
+
+class DischargeModel:
+    """A fit of how fast one battery reading falls per second as a function of load.
+
+    Drain is modelled as a + b·load from the sums of discharge_sums(), which
+    are accumulated incrementally and refitted in constant time. If the
+    observed loads are too close together to separate a and b, drain is taken
+    as proportional to load.
+    """
+
+    def __init__(self) -> None:
+        self.sums = np.zeros(5)
+        self._coefficients: tuple[float, float] | None = None
+
+    @property
+    def seconds(self) -> float:
+        """The (decay-weighted) seconds of discharge the fit is based on."""
+        return float(self.sums[0])
+
+    def add(self, sums: "np.ndarray") -> None:
+        """Adds the sums of more discharge data and refits."""
+        self.sums += sums
+        self._refit()
+
+    def add_segment(self, dt: float, load: float, drop: float) -> None:
+        """Adds a single segment; the per-sample equivalent of add(discharge_sums(...)) without array overhead."""
+        if 0 < dt <= MAX_SEGMENT_SECONDS:
+            self.sums += (dt, dt * load, dt * load * load, drop, drop * load)
+            self._refit()
+
+    def decay(self, factor: float) -> None:
+        """Scales down the weight of everything seen so far."""
+        self.sums *= factor
+        self._refit()
+
+    def _refit(self) -> None:
+        s0, s1, s2, y0, y1 = self.sums.tolist()
+        # The determinant over s0² is the weighted variance of the observed load
+        det = s0 * s2 - s1 * s1
+        if s0 <= 0:
+            self._coefficients = None
+        elif det > (MIN_LOAD_SPREAD * s0) ** 2:
+            self._coefficients = ((s2 * y0 - s1 * y1) / det, (s0 * y1 - s1 * y0) / det)
+        elif s2 > 0:
+            self._coefficients = (0.0, y1 / s2)
+        else:
+            self._coefficients = (y0 / s0, 0.0)
+
+    def rate(self, load: float) -> float | None:
+        """Returns the predicted fall per second at a load, or None if the fit predicts none."""
+        if self._coefficients is None:
+            return None
+        a, b = self._coefficients
+        rate = a + b * load
+        return rate if rate > 0 else None
+
+
+def load_discharge_history(cursor: sqlite3.Cursor, ups_id: str = DEFAULT_UPS_ID) -> tuple["np.ndarray", ...]:
+    """Returns (t, loadpct, bcharge, battv) arrays of every on-battery reading stored for a UPS, oldest first.
+
+    Raw samples are used where they are kept; before that, minute rollups
+    spent entirely on battery fill in with their averages.
+    """
+    rows = cursor.execute(
+        """
+        SELECT bucket + 30, loadpct_avg, bcharge_avg, battv_avg FROM ups_rollup_1m
+        WHERE ups_id = ? AND status LIKE '%ONBATT%' AND status NOT LIKE '%ONLINE%'
+            AND bucket + 60 <= COALESCE((SELECT MIN(timestamp) FROM ups_data WHERE ups_id = ?), 1e18)
+        UNION ALL
+        SELECT timestamp, loadpct, bcharge, battv FROM ups_data
+        WHERE ups_id = ? AND status LIKE '%ONBATT%'
+        ORDER BY 1
+        """,
+        (ups_id, ups_id, ups_id),
+    ).fetchall()
+    columns = np.array(rows, dtype=float).reshape(-1, 4).T
+    return tuple(columns)
+
+
+class RuntimePredictor:
+    """Predicts how long one UPS can keep running on battery at its current load.
+
+    Two discharge models are fitted from every outage seen: battery charge
+    and, if a cutoff voltage is given, battery voltage. Past outages are read
+    from the database in one vectorized pass by fit_history(); the current one
+    is added by observe() at constant cost per sample. The time to empty is
+    the shorter of the two predictions. Each new outage scales the weight of
+    earlier ones by history_decay.
+    """
+
+    def __init__(
+        self,
+        history_decay: float = DEFAULT_HISTORY_DECAY,
+        min_fit_seconds: float = DEFAULT_MIN_FIT_SECONDS,
+        cutoff_battv: float | None = None,
+    ) -> None:
+        self.history_decay = history_decay
+        self.min_fit_seconds = min_fit_seconds
+        self.cutoff_battv = cutoff_battv
+        self.charge = DischargeModel()
+        self.voltage = DischargeModel()
+        self._previous: UPSSample | None = None
+
+    def fit_history(self, t: "np.ndarray", loadpct: "np.ndarray", bcharge: "np.ndarray", battv: "np.ndarray") -> None:
+        """Fits both models from stored on-battery readings, as returned by load_discharge_history()."""
+        if len(t) < 2:
+            return
+        # Readings further apart than a segment belong to different outages
+        outage = np.concatenate(([0], np.cumsum(np.diff(t) > MAX_SEGMENT_SECONDS)))
+        weight = self.history_decay ** (outage[-1] - outage)
+        self.charge.add(discharge_sums(t, loadpct, bcharge, weight))
+        self.voltage.add(discharge_sums(t, loadpct, battv, weight))
+        logger.info(
+            f"Fitted battery discharge from {outage[-1] + 1} stored outage(s) ({self.charge.seconds:.0f}s weighted)."
+        )
+
+    def observe(self, sample: UPSSample) -> None:
+        """Adds a new reading to the fit if it was taken on battery."""
+        previous = self._previous
+        if not sample.on_battery:
+            self._previous = None
+            return
+        self._previous = sample
+        if previous is None:
+            self.charge.decay(self.history_decay)
+            self.voltage.decay(self.history_decay)
+            return
+        if previous.loadpct is None or sample.loadpct is None:
+            return
+        dt = sample.monotonic - previous.monotonic
+        load = (previous.loadpct + sample.loadpct) / 2
+        if previous.bcharge is not None and sample.bcharge is not None:
+            self.charge.add_segment(dt, load, previous.bcharge - sample.bcharge)
+        if previous.battv is not None and sample.battv is not None:
+            self.voltage.add_segment(dt, load, previous.battv - sample.battv)
+
+    def time_to_empty(self, sample: UPSSample) -> float | None:
+        """Returns the predicted seconds of runtime left at the sample's load, or None without a trusted fit."""
+        if sample.loadpct is None or sample.bcharge is None or self.charge.seconds < self.min_fit_seconds:
+            return None
+        rate = self.charge.rate(sample.loadpct)
+        if rate is None:
+            return None
+        runtime = max(0.0, sample.bcharge / rate)
+        if self.cutoff_battv is not None and sample.battv is not None:
+            volt_rate = self.voltage.rate(sample.loadpct)
+            if volt_rate is not None:
+                runtime = min(runtime, max(0.0, (sample.battv - self.cutoff_battv) / volt_rate))
+        return runtime
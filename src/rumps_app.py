@@ -1,7 +1,8 @@
 import rumps
-from apcaccess.status import get, parse
 import logging
 
+from status_cache import status_caches
+
 logger = logging.getLogger("apcmagic")
 
 class APCApp(rumps.App):
@@ -13,19 +14,17 @@ class APCApp(rumps.App):
 
     @rumps.clicked("Status")
     def status(self, _) -> None:
-        """Displays the current UPS status in a rumps alert window."""
+        """Displays the current status of every monitored UPS in a rumps alert window."""
         try:
-            raw_status = get()
-            raw_status = get()
-            raw_status = get()
-            status = parse(raw_status)
-            rumps.alert(
-                title="APC UPS Status",
-                message=f"Status: {status['STATUS']}\n" \
-                        f"Battery: {status['BCHARGE']}%\n" \
-                        f"Load: {status['LOADPCT']}%\n" \
-                        f"Time Left: {status['TIMELEFT']}",
-            )
+            sections = []
+            for ups_id, cache in status_caches.items():
+                sample = cache.get()
+                message = f"Status: {sample.status}\n" \
+                          f"Battery: {sample.bcharge}%\n" \
+                          f"Load: {sample.loadpct}%\n" \
+                          f"Time Left: {sample.timeleft}"
+                sections.append(message if len(status_caches) == 1 else f"{ups_id}\n{message}")
+            rumps.alert(title="APC UPS Status", message="\n\n".join(sections))
         except Exception as e:
             rumps.alert(title="Error", message=str(e))
             logger.error(f"Error in rumps app status: {e}")
@@ -0,0 +1,107 @@
+import enum
+import time
+from dataclasses import dataclass, field
+
+# Identifier of the UPS monitored when no [ups:<id>] sections are configured
+DEFAULT_UPS_ID = "default"
+
+# apcupsd status fields parsed into UPSSample attributes
+NUMERIC_FIELDS = {
+    "BCHARGE": "bcharge",
+    "LOADPCT": "loadpct",
+    "TIMELEFT": "timeleft",
+    "LINEV": "linev",
+    "BATTV": "battv",
+}
+
+
+class UPSStatus(enum.Flag):
+    """The flags apcupsd reports in its STATUS field."""
+
+    NONE = 0
+    CAL = enum.auto()
+    TRIM = enum.auto()
+    BOOST = enum.auto()
+    ONLINE = enum.auto()
+    ONBATT = enum.auto()
+    OVERLOAD = enum.auto()
+    LOWBATT = enum.auto()
+    REPLACEBATT = enum.auto()
+    NOBATT = enum.auto()
+    SLAVE = enum.auto()
+    SLAVEDOWN = enum.auto()
+    COMMLOST = enum.auto()
+    SHUTTING_DOWN = enum.auto()
+
+    @classmethod
+    def parse(cls, text: str | None) -> "UPSStatus":
+        """Parses an apcupsd STATUS string such as "ONBATT LOWBATT"; unknown words are ignored."""
+        flags = cls.NONE
+        for word in (text or "").upper().replace("SHUTTING DOWN", "SHUTTING_DOWN").split():
+            flags |= cls.__members__.get(word, cls.NONE)
+        return flags
+
+    def __str__(self) -> str:
+        """Formats the flags the way apcupsd does, e.g. "ONBATT LOWBATT"."""
+        words = [flag.name.replace("_", " ") for flag in UPSStatus if flag and flag in self]
+        return " ".join(words)
+
+
+def _parse_number(value: str | None) -> float | None:
+    """Parses an apcupsd value such as "100.0 Percent" into a float, or None if absent."""
+    if not value:
+        return None
+    try:
+        return float(value.split()[0])
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class UPSSample:
+    """A single parsed UPS status poll, built once and shared by storage, shutdown logic and the APIs."""
+
+    status: UPSStatus
+    bcharge: float | None
+    loadpct: float | None
+    timeleft: float | None
+    linev: float | None
+    battv: float | None
+    # Which configured UPS the sample came from
+    ups_id: str = DEFAULT_UPS_ID
+    # Wall-clock Unix time of the poll, as stored in the database
+    timestamp: float = field(default_factory=time.time)
+    # time.monotonic() at the poll, for intervals that must not jump with the clock
+    monotonic: float = field(default_factory=time.monotonic)
+    # Wall-clock Unix time the poll was scheduled for, if it came from the poll scheduler
+    scheduled: float | None = None
+    # Every field apcupsd reported, as unparsed text
+    fields: dict = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_status(cls, status: dict, ups_id: str = DEFAULT_UPS_ID, scheduled: float | None = None) -> "UPSSample":
+        """Builds a sample from a dict returned by nis_client.parse_status()."""
+        return cls(
+            status=UPSStatus.parse(status.get("STATUS")),
+            ups_id=ups_id,
+            scheduled=scheduled,
+            fields=dict(status),
+            **{attr: _parse_number(status.get(key)) for key, attr in NUMERIC_FIELDS.items()},
+        )
+
+    def number(self, key: str) -> float | None:
+        """Parses any reported field as a number, e.g. "NOMPOWER" (nominal output watts); None if absent."""
+        return _parse_number(self.fields.get(key))
+
+    @property
+    def on_battery(self) -> bool:
+        """Whether the UPS is running from its battery."""
+        return UPSStatus.ONBATT in self.status
+
+    def to_dict(self, include_raw: bool = True) -> dict:
+        """Returns STATUS and the numeric fields in parsed form, plus every other reported field if include_raw."""
+        return {
+            **(self.fields if include_raw else {}),
+            "STATUS": str(self.status),
+            **{key: getattr(self, attr) for key, attr in NUMERIC_FIELDS.items()},
+        }
@@ -0,0 +1,105 @@
+import logging
+
+from sample import UPSSample
+
+logger = logging.getLogger("apcmagic")
+
+# Changes per minute that switch a UPS to its fast interval (overridden from config.ini)
+DEFAULT_RATE_THRESHOLDS = {
+    "loadpct": 5.0,
+    "linev": 5.0,
+    "bcharge": 1.0,
+}
+# Seconds a UPS keeps its fast interval after the last reading that called for it
+DEFAULT_FAST_HOLD_SECONDS = 120.0
+# Longest gap between stored samples of an unchanging UPS when storing on change
+DEFAULT_STORE_HEARTBEAT_SECONDS = 300.0
+
+# Metrics compared against their deadband when deciding whether a sample is a change
+STORED_METRICS = ("bcharge", "loadpct", "timeleft", "linev", "battv")
+
+
+class AdaptiveSampler:
+    """Decides how often one UPS is polled and which of its samples are stored.
+
+    A UPS is polled at its slow interval while it is on line power and its
+    readings are stable. It switches to its fast interval as soon as it goes on
+    battery or load, line voltage or charge moves faster than a threshold, and
+    stays there for fast_hold seconds after the last such reading. With
+    store_on_change, samples taken at the slow interval are only stored when
+    the status changed, a metric moved further than its deadband from the last
+    stored value, or heartbeat seconds have passed since the last stored one.
+    """
+
+    def __init__(
+        self,
+        slow_interval: float,
+        fast_interval: float | None = None,
+        rate_thresholds: dict[str, float] | None = None,
+        fast_hold: float = DEFAULT_FAST_HOLD_SECONDS,
+        store_on_change: bool = False,
+        heartbeat: float = DEFAULT_STORE_HEARTBEAT_SECONDS,
+        deadbands: dict[str, float] | None = None,
+    ) -> None:
+        self.slow_interval = slow_interval
+        self.fast_interval = fast_interval
+        self.rate_thresholds = DEFAULT_RATE_THRESHOLDS if rate_thresholds is None else rate_thresholds
+        self.fast_hold = fast_hold
+        self.store_on_change = store_on_change
+        self.heartbeat = heartbeat
+        # Largest change per metric that doesn't count as one; missing metrics must match exactly
+        self.deadbands = deadbands or {}
+        self.fast = False
+        self._previous: UPSSample | None = None
+        self._stored: UPSSample | None = None
+        self._fast_until = float("-inf")
+
+    def _changing_fast(self, sample: UPSSample) -> bool:
+        previous = self._previous
+        if previous is None or sample.monotonic <= previous.monotonic:
+            return False
+        minutes = (sample.monotonic - previous.monotonic) / 60
+        for metric, threshold in self.rate_thresholds.items():
+            now, before = getattr(sample, metric), getattr(previous, metric)
+            if now is not None and before is not None and abs(now - before) / minutes > threshold:
+                return True
+        return False
+
+    def observe(self, sample: UPSSample) -> float:
+        """Takes in a new sample and returns the number of seconds until the next poll."""
+        if self.fast_interval is not None and (sample.on_battery or self._changing_fast(sample)):
+            self._fast_until = sample.monotonic + self.fast_hold
+        self._previous = sample
+
+        fast = self.fast_interval is not None and sample.monotonic < self._fast_until
+        if fast != self.fast:
+            logger.info(
+                f"Polling UPS {sample.ups_id} every {self.fast_interval if fast else self.slow_interval}s."
+            )
+            self.fast = fast
+        return self.fast_interval if fast else self.slow_interval
+
+    def _changed(self, sample: UPSSample, stored: UPSSample) -> bool:
+        if sample.status != stored.status:
+            return True
+        for metric in STORED_METRICS:
+            now, before = getattr(sample, metric), getattr(stored, metric)
+            if (now is None) != (before is None):
+                return True
+            if now is not None and abs(now - before) > self.deadbands.get(metric, 0.0):
+                return True
+        return False
+
+    def should_store(self, sample: UPSSample) -> bool:
+        """Returns whether a sample passed to observe() should be written to the database."""
+        stored = self._stored
+        if (
+            not self.store_on_change
+            or stored is None
+            or self.fast
+            or self._changed(sample, stored)
+            or sample.monotonic - stored.monotonic >= self.heartbeat
+        ):
+            self._stored = sample
+            return True
+        return False
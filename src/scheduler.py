@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterator
+
+from metrics import poll_deadlines_exceeded, poll_drift_seconds, polls_skipped
+from nis_client import DEFAULT_NIS_PORT, BackgroundLoop, nis_loop
+from sample import DEFAULT_UPS_ID
+
+logger = logging.getLogger("apcmagic")
+
+# Seconds allowed to connect to a UPS's apcupsd, and for each read of a poll
+DEFAULT_POLL_TIMEOUT = 5.0
+# Seconds a whole poll may take, however slowly apcupsd trickles its response in
+DEFAULT_POLL_DEADLINE = 10.0
+# Random delay added to each poll, as a fraction of the target's interval
+DEFAULT_JITTER = 0.1
+# What happens to polls that come due while a target's previous poll is still running or the loop fell behind:
+# dropped until the next future slot, or made up back to back once the target is free
+OVERRUN_SKIP = "skip"
+OVERRUN_CATCH_UP = "catch_up"
+OVERRUN_POLICIES = (OVERRUN_SKIP, OVERRUN_CATCH_UP)
+# Overdue polls of one target made up back to back under OVERRUN_CATCH_UP; any further ones are skipped
+DEFAULT_MAX_CATCH_UP = 3
+
+
+@dataclass(frozen=True)
+class UPSTarget:
+    """One apcupsd daemon to poll, and the shutdown policy tied to it."""
+
+    ups_id: str = DEFAULT_UPS_ID
+    host: str = "localhost"
+    port: int = DEFAULT_NIS_PORT
+    interval: float = 1.0
+    # Interval used while the UPS is on battery or its readings change quickly; None polls at a fixed interval
+    fast_interval: float | None = None
+    timeout: float = DEFAULT_POLL_TIMEOUT
+    # Hard limit on a whole poll, after which it is cancelled and fails; None never cancels it
+    deadline: float | None = DEFAULT_POLL_DEADLINE
+    # Battery charge (%) below which an on-battery reading triggers shutdown; None only monitors
+    shutdown_threshold: float | None = None
+
+
+class PollScheduler:
+    """Polls every target on its own interval as coroutines on one event loop.
+
+    Each target's polls are due on a fixed grid of deadlines on the monotonic
+    clock, nominal + interval, so neither the time a poll takes nor the work
+    done with its result shifts later polls. With align, the grid sits on
+    wall-clock multiples of the interval (after an immediate first poll), so
+    samples from several machines and restarts line up.
+
+    Targets start staggered across their interval and each poll is delayed by
+    a random jitter, so daemons are not all hit at once. Polls run concurrently
+    on the background loop while results are handed back to the caller's
+    thread, which keeps storage and shutdown decisions single-threaded. A poll
+    exceeding its target's deadline is cancelled and yields a TimeoutError.
+
+    A poll that comes due while the target's previous one is still running,
+    or after the loop fell whole intervals behind, is an overrun: with
+    OVERRUN_SKIP it is dropped and the next future slot is used; with
+    OVERRUN_CATCH_UP up to max_catch_up overdue polls are made up back to back
+    as soon as the target is free. Either way a slow or dead daemon only ever
+    delays itself. The caller can change a target's interval between results
+    with set_interval().
+
+    The poll coroutine is called with the target and the wall-clock time the
+    poll was scheduled for (its grid slot, before jitter).
+    """
+
+    def __init__(
+        self,
+        targets: list[UPSTarget],
+        poll: Callable[[UPSTarget, float], Awaitable],
+        jitter: float = DEFAULT_JITTER,
+        loop: BackgroundLoop = nis_loop,
+        overrun: str = OVERRUN_SKIP,
+        max_catch_up: int = DEFAULT_MAX_CATCH_UP,
+        align: bool = False,
+        stop: threading.Event | None = None,
+    ) -> None:
+        if not targets:
+            raise ValueError("PollScheduler needs at least one target")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy {overrun!r}; expected one of {', '.join(OVERRUN_POLICIES)}")
+        self.targets = list(targets)
+        self.jitter = jitter
+        self.overrun = overrun
+        self.max_catch_up = max_catch_up
+        self.align = align
+        self.stop = stop or threading.Event()
+        self._poll = poll
+        self._loop = loop
+        self._inflight: dict[Future, UPSTarget] = {}
+        self._index = {target: i for i, target in enumerate(self.targets)}
+        self._intervals = [target.interval for target in self.targets]
+        now = time.monotonic()
+        # Converts monotonic times into the wall-clock times reported as scheduled, fixed so the grid never jumps
+        self._wall_offset = time.time() - now
+        # Nominal time of each target's most recent poll
+        self._last_nominal = [now] * len(self.targets)
+        # Overdue nominal times waiting for the target's running poll to finish (OVERRUN_CATCH_UP)
+        self._held: dict[int, float] = {}
+        # (due time, nominal time, index) per target; the nominal grid never drifts with jitter
+        self._schedule = [(now + self._phase(i), now + self._phase(i), i) for i in range(len(self.targets))]
+        heapq.heapify(self._schedule)
+
+    def _phase(self, i: int) -> float:
+        """Returns how far target i's polls are staggered into its interval."""
+        return i * self._intervals[i] / len(self.targets)
+
+    def _following(self, i: int, nominal: float) -> float:
+        """Returns the slot of target i's grid after the nominal time of a poll."""
+        interval = self._intervals[i]
+        if not self.align:
+            return nominal + interval
+        phase = self._phase(i) - self._wall_offset
+        following = (math.floor((nominal - phase) / interval) + 1) * interval + phase
+        # Guards against rounding when nominal already sits on the grid
+        return following if following > nominal + interval / 2 else following + interval
+
+    def _push(self, nominal: float, i: int) -> None:
+        due = nominal + random.uniform(0, self.jitter * self._intervals[i])
+        heapq.heappush(self._schedule, (due, nominal, i))
+
+    def set_interval(self, target: UPSTarget, interval: float) -> None:
+        """Changes how often a target is polled, rescheduling its next poll from its last one."""
+        i = self._index[target]
+        if self._intervals[i] == interval:
+            return
+        self._intervals[i] = interval
+        self._schedule = [entry for entry in self._schedule if entry[2] != i]
+        heapq.heapify(self._schedule)
+        self._held.pop(i, None)
+        # A poll that is now overdue is dispatched on the next pass
+        self._push(self._following(i, self._last_nominal[i]), i)
+
+    async def _bounded(self, target: UPSTarget, scheduled: float):
+        """Runs one poll, cancelling it once it exceeds the target's deadline."""
+        task = asyncio.ensure_future(self._poll(target, scheduled))
+        done, _ = await asyncio.wait({task}, timeout=target.deadline)
+        if not done:
+            task.cancel()
+            await asyncio.wait({task})
+            poll_deadlines_exceeded.inc(ups=target.ups_id)
+            raise TimeoutError(f"Poll of UPS {target.ups_id} did not finish within {target.deadline:g}s")
+        return task.result()
+
+    def _schedule_next(self, i: int, nominal: float, now: float) -> None:
+        """Schedules target i's poll after the one due at nominal, skipping slots that are already past."""
+        interval = self._intervals[i]
+        following = self._following(i, nominal)
+        overdue = math.floor((now - following) / interval) + 1 if following <= now else 0
+        skipped = overdue if self.overrun == OVERRUN_SKIP else max(0, overdue - self.max_catch_up)
+        if skipped:
+            logger.warning(f"Polling of UPS {self.targets[i].ups_id} fell behind; skipping {skipped} interval(s).")
+            polls_skipped.inc(skipped, ups=self.targets[i].ups_id)
+        self._push(following + skipped * interval, i)
+
+    def _dispatch_due(self) -> None:
+        now = time.monotonic()
+        busy = set(self._inflight.values())
+        while self._schedule and self._schedule[0][0] <= now:
+            due, nominal, i = heapq.heappop(self._schedule)
+            target = self.targets[i]
+            self._last_nominal[i] = nominal
+            poll_drift_seconds.observe(now - due, ups=target.ups_id)
+            if target in busy:
+                if self.overrun == OVERRUN_CATCH_UP:
+                    # Made up as soon as the running poll finishes; the next slot is scheduled then
+                    self._held[i] = nominal
+                    continue
+                logger.warning(f"Poll of UPS {target.ups_id} is still running; skipping this interval.")
+                polls_skipped.inc(ups=target.ups_id)
+            else:
+                future = self._loop.submit(self._bounded(target, nominal + self._wall_offset))
+                self._inflight[future] = target
+                busy.add(target)
+            self._schedule_next(i, nominal, now)
+
+    def results(self) -> Iterator[tuple[UPSTarget, object, BaseException | None]]:
+        """Runs the schedule until stop is set, yielding (target, result, error) as each poll finishes.
+
+        Stop is noticed while waiting for the next poll to come due, or once
+        the polls in flight have finished.
+        """
+        while not self.stop.is_set():
+            self._dispatch_due()
+            timeout = max(0.0, self._schedule[0][0] - time.monotonic()) if self._schedule else None
+            if not self._inflight:
+                self.stop.wait(timeout)
+                continue
+            done, _ = wait(self._inflight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = self._inflight.pop(future)
+                held = self._held.pop(self._index[target], None)
+                if held is not None:
+                    heapq.heappush(self._schedule, (time.monotonic(), held, self._index[target]))
+                error = future.exception()
+                yield target, None if error else future.result(), error
+                # Polls that came due while the caller handled the result go out now, not after the whole batch
+                self._dispatch_due()
+
+    def shutdown(self) -> None:
+        """Cancels the polls still in flight."""
+        for future in self._inflight:
+            future.cancel()
+        self._inflight.clear()
@@ -0,0 +1,281 @@
+import json
+import logging
+import math
+import mmap
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from sample import UPSSample, UPSStatus
+
+logger = logging.getLogger("apcmagic")
+
+# Identifies a status file and the version of its layout
+MAGIC = b"APCSTAT1"
+# Samples kept in the ring: how far a reader may fall behind before it misses some
+DEFAULT_SLOTS = 256
+# Bytes per slot, room for a sample with every field apcupsd reports
+DEFAULT_SLOT_SIZE = 4096
+# Seconds between checks for new samples by a SharedStatusFollower
+FOLLOW_INTERVAL = 0.1
+# Times a read of a slot being overwritten is retried before it is treated as lost
+READ_RETRIES = 100
+
+# File header: magic, slot count, slot size, then the number of samples published so far
+_HEADER = struct.Struct("<8sII")
+_PUBLISHED = struct.Struct("<Q")
+_PUBLISHED_OFFSET = _HEADER.size
+# Slots start on their own cache line
+_SLOTS_OFFSET = 64
+# Slot header: sequence number (odd while the slot is being written), payload length
+_SEQUENCE = struct.Struct("<Q")
+_SLOT_HEADER = struct.Struct("<QI")
+# Payload: status flags; bcharge, loadpct, timeleft, linev, battv, timestamp, monotonic
+# and scheduled (NaN for None); UPS id length. The UPS id and the raw fields as JSON follow.
+_RECORD = struct.Struct("<Q8dH")
+
+
+class StaleStatusError(Exception):
+    """Raised when the monitor has not published a recent enough sample of a UPS."""
+
+
+def _number(value: float | None) -> float:
+    return math.nan if value is None else value
+
+
+def _optional(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+def encode_sample(sample: UPSSample, limit: int = DEFAULT_SLOT_SIZE - _SLOT_HEADER.size) -> bytes:
+    """Packs a sample into a slot payload; the raw fields are left out if they would not fit in `limit` bytes."""
+    ups_id = sample.ups_id.encode()
+    head = _RECORD.pack(
+        sample.status.value,
+        *(_number(value) for value in (sample.bcharge, sample.loadpct, sample.timeleft, sample.linev, sample.battv)),
+        sample.timestamp,
+        sample.monotonic,
+        _number(sample.scheduled),
+        len(ups_id),
+    ) + ups_id
+    fields = json.dumps(sample.fields, separators=(",", ":")).encode()
+    if len(head) + len(fields) > limit:
+        logger.debug(f"Raw fields of a {sample.ups_id} sample do not fit in a status slot; publishing without them.")
+        fields = b"{}"
+    if len(head) + len(fields) > limit:
+        raise ValueError(f"UPS id {sample.ups_id!r} is too long for a status slot")
+    return head + fields
+
+
+def decode_sample(payload: bytes) -> UPSSample:
+    """Unpacks a slot payload written by encode_sample()."""
+    status, bcharge, loadpct, timeleft, linev, battv, timestamp, monotonic, scheduled, id_length = _RECORD.unpack_from(
+        payload
+    )
+    start = _RECORD.size + id_length
+    return UPSSample(
+        status=UPSStatus(status),
+        bcharge=_optional(bcharge),
+        loadpct=_optional(loadpct),
+        timeleft=_optional(timeleft),
+        linev=_optional(linev),
+        battv=_optional(battv),
+        ups_id=payload[_RECORD.size:start].decode(),
+        timestamp=timestamp,
+        monotonic=monotonic,
+        scheduled=_optional(scheduled),
+        fields=json.loads(payload[start:]),
+    )
+
+
+def initialize_status_file(
+    path: Path | str, slots: int = DEFAULT_SLOTS, slot_size: int = DEFAULT_SLOT_SIZE, reset: bool = False
+) -> None:
+    """Creates an empty status file at `path`, unless one with the same layout is already there and reset is False."""
+    path = Path(path)
+    size = _SLOTS_OFFSET + slots * slot_size
+    header = _HEADER.pack(MAGIC, slots, slot_size)
+    try:
+        with path.open("rb") as f:
+            if not reset and f.read(_HEADER.size) == header and path.stat().st_size == size:
+                return
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    # Written to a new file and renamed, so readers never map a half-created one
+    temporary = path.with_name(f".{path.name}.new")
+    with temporary.open("wb") as f:
+        f.write(header)
+        f.truncate(size)
+    temporary.replace(path)
+
+
+class SharedStatusWriter:
+    """Publishes samples into a memory-mapped ring of fixed-size slots in a status file.
+
+    Only one process may write to a status file. Each slot is guarded by a
+    sequence number (a seqlock): it is odd while the slot is being written, and
+    readers retry a read that saw an odd or changed number, so they never take
+    a lock and never see a half-written sample. The n-th sample published goes
+    to slot n % slots; a writer reopening the file carries on from the count in
+    its header, so readers following the ring are not confused by a restart.
+    """
+
+    def __init__(self, path: Path | str, slots: int = DEFAULT_SLOTS, slot_size: int = DEFAULT_SLOT_SIZE) -> None:
+        initialize_status_file(path, slots, slot_size)
+        self._slots = slots
+        self._slot_size = slot_size
+        with open(path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        (self._published,) = _PUBLISHED.unpack_from(self._map, _PUBLISHED_OFFSET)
+
+    @property
+    def published(self) -> int:
+        """The number of samples published to the file, by this writer and earlier ones."""
+        return self._published
+
+    def publish(self, sample: UPSSample) -> None:
+        """Writes a sample into the next slot and makes it visible to readers."""
+        payload = encode_sample(sample, self._slot_size - _SLOT_HEADER.size)
+        number = self._published
+        offset = _SLOTS_OFFSET + number % self._slots * self._slot_size
+        # Derived from the sample number rather than read back, so a slot left odd by a crash is still rewritten cleanly
+        sequence = 2 * (number // self._slots + 1)
+        _SEQUENCE.pack_into(self._map, offset, sequence - 1)
+        start = offset + _SLOT_HEADER.size
+        self._map[start:start + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self._map, offset, sequence, len(payload))
+        self._published = number + 1
+        _PUBLISHED.pack_into(self._map, _PUBLISHED_OFFSET, self._published)
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class SharedStatusReader:
+    """Reads samples from a status file published by a SharedStatusWriter in another process, without locking."""
+
+    def __init__(self, path: Path | str) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._slots, self._slot_size = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != _SLOTS_OFFSET + self._slots * self._slot_size:
+            self._map.close()
+            raise ValueError(f"{path} is not an apcmagic status file")
+
+    @property
+    def published(self) -> int:
+        """The number of samples published so far."""
+        return _PUBLISHED.unpack_from(self._map, _PUBLISHED_OFFSET)[0]
+
+    def _payload(self, number: int) -> bytes | None:
+        """Returns the payload of the number-th sample, or None once the writer has overwritten it."""
+        offset = _SLOTS_OFFSET + number % self._slots * self._slot_size
+        expected = 2 * (number // self._slots + 1)
+        start = offset + _SLOT_HEADER.size
+        for _ in range(READ_RETRIES):
+            sequence, length = _SLOT_HEADER.unpack_from(self._map, offset)
+            if sequence > expected:
+                return None
+            if sequence == expected:
+                payload = self._map[start:start + length]
+                if _SEQUENCE.unpack_from(self._map, offset)[0] == sequence:
+                    return payload
+        return None
+
+    def read(self, number: int) -> UPSSample | None:
+        """Returns the number-th sample published, or None if it has been overwritten since."""
+        payload = self._payload(number)
+        return None if payload is None else decode_sample(payload)
+
+    def read_since(self, cursor: int) -> tuple[list[UPSSample], int]:
+        """Returns the samples published from sample number `cursor` on and the cursor to pass next time.
+
+        Samples that have been overwritten already, by a writer that lapped
+        the reader, are skipped.
+        """
+        published = self.published
+        if cursor > published:
+            # The file was recreated; start over from what it holds
+            cursor = 0
+        samples = []
+        for number in range(max(cursor, published - self._slots), published):
+            sample = self.read(number)
+            if sample is not None:
+                samples.append(sample)
+        return samples, published
+
+    def latest(self, ups_id: str) -> UPSSample | None:
+        """Returns the most recent sample of a UPS still in the ring, if any."""
+        published = self.published
+        encoded = ups_id.encode()
+        for number in range(published - 1, max(-1, published - self._slots - 1), -1):
+            payload = self._payload(number)
+            if payload is None:
+                continue
+            id_length = _RECORD.unpack_from(payload)[-1]
+            if payload[_RECORD.size:_RECORD.size + id_length] == encoded:
+                return decode_sample(payload)
+        return None
+
+    def fetcher(self, ups_id: str, stale_after: float) -> Callable[[], UPSSample]:
+        """Returns a StatusCache fetcher that reads a UPS's latest published sample instead of polling apcupsd.
+
+        It raises StaleStatusError when that sample is more than stale_after
+        seconds old, e.g. because the monitor process has died. Age is measured
+        by the wall clock, since samples may outlive the boot they were taken in.
+        """
+        def fetch() -> UPSSample:
+            sample = self.latest(ups_id)
+            if sample is None:
+                raise StaleStatusError(f"The monitor has not published a sample of {ups_id} yet")
+            age = time.time() - sample.timestamp
+            if age > stale_after:
+                raise StaleStatusError(f"The latest sample of {ups_id} from the monitor is {age:.0f}s old")
+            return sample
+        return fetch
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class SharedStatusFollower:
+    """Hands every sample published to a status file after it was created to a callback, from a background thread.
+
+    Samples already in the ring, possibly left by an earlier run, are not
+    handed over; SharedStatusReader.latest() reads those.
+    """
+
+    def __init__(
+        self, reader: SharedStatusReader, on_sample: Callable[[UPSSample], None], interval: float = FOLLOW_INTERVAL
+    ) -> None:
+        self.reader = reader
+        self.on_sample = on_sample
+        self.interval = interval
+        self._cursor = reader.published
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def poll(self) -> int:
+        """Hands over the samples published since the last poll and returns how many there were."""
+        samples, self._cursor = self.reader.read_since(self._cursor)
+        for sample in samples:
+            try:
+                self.on_sample(sample)
+            except Exception as e:
+                logger.error(f"Error handling a sample published by the monitor: {e}")
+        return len(samples)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="status-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
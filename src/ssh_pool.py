@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_import import lazy_import
+from metrics import ssh_connect_seconds
+
+# Loaded on first use, so processes that never open a session skip the import
+paramiko = lazy_import("paramiko")
+
+logger = logging.getLogger("apcmagic")
+
+# Seconds allowed for the TCP connect and SSH handshake to a device
+CONNECT_TIMEOUT = 10
+# Port devices listen on for SSH unless their entry names another
+SSH_PORT = 22
+# Seconds between SSH keepalives on pooled sessions
+KEEPALIVE_INTERVAL = 15
+# Seconds allowed for a health probe on an open session
+PROBE_TIMEOUT = 5
+# Reconnect backoff after consecutive failures, doubling from the first to the last value
+BACKOFF_INITIAL_SECONDS = 5.0
+BACKOFF_MAX_SECONDS = 300.0
+
+
+def connect_device(device: dict) -> "paramiko.SSHClient":
+    """Opens an authenticated SSH session to a device described by a UBIQUITI_DEVICES entry."""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    with ssh_connect_seconds.time(host=device["host"]):
+        ssh.connect(
+            device["host"],
+            port=device.get("port", SSH_PORT),
+            username=device["username"],
+            password=device.get("password"),
+            key_filename=device.get("key_filename"),
+            timeout=CONNECT_TIMEOUT,
+        )
+    return ssh
+
+
+def session_is_active(ssh: "paramiko.SSHClient") -> bool:
+    """Returns whether an SSH session's transport is still up."""
+    transport = ssh.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class _DeviceState:
+    """Connection and health bookkeeping for one device."""
+
+    def __init__(self, device: dict) -> None:
+        self.device = device
+        self.session: paramiko.SSHClient | None = None
+        self.state = "unknown"
+        self.connect_latency_ms: float | None = None
+        self.probe_latency_ms: float | None = None
+        self.last_check: float | None = None
+        self.last_success: float | None = None
+        self.last_error: str | None = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class SSHDevicePool:
+    """Keeps authenticated SSH sessions to the managed devices and tracks their health.
+
+    Sessions can be opened on demand (e.g. when the UPS switches to battery) or
+    kept open permanently by the health-check thread, which probes each session
+    periodically and reconnects failed devices with exponential backoff. Either
+    way, take() hands shutdown a ready session without a handshake.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._devices: dict[str, _DeviceState] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def configure(self, devices: list[dict]) -> None:
+        """Replaces the managed devices, closing sessions to hosts no longer listed."""
+        with self._lock:
+            old = self._devices
+            self._devices = {}
+            for device in devices:
+                state = old.pop(device["host"], None) or _DeviceState(device)
+                state.device = device
+                self._devices[device["host"]] = state
+        for state in old.values():
+            if state.session is not None:
+                state.session.close()
+
+    def _record_failure(self, state: _DeviceState, kind: str, error: Exception) -> None:
+        state.state = kind
+        state.last_error = str(error) or type(error).__name__
+        state.failures += 1
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_INITIAL_SECONDS * 2 ** (state.failures - 1))
+        state.retry_at = time.monotonic() + delay
+
+    def _connect(self, state: _DeviceState) -> None:
+        host = state.device["host"]
+        started = time.perf_counter()
+        try:
+            ssh = connect_device(state.device)
+            transport = ssh.get_transport()
+            if transport is not None:
+                transport.set_keepalive(KEEPALIVE_INTERVAL)
+        except paramiko.AuthenticationException as e:
+            logger.error(f"SSH authentication to {host} failed: {e}")
+            with self._lock:
+                self._record_failure(state, "auth_failed", e)
+            return
+        except Exception as e:
+            logger.warning(f"SSH connection to {host} failed: {e}")
+            with self._lock:
+                self._record_failure(state, "unreachable", e)
+            return
+
+        with self._lock:
+            if state.session is not None:
+                state.session.close()
+            state.session = ssh
+            state.state = "connected"
+            state.connect_latency_ms = (time.perf_counter() - started) * 1000
+            state.last_success = time.time()
+            state.last_error = None
+            state.failures = 0
+        logger.info(f"SSH session to {host} established in {state.connect_latency_ms:.0f} ms")
+
+    def _probe(self, state: _DeviceState, session: "paramiko.SSHClient") -> None:
+        """Opens and closes a channel on a session to prove the device still answers."""
+        started = time.perf_counter()
+        try:
+            channel = session.get_transport().open_session(timeout=PROBE_TIMEOUT)
+            channel.close()
+        except Exception as e:
+            logger.warning(f"SSH session to {state.device['host']} failed its health check: {e}")
+            with self._lock:
+                if state.session is session:
+                    state.session = None
+                self._record_failure(state, "unreachable", e)
+            session.close()
+            return
+        with self._lock:
+            state.state = "connected"
+            state.probe_latency_ms = (time.perf_counter() - started) * 1000
+            state.last_success = time.time()
+
+    def _check(self, state: _DeviceState, force: bool) -> None:
+        with self._lock:
+            state.last_check = time.time()
+            session = state.session
+        if session is not None and session_is_active(session):
+            self._probe(state, session)
+        elif force or time.monotonic() >= state.retry_at:
+            self._connect(state)
+
+    def check_all(self, force: bool = False) -> None:
+        """Probes open sessions and (re)connects the rest in parallel.
+
+        Devices in reconnect backoff are skipped unless force is set.
+        """
+        with self._lock:
+            states = list(self._devices.values())
+        if not states:
+            return
+        with ThreadPoolExecutor(max_workers=len(states)) as executor:
+            list(executor.map(lambda state: self._check(state, force), states))
+
+    def connect_all(self) -> None:
+        """Opens sessions to every device that doesn't have a live one, ignoring backoff."""
+        self.check_all(force=True)
+
+    def take(self, host: str) -> "paramiko.SSHClient | None":
+        """Removes and returns the live session to a host, if there is one."""
+        with self._lock:
+            state = self._devices.get(host)
+            if state is None or state.session is None:
+                return None
+            session, state.session = state.session, None
+            state.state = "disconnected"
+        if session_is_active(session):
+            return session
+        session.close()
+        return None
+
+    def close_all(self) -> None:
+        """Closes every pooled session."""
+        with self._lock:
+            sessions = [state.session for state in self._devices.values() if state.session is not None]
+            for state in self._devices.values():
+                if state.session is not None:
+                    state.session = None
+                    state.state = "disconnected"
+        for session in sessions:
+            session.close()
+
+    def health(self) -> list[dict]:
+        """Returns per-device connection state, latencies and the last error."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "host": host,
+                    "state": state.state,
+                    "connected": state.session is not None,
+                    "connect_latency_ms": state.connect_latency_ms,
+                    "probe_latency_ms": state.probe_latency_ms,
+                    "last_check": state.last_check,
+                    "last_success": state.last_success,
+                    "last_error": state.last_error,
+                    "consecutive_failures": state.failures,
+                    "retry_in_seconds": max(0.0, state.retry_at - now) if state.failures else None,
+                }
+                for host, state in self._devices.items()
+            ]
+
+    def start(self, interval: float) -> None:
+        """Starts a background thread keeping sessions open and checking them every `interval` seconds."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run() -> None:
+            while not self._stop.is_set():
+                try:
+                    self.check_all()
+                except Exception as e:
+                    logger.error(f"Error during SSH health check: {e}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the health-check thread and closes all sessions."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close_all()
+
+
+# Process-wide pool shared by the shutdown sequence and the web API
+device_pool = SSHDevicePool()
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+from nis_client import NISClient, nis_loop
+from sample import DEFAULT_UPS_ID, UPSSample
+
+logger = logging.getLogger("apcmagic")
+
+# Default freshness window for cached status snapshots (overridden from config.ini)
+DEFAULT_TTL_SECONDS = 5.0
+
+
+def make_fetcher(client: NISClient, ups_id: str = DEFAULT_UPS_ID) -> Callable[[], UPSSample]:
+    """Returns a blocking fetcher that polls a UPS through its NIS client on the shared event loop."""
+    def fetch() -> UPSSample:
+        return nis_loop.run(client.sample(ups_id))
+    return fetch
+
+
+class _Fetch:
+    """An in-flight fetch that concurrent readers can wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: UPSSample | None = None
+        self.error: BaseException | None = None
+
+
+class StatusCache:
+    """A thread-safe, TTL-bounded cache of the latest UPS status snapshot.
+
+    Concurrent readers that find the snapshot stale share a single in-flight
+    fetch instead of each opening their own connection to apcupsd.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL_SECONDS, fetcher: Callable[[], UPSSample] | None = None) -> None:
+        self.ttl = ttl
+        self.fetcher = fetcher or make_fetcher(NISClient())
+        self._lock = threading.Lock()
+        self._status: UPSSample | None = None
+        self._updated_at = 0.0
+        self._inflight: _Fetch | None = None
+
+    def get(self, max_age: float | None = None) -> UPSSample:
+        """Returns a status snapshot no older than max_age (defaults to the TTL)."""
+        if max_age is None:
+            max_age = self.ttl
+
+        with self._lock:
+            if self._status is not None and time.monotonic() - self._updated_at <= max_age:
+                return self._status
+            fetch = self._inflight
+            leader = fetch is None
+            if leader:
+                fetch = self._inflight = _Fetch()
+
+        if not leader:
+            fetch.done.wait()
+            if fetch.error is not None:
+                raise fetch.error
+            return fetch.result
+
+        try:
+            fetch.result = self.fetcher()
+        except BaseException as e:
+            fetch.error = e
+            raise
+        else:
+            self.update(fetch.result)
+            return fetch.result
+        finally:
+            with self._lock:
+                self._inflight = None
+            fetch.done.set()
+
+    def refresh(self) -> UPSSample:
+        """Forces a fresh fetch (joining one already in flight) and returns it."""
+        return self.get(max_age=0)
+
+    def latest(self) -> tuple[UPSSample, float] | None:
+        """Returns the cached snapshot and its age in seconds, or None if there is none; never polls apcupsd."""
+        with self._lock:
+            if self._status is None:
+                return None
+            return self._status, time.monotonic() - self._updated_at
+
+    def update(self, status: UPSSample) -> None:
+        """Publishes a status snapshot obtained elsewhere into the cache."""
+        with self._lock:
+            self._status = status
+            self._updated_at = time.monotonic()
+
+    def clear(self) -> None:
+        """Drops the cached snapshot so the next read fetches a fresh one."""
+        with self._lock:
+            self._status = None
+            self._updated_at = 0.0
+
+
+# Process-wide cache of the default UPS, shared by the monitor loop, the web API and the menu bar app
+status_cache = StatusCache()
+
+# Caches of every monitored UPS by id, in configuration order (see configure_caches())
+status_caches: dict[str, StatusCache] = {DEFAULT_UPS_ID: status_cache}
+
+
+def configure_caches(fetchers: dict[str, Callable[[], UPSSample]], ttl: float) -> None:
+    """Replaces the monitored UPSes with one cache per fetcher, reusing status_cache for DEFAULT_UPS_ID."""
+    caches = {}
+    for ups_id, fetcher in fetchers.items():
+        cache = status_cache if ups_id == DEFAULT_UPS_ID else status_caches.get(ups_id) or StatusCache()
+        cache.ttl = ttl
+        cache.fetcher = fetcher
+        cache.clear()
+        caches[ups_id] = cache
+    status_caches.clear()
+    status_caches.update(caches)
+
+
+def default_ups_id() -> str:
+    """Returns the UPS the APIs report on when a request doesn't name one: the first configured."""
+    return next(iter(status_caches), DEFAULT_UPS_ID)
@@ -0,0 +1,613 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from metrics import db_write_seconds, samples_written
+from sample import DEFAULT_UPS_ID, UPSSample
+
+logger = logging.getLogger("apcmagic")
+
+# Numeric columns recorded per sample and aggregated in rollups and history buckets
+METRICS = ("bcharge", "loadpct", "timeleft", "linev", "battv")
+
+# Rollup tiers as (table, bucket width in seconds, source table), finest first
+ROLLUP_TIERS = (
+    ("ups_rollup_1m", 60, "ups_data"),
+    ("ups_rollup_1h", 60 * 60, "ups_rollup_1m"),
+    ("ups_rollup_1d", 24 * 60 * 60, "ups_rollup_1h"),
+)
+
+# Days of data kept per table; 0 keeps data forever (overridden from config.ini)
+RETENTION_DAYS = {
+    "ups_data": 7,
+    "ups_rollup_1m": 30,
+    "ups_rollup_1h": 365,
+    "ups_rollup_1d": 0,
+}
+
+# Seconds a stored sample's values are held for when history is reconstructed
+# step-wise; 0 disables reconstruction (set from config.ini when storing on change)
+HOLD_SECONDS = 0
+
+# Write-behind defaults for SampleWriter (overridden from config.ini)
+DEFAULT_WRITE_BATCH_SIZE = 20
+DEFAULT_WRITE_FLUSH_SECONDS = 30.0
+# Upper bound on buffered samples kept for retry while the database is failing
+MAX_PENDING_SAMPLES = 10000
+
+# Idle read-only connections kept by ReadConnectionPool, and compiled statements cached per connection
+READ_POOL_SIZE = 8
+READ_CACHED_STATEMENTS = 256
+# Rows fetched per step when raw samples are streamed out by iter_samples()
+EXPORT_BATCH_ROWS = 5000
+# Times in JSON responses: ISO 8601 in UTC with a Z, which every browser's Date() reads as UTC
+API_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Bumped whenever migrate() has to rewrite existing databases (stored in PRAGMA user_version)
+SCHEMA_VERSION = 3
+
+_ROLLUP_COLUMNS = ",\n    ".join(f"{m}_min REAL, {m}_max REAL, {m}_avg REAL" for m in METRICS)
+
+# Samples are keyed on integer Unix epoch seconds so range scans use the index
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS ups_data (
+    timestamp INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+    ups_id TEXT NOT NULL DEFAULT '{DEFAULT_UPS_ID}',
+    status TEXT,
+    bcharge REAL,
+    loadpct REAL,
+    timeleft REAL,
+    linev REAL,
+    battv REAL,
+    -- Wall-clock time the poll was scheduled for; timestamp is when it was taken
+    scheduled REAL
+);
+CREATE INDEX IF NOT EXISTS ups_data_timestamp ON ups_data (timestamp);
+CREATE INDEX IF NOT EXISTS ups_data_ups_timestamp ON ups_data (ups_id, timestamp);
+CREATE TABLE IF NOT EXISTS power_events (
+    id INTEGER PRIMARY KEY,
+    ups_id TEXT NOT NULL DEFAULT '{DEFAULT_UPS_ID}',
+    kind TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER,
+    min_bcharge REAL,
+    min_linev REAL,
+    max_linev REAL,
+    max_loadpct REAL,
+    energy_wh REAL
+);
+CREATE INDEX IF NOT EXISTS power_events_ups_start ON power_events (ups_id, start_time);
+CREATE INDEX IF NOT EXISTS power_events_ups_kind_start ON power_events (ups_id, kind, start_time);
+""" + "".join(
+    f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket INTEGER NOT NULL,
+    ups_id TEXT NOT NULL DEFAULT '{DEFAULT_UPS_ID}',
+    samples INTEGER NOT NULL,
+    status TEXT,
+    {_ROLLUP_COLUMNS},
+    PRIMARY KEY (bucket, ups_id)
+);
+"""
+    for table, _, _ in ROLLUP_TIERS
+)
+
+
+INSERT_SAMPLE = (
+    "INSERT INTO ups_data (timestamp, ups_id, status, bcharge, loadpct, timeleft, linev, battv, scheduled) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def sample_row(sample: UPSSample) -> tuple:
+    """Returns the INSERT_SAMPLE parameters for a sample."""
+    return (
+        int(sample.timestamp),
+        sample.ups_id,
+        str(sample.status),
+        *(getattr(sample, m) for m in METRICS),
+        sample.scheduled,
+    )
+
+
+def enable_wal(conn: sqlite3.Connection) -> None:
+    """Switches a connection to WAL journaling so readers never block the sample writer.
+
+    With WAL, synchronous=NORMAL only fsyncs at checkpoints; a power loss can
+    drop the last few commits but never corrupts the database.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class SampleWriter:
+    """Buffers samples and writes them to ups_data in batched transactions.
+
+    The buffer is committed once it holds batch_size samples or its oldest
+    sample is flush_interval seconds old. Samples that change the UPS status,
+    and every sample taken on battery, are committed immediately so the data
+    around an outage is never left in memory. Status changes are tracked per
+    UPS, so a single writer serves every monitored UPS.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+        flush_interval: float = DEFAULT_WRITE_FLUSH_SECONDS,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._pending: list[tuple] = []
+        self._oldest: float | None = None
+        self._last_status: dict[str, object] = {}
+
+    def add(self, sample: UPSSample) -> bool:
+        """Buffers a sample, committing the buffer if a threshold is hit. Returns True if it flushed."""
+        with self._lock:
+            transition = sample.status != self._last_status.get(sample.ups_id)
+            self._last_status[sample.ups_id] = sample.status
+            self._pending.append(sample_row(sample))
+            if self._oldest is None:
+                self._oldest = sample.monotonic
+
+            if (
+                transition
+                or sample.on_battery
+                or len(self._pending) >= self.batch_size
+                or sample.monotonic - self._oldest >= self.flush_interval
+            ):
+                self._flush()
+                return True
+            return False
+
+    def flush(self) -> None:
+        """Commits all buffered samples."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        try:
+            with db_write_seconds.time(operation="insert"):
+                self._conn.executemany(INSERT_SAMPLE, self._pending)
+            with db_write_seconds.time(operation="commit"):
+                self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            if len(self._pending) > MAX_PENDING_SAMPLES:
+                logger.warning(f"Dropping {len(self._pending) - MAX_PENDING_SAMPLES} unwritten samples.")
+                del self._pending[:-MAX_PENDING_SAMPLES]
+            raise
+        samples_written.inc(len(self._pending))
+        self._pending.clear()
+        self._oldest = None
+
+
+class ReadConnectionPool:
+    """Reuses read-only connections to the database across requests.
+
+    Connections are opened in SQLite's ?mode=ro URI mode and keep their
+    compiled-statement cache, so a request pays neither the connect and schema
+    parse nor the query preparation again. Up to `size` idle connections are
+    kept; bursts beyond that open extra connections that are closed on return.
+    """
+
+    def __init__(self, path: Path | str, size: int = READ_POOL_SIZE) -> None:
+        self._uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            self._uri, uri=True, check_same_thread=False, cached_statements=READ_CACHED_STATEMENTS
+        )
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrows a connection for the duration of a with block."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        pooled = False
+        try:
+            yield conn
+        except sqlite3.Error:
+            # The connection may be unusable (e.g. the file was replaced); don't pool it
+            raise
+        else:
+            try:
+                self._idle.put_nowait(conn)
+                pooled = True
+            except queue.Full:
+                pass
+        finally:
+            # Also reached when the borrower fails or is abandoned mid-read (e.g. a client dropping an
+            # /api/export stream), so no connection is left holding a read snapshot that pins the WAL
+            if not pooled:
+                conn.close()
+
+    def close_all(self) -> None:
+        """Closes every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    """Creates any missing tables and upgrades databases written by older versions.
+
+    Version 0 databases stored ups_data timestamps as DATETIME text without an
+    index; they are rewritten once into the integer-epoch, indexed layout.
+    Version 1 databases monitored a single UPS; their rows are assigned to
+    DEFAULT_UPS_ID and the rollup tables are rebuilt keyed on (bucket, ups_id).
+    Version 2 databases gain the scheduled time of each sample, unknown for
+    existing rows.
+    """
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    legacy = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ups_data'"
+    ).fetchone()
+
+    if version < 1 and legacy:
+        logger.info("Migrating ups_data to indexed epoch timestamps...")
+        columns = ", ".join(("status",) + METRICS)
+        cursor.executescript(
+            f"""
+            BEGIN;
+            ALTER TABLE ups_data RENAME TO ups_data_v0;
+            {SCHEMA}
+            INSERT INTO ups_data (timestamp, {columns})
+                SELECT CAST(strftime('%s', timestamp) AS INTEGER), {columns}
+                FROM ups_data_v0 WHERE timestamp IS NOT NULL ORDER BY timestamp;
+            DROP TABLE ups_data_v0;
+            COMMIT;
+            """
+        )
+
+    if version < 2:
+        if legacy and "ups_id" not in _columns(cursor, "ups_data"):
+            logger.info("Adding ups_id to ups_data...")
+            cursor.execute(f"ALTER TABLE ups_data ADD COLUMN ups_id TEXT NOT NULL DEFAULT '{DEFAULT_UPS_ID}'")
+        columns = ", ".join(f"{m}_min, {m}_max, {m}_avg" for m in METRICS)
+        for table, _, _ in ROLLUP_TIERS:
+            existing = _columns(cursor, table)
+            if not existing or "ups_id" in existing:
+                continue
+            logger.info(f"Rebuilding {table} keyed on (bucket, ups_id)...")
+            cursor.executescript(
+                f"""
+                BEGIN;
+                ALTER TABLE {table} RENAME TO {table}_v1;
+                {SCHEMA}
+                INSERT INTO {table} (bucket, samples, status, {columns})
+                    SELECT bucket, samples, status, {columns} FROM {table}_v1;
+                DROP TABLE {table}_v1;
+                COMMIT;
+                """
+            )
+
+    if version < 3 and legacy and "scheduled" not in _columns(cursor, "ups_data"):
+        logger.info("Adding scheduled to ups_data...")
+        cursor.execute("ALTER TABLE ups_data ADD COLUMN scheduled REAL")
+
+    cursor.executescript(SCHEMA)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> set[str]:
+    """Returns the column names of a table, or an empty set if it doesn't exist."""
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _source_select(table: str) -> str:
+    """Returns a SELECT exposing any table as (ups_id, t, samples, status, <metric>_min/_max/_avg...) rows."""
+    if table == "ups_data":
+        values = ", ".join(f"{m} AS {m}_min, {m} AS {m}_max, {m} AS {m}_avg" for m in METRICS)
+        return f"SELECT ups_id, timestamp AS t, 1 AS samples, status, {values} FROM ups_data"
+    values = ", ".join(f"{m}_min, {m}_max, {m}_avg" for m in METRICS)
+    return f"SELECT ups_id, bucket AS t, samples, status, {values} FROM {table}"
+
+
+def _source_range(table: str, per_ups: bool = False) -> str:
+    """Returns a WHERE clause restricting a table to [?, ?) epoch seconds, for one UPS (the first parameter) if per_ups."""
+    column = "timestamp" if table == "ups_data" else "bucket"
+    clause = f"{column} >= ? AND {column} < ?"
+    return f"ups_id = ? AND {clause}" if per_ups else clause
+
+
+def _aggregates() -> str:
+    """Returns the SELECT list merging source rows into one bucket, weighting averages by sample count."""
+    return ", ".join(
+        f"MIN({m}_min), MAX({m}_max), SUM({m}_avg * samples) / SUM(samples)" for m in METRICS
+    )
+
+
+def _merge_statuses(status: str | None) -> str | None:
+    """Deduplicates a comma-joined status list produced by nested GROUP_CONCATs."""
+    if status is None:
+        return None
+    return ",".join(dict.fromkeys(status.split(",")))
+
+
+def _watermark(cursor: sqlite3.Cursor, table: str, width: int, ups_id: str | None = None) -> int | None:
+    """Returns the end of the newest compacted bucket in a rollup table (for one UPS if given), if any."""
+    if ups_id is None:
+        cursor.execute(f"SELECT MAX(bucket) FROM {table}")
+    else:
+        cursor.execute(f"SELECT MAX(bucket) FROM {table} WHERE ups_id = ?", (ups_id,))
+    newest = cursor.fetchone()[0]
+    return None if newest is None else newest + width
+
+
+def compact(conn: sqlite3.Connection, now: int | None = None, settle: int = 0) -> None:
+    """Rolls closed buckets up into each tier and prunes data past its retention.
+
+    Each tier is built from the next finer one, per UPS, and a table is only
+    ever pruned below what the next coarser tier has already absorbed, so no
+    data is lost. Buckets are only rolled up once they closed `settle` seconds
+    ago, so samples still buffered by a SampleWriter are not left out.
+    """
+    now = int(time.time()) if now is None else now
+    cursor = conn.cursor()
+    columns = ", ".join(f"{m}_min, {m}_max, {m}_avg" for m in METRICS)
+
+    for table, width, source in ROLLUP_TIERS:
+        start = _watermark(cursor, table, width) or 0
+        end = (now - settle) // width * width
+        if start >= end:
+            continue
+        cursor.execute(
+            f"""
+            INSERT OR REPLACE INTO {table} (bucket, ups_id, samples, status, {columns})
+            SELECT t / {width} * {width} AS rollup, ups_id, SUM(samples), GROUP_CONCAT(DISTINCT status), {_aggregates()}
+            FROM ({_source_select(source)} WHERE {_source_range(source)})
+            GROUP BY ups_id, rollup
+            """,
+            (start, end),
+        )
+
+    tables = ("ups_data",) + tuple(table for table, _, _ in ROLLUP_TIERS)
+    for finer, (coarser, width, _) in zip(tables, ROLLUP_TIERS + ((None, None, None),)):
+        days = RETENTION_DAYS.get(finer, 0)
+        if not days:
+            continue
+        cutoff = now - days * 24 * 60 * 60
+        if coarser is not None:
+            cutoff = min(cutoff, _watermark(cursor, coarser, width) or 0)
+        column = "timestamp" if finer == "ups_data" else "bucket"
+        cursor.execute(f"DELETE FROM {finer} WHERE {column} < ?", (cutoff,))
+
+    conn.commit()
+
+
+def _choose_tier(cursor: sqlite3.Cursor, start: int, width: int, now: int) -> tuple[str, int] | None:
+    """Picks the coarsest rollup tier that resolves `width`-second buckets back to `start`.
+
+    Returns None when raw samples should be used. A tier whose retention does
+    not reach back to `start` is only used if no finer source does either.
+    """
+    def covers(table: str) -> bool:
+        days = RETENTION_DAYS.get(table, 0)
+        return not days or start >= now - days * 24 * 60 * 60
+
+    chosen = None
+    for table, tier_width, _ in ROLLUP_TIERS:
+        if tier_width <= width and covers(table):
+            chosen = (table, tier_width)
+    if chosen is None and not covers("ups_data"):
+        for table, tier_width, _ in ROLLUP_TIERS:
+            if covers(table):
+                return table, tier_width
+        return ROLLUP_TIERS[-1][:2]
+    return chosen
+
+
+def _held_row(held: tuple) -> dict:
+    """Returns the metrics of a bucket with no stored rows, holding the last values stored before it."""
+    _, status, *values = held
+    row = {"status": status, "samples": 0}
+    for metric, value in zip(METRICS, values):
+        row[metric] = {"min": value, "max": value, "avg": value}
+    return row
+
+
+def _reconstruct_steps(
+    cursor: sqlite3.Cursor,
+    buckets: dict[int, dict],
+    sources: str,
+    params: list,
+    origin: int,
+    start: int,
+    end: int,
+    width: int,
+    hold: int,
+    ups_id: str,
+) -> None:
+    """Fills in the buckets of a series stored on change, holding each stored value for up to `hold` seconds.
+
+    Buckets are numbered `width` seconds apart from `origin`; those in
+    [start, end] are filled. Empty buckets covered by a held value get that
+    value (with 0 samples), and a bucket the previous value is held into has
+    its min/max widened to include it, so the step between two stored rows is
+    not lost.
+    """
+    values = ", ".join(f"{m}_avg" for m in METRICS)
+    # With a single MAX() aggregate, SQLite takes the bare columns from the newest row of each bucket
+    cursor.execute(
+        f"""
+        SELECT (t - ?) / ? AS bucket, MAX(t), status, {values}
+        FROM ({sources})
+        WHERE t >= ? AND t <= ?
+        GROUP BY bucket
+        """,
+        (origin, width, *params, start, end),
+    )
+    last = {bucket: row for bucket, *row in cursor.fetchall()}
+    cursor.execute(
+        f"""
+        SELECT timestamp, status, {", ".join(METRICS)} FROM ups_data
+        WHERE ups_id = ? AND timestamp < ? AND timestamp >= ?
+        ORDER BY timestamp DESC LIMIT 1
+        """,
+        (ups_id, start, start - hold),
+    )
+    held = cursor.fetchone()
+
+    for bucket in range((start - origin) // width, (end - origin) // width + 1):
+        if held is not None and held[0] + hold < origin + bucket * width:
+            held = None
+        row = buckets.get(bucket)
+        if row is None:
+            if held is not None:
+                buckets[bucket] = _held_row(held)
+        elif held is not None:
+            for metric, value in zip(METRICS, held[2:]):
+                if value is None:
+                    continue
+                stats = row[metric]
+                stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+                stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+        held = last.get(bucket, held)
+
+
+def iter_samples(
+    cursor: sqlite3.Cursor,
+    start: int,
+    end: int,
+    ups_id: str = DEFAULT_UPS_ID,
+    batch_size: int = EXPORT_BATCH_ROWS,
+) -> Iterator[list[tuple]]:
+    """Yields one UPS's raw samples in [start, end) as batches of (timestamp, ups_id, status, *METRICS) rows, oldest first.
+
+    Rows are stepped through a single cursor a batch at a time, so memory use
+    is bounded by batch_size however long the range is.
+    """
+    cursor.execute(
+        f"""
+        SELECT timestamp, ups_id, status, {", ".join(METRICS)} FROM ups_data
+        WHERE ups_id = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp
+        """,
+        (ups_id, start, end),
+    )
+    while rows := cursor.fetchmany(batch_size):
+        yield rows
+
+
+def history_page(
+    start: int, end: int, points: int, limit: int | None = None, before: int | None = None
+) -> tuple[int, int, int]:
+    """Returns (bucket width, first, last epoch time) of a page of a history query.
+
+    The bucket grid is fixed by start, end and points alone, so every page of
+    one query lines up. A page holds the newest `limit` buckets (all if None)
+    that start before `before`, the keyset of the next page; `first` is that
+    keyset. An exhausted query yields first > last.
+    """
+    width = (end - start) // points + 1
+    last_bucket = (end - start) // width
+    if before is not None:
+        last_bucket = min(last_bucket, -(-(before - start) // width) - 1)
+    first_bucket = 0 if limit is None else max(0, last_bucket - limit + 1)
+    return width, start + first_bucket * width, min(end, start + (last_bucket + 1) * width - 1)
+
+
+def history_version(cursor: sqlite3.Cursor, ups_id: str = DEFAULT_UPS_ID) -> tuple[int | None, tuple]:
+    """Returns the time of a UPS's newest sample and a version that changes whenever history could.
+
+    The version is the newest rowid of ups_data and of each rollup table, so
+    new samples and compaction both change it. Each is an index lookup, cheap
+    enough to check on every request.
+    """
+    tables = ("ups_data",) + tuple(table for table, _, _ in ROLLUP_TIERS)
+    cursor.execute(
+        "SELECT (SELECT MAX(timestamp) FROM ups_data WHERE ups_id = ?), "
+        + ", ".join(f"(SELECT MAX(rowid) FROM {table})" for table in tables),
+        (ups_id,),
+    )
+    newest, *version = cursor.fetchone()
+    return newest, tuple(version)
+
+
+def query_history(
+    cursor: sqlite3.Cursor,
+    start: int,
+    end: int,
+    points: int,
+    now: int | None = None,
+    ups_id: str = DEFAULT_UPS_ID,
+    hold: int | None = None,
+    limit: int | None = None,
+    before: int | None = None,
+) -> list[dict]:
+    """Aggregates one UPS's samples between two epoch times into at most `points` buckets.
+
+    Reads from the coarsest rollup tier that still resolves the requested
+    bucket width, topped up with raw samples newer than that tier's last
+    compacted bucket. Each bucket reports the sample count, the distinct
+    statuses seen and the min/max/avg of every metric, newest bucket first.
+    With `limit` and `before`, only one page of buckets is read, as described
+    in history_page(). With a `hold` (default HOLD_SECONDS), the series is
+    reconstructed step-wise as described in _reconstruct_steps().
+    """
+    now = int(time.time()) if now is None else now
+    hold = HOLD_SECONDS if hold is None else hold
+    width, first, last = history_page(start, end, points, limit, before)
+    if first > last:
+        return []
+    origin, start, end = start, first, last
+
+    sources = []
+    params: list = []
+    raw_start = start
+    tier = _choose_tier(cursor, start, width, now)
+    if tier is not None:
+        table, tier_width = tier
+        raw_start = max(start, _watermark(cursor, table, tier_width, ups_id) or start)
+        sources.append(f"{_source_select(table)} WHERE {_source_range(table, per_ups=True)}")
+        params += [ups_id, start, raw_start]
+    sources.append(f"{_source_select('ups_data')} WHERE {_source_range('ups_data', per_ups=True)}")
+    params += [ups_id, raw_start, end + 1]
+
+    cursor.execute(
+        f"""
+        SELECT (t - ?) / ? AS bucket, SUM(samples), GROUP_CONCAT(DISTINCT status), {_aggregates()}
+        FROM ({" UNION ALL ".join(sources)})
+        WHERE t >= ? AND t <= ?
+        GROUP BY bucket
+        ORDER BY bucket DESC
+        """,
+        (origin, width, *params, start, end),
+    )
+
+    buckets = {}
+    for bucket, samples, status, *values in cursor.fetchall():
+        row = {"status": _merge_statuses(status), "samples": samples}
+        for i, metric in enumerate(METRICS):
+            low, high, avg = values[3 * i:3 * i + 3]
+            row[metric] = {"min": low, "max": high, "avg": avg}
+        buckets[bucket] = row
+
+    if hold:
+        _reconstruct_steps(
+            cursor, buckets, " UNION ALL ".join(sources), params, origin, start, end, width, hold, ups_id
+        )
+
+    return [
+        {"timestamp": time.strftime(API_TIME_FORMAT, time.gmtime(origin + bucket * width)), **buckets[bucket]}
+        for bucket in sorted(buckets, reverse=True)
+    ]
@@ -1,58 +1,343 @@
+import json
 import logging
+import queue
 import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Callable, Iterator
 
-from apcaccess.status import get, parse
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request
+from werkzeug.http import is_resource_modified
+
+from broadcast import sample_broadcaster
+from events import EVENT_KINDS, event_summary, query_events
+from export import COLUMNAR_MIMETYPE, columnar_chunks, csv_chunks
+from http_cache import BodyCache, accepts_gzip, compress, make_etag
+from metrics import CONTENT_TYPE, GaugeCallback, history_seconds, registry
+from sample import UPSSample, UPSStatus
+from ssh_pool import device_pool
+from status_cache import default_ups_id, status_caches
+import storage
+from storage import ReadConnectionPool, history_page, history_version, iter_samples, query_history
 
 logger = logging.getLogger("apcmagic")
 
 # Constants
 BASE_DIR = Path(__file__).parent.parent
 DATABASE_FILE = BASE_DIR / "data" / "apc_data.db"
+# Seconds between SSE keepalive comments when no sample arrives
+STREAM_KEEPALIVE_SECONDS = 15
+# Concurrent /api/stream clients allowed by default; each holds a server thread while connected
+DEFAULT_MAX_STREAMS = 8
+
+# Latest time a request may name: the last second a datetime can hold, well within SQLite's integers
+MAX_TIME = int(datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp())
+# Selectable /api/history ranges, in seconds
+HISTORY_RANGES = {
+    "1h": 60 * 60,
+    "24h": 24 * 60 * 60,
+    "7d": 7 * 24 * 60 * 60,
+}
+# Default and upper bound for the number of buckets /api/history returns
+DEFAULT_HISTORY_POINTS = 500
+MAX_HISTORY_POINTS = 5000
+# Default and upper bound for the number of events /api/events returns
+DEFAULT_EVENTS_LIMIT = 500
+MAX_EVENTS_LIMIT = 5000
+# Per-UPS gauges served by /metrics as (name, help, reading of a (sample, age in seconds) snapshot)
+UPS_GAUGES = (
+    ("apcmagic_ups_battery_charge_percent", "Battery charge.", lambda sample, age: sample.bcharge),
+    ("apcmagic_ups_load_percent", "Load as a percentage of capacity.", lambda sample, age: sample.loadpct),
+    ("apcmagic_ups_time_left_seconds", "Runtime left on battery as estimated by the UPS.",
+     lambda sample, age: None if sample.timeleft is None else sample.timeleft * 60),
+    ("apcmagic_ups_line_voltage_volts", "Input line voltage.", lambda sample, age: sample.linev),
+    ("apcmagic_ups_battery_voltage_volts", "Battery voltage.", lambda sample, age: sample.battv),
+    ("apcmagic_ups_on_battery", "1 while the UPS runs from its battery.", lambda sample, age: int(sample.on_battery)),
+    ("apcmagic_ups_low_battery", "1 while the UPS reports a low battery.",
+     lambda sample, age: int(UPSStatus.LOWBATT in sample.status)),
+    ("apcmagic_ups_sample_age_seconds", "Seconds since the latest sample was taken.", lambda sample, age: age),
+)
+# /api/export formats as (encoder, media type, file extension)
+EXPORT_FORMATS = {
+    "csv": (csv_chunks, "text/csv", "csv"),
+    "columnar": (columnar_chunks, COLUMNAR_MIMETYPE, "apcx"),
+}
 
 app = Flask(__name__, template_folder=BASE_DIR / "templates")
+read_pool = ReadConnectionPool(DATABASE_FILE)
+# Serialized /api/history bodies by query and data version, shared by every viewer
+history_bodies = BodyCache()
+# Free /api/stream slots, so streams can never take every worker of a bounded server
+stream_slots = threading.BoundedSemaphore(DEFAULT_MAX_STREAMS)
+
+def _ups_gauge(read: Callable[[UPSSample, float], float | None]) -> Callable[[], Iterator[tuple[tuple, float | None]]]:
+    """Returns a GaugeCallback collector reading every UPS's latest snapshot, without polling apcupsd."""
+    def collect() -> Iterator[tuple[tuple, float | None]]:
+        for ups_id, cache in status_caches.items():
+            latest = cache.latest()
+            if latest is not None:
+                yield (ups_id,), read(*latest)
+    return collect
+
+for name, description, read in UPS_GAUGES:
+    registry.register(GaugeCallback(name, description, ["ups"], _ups_gauge(read)))
+
+def configure_streams(max_streams: int) -> None:
+    """Sets how many /api/stream clients may be connected at once."""
+    global stream_slots
+    stream_slots = threading.BoundedSemaphore(max_streams)
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Gzips responses for clients that accept it."""
+    return compress(response, request)
 
 @app.route("/")
 def index() -> str:
     """Renders the main index page of the web application."""
     return render_template("index.html")
 
+def _requested_ups() -> str | None:
+    """Returns the UPS named by the ?ups= argument (the default UPS if absent), or None if it is unknown."""
+    ups_id = request.args.get("ups") or default_ups_id()
+    return ups_id if ups_id in status_caches else None
+
+@app.route("/metrics")
+def metrics() -> Response:
+    """Serves the latest UPS readings and the app's latency histograms in the Prometheus text format."""
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route("/api/ups")
+def api_ups() -> dict:
+    """Returns the ids of the monitored UPSes, the default one first."""
+    return jsonify(list(status_caches))
+
 @app.route("/api/status")
 def api_status() -> tuple[dict, int] | dict:
-    """Returns the current UPS status as a JSON object."""
+    """Returns the current status of a UPS (?ups=<id>, default UPS if omitted) as a JSON object."""
+    ups_id = _requested_ups()
+    if ups_id is None:
+        return jsonify({"error": "Unknown UPS"}), 404
     try:
-        raw_status = get()
-        status = parse(raw_status)
-        return jsonify(status)
+        return jsonify(status_caches[ups_id].get().to_dict())
     except Exception as e:
         logger.error(f"Error in /api/status: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route("/api/history")
-def api_history() -> tuple[dict, int] | dict:
-    """Returns historical UPS data for a given time range as a JSON object."""
+@app.route("/api/devices")
+def api_devices() -> dict:
+    """Returns the SSH connection health and latency of each managed device as JSON."""
+    return jsonify(device_pool.health())
+
+@app.route("/api/stream")
+def api_stream() -> Response:
+    """Streams each new sample of every UPS to the client as Server-Sent Events."""
+    slots = stream_slots
+    if not slots.acquire(blocking=False):
+        return Response("Too many live streams", status=503, headers={"Retry-After": "30"})
+
+    def generate():
+        subscription = sample_broadcaster.subscribe()
+        try:
+            for latest in sample_broadcaster.latest_by_ups:
+                yield f"data: {json.dumps(latest)}\n\n"
+            while True:
+                try:
+                    sample = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if sample is None:
+                    # The server is shutting down
+                    return
+                yield f"data: {json.dumps(sample)}\n\n"
+        finally:
+            sample_broadcaster.unsubscribe(subscription)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Runs once the stream ends or the client goes away, even if it was never read
+    response.call_on_close(slots.release)
+    return response
+
+def _check_time(seconds: int) -> int:
+    """Returns epoch seconds unchanged, raising ValueError if they lie before 1970 or after MAX_TIME."""
+    if not 0 <= seconds <= MAX_TIME:
+        raise ValueError(f"Time {seconds} is out of range")
+    return seconds
+
+def _parse_time(value: str) -> int:
+    """Parses epoch seconds or an ISO 8601 time (UTC unless it carries an offset) into epoch seconds.
+
+    Raises ValueError for anything else, including times before 1970 or after MAX_TIME.
+    """
+    try:
+        seconds = int(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        seconds = int(parsed.timestamp())
+    return _check_time(seconds)
+
+def _history_query() -> tuple[int, int, int, int | None]:
+    """Returns (start, end, points, before) of a history request, raising ValueError if they are invalid.
+
+    A cursor from a previous page carries the whole query, so the bucket grid
+    stays put while the client pages back; otherwise the window is start/end
+    (end defaults to now) or the timerange ending now.
+    """
+    cursor = request.args.get("cursor")
     timerange = request.args.get("timerange", "1h")
+    if not cursor and "start" not in request.args and timerange not in HISTORY_RANGES:
+        raise ValueError("Invalid timerange")
+    try:
+        if cursor:
+            start, end, points, before = (int(field) for field in cursor.split(":"))
+            start, end, before = _check_time(start), _check_time(end), _check_time(before)
+        else:
+            before = None
+            points = int(request.args.get("points", DEFAULT_HISTORY_POINTS))
+            end = _parse_time(request.args["end"]) if "end" in request.args else int(time.time())
+            start = _parse_time(request.args["start"]) if "start" in request.args else None
+    except ValueError:
+        raise ValueError("start and end must be epoch seconds or ISO 8601 times, points a number") from None
+    if not 1 <= points <= MAX_HISTORY_POINTS:
+        raise ValueError(f"points must be between 1 and {MAX_HISTORY_POINTS}")
+    if start is None:
+        # Hold the window still for a bucket's width so repeated polls hit the same cache entry
+        width = HISTORY_RANGES[timerange] // points + 1
+        end = end // width * width + width - 1
+        start = end - HISTORY_RANGES[timerange]
+    if start >= end:
+        raise ValueError("start must be before end")
+    return start, end, points, before
+
+@app.route("/api/history")
+def api_history() -> tuple[dict, int] | Response:
+    """Returns historical data of a UPS for a time range, downsampled into time buckets, newest first.
+
+    With ?limit=, at most that many buckets are returned per request and the
+    X-Next-Cursor header holds the ?cursor= of the next, older page.
+    """
+    try:
+        start, end, points, before = _history_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ups_id = _requested_ups()
+    if ups_id is None:
+        return jsonify({"error": "Unknown UPS"}), 404
+    limit = request.args.get("limit", type=int)
+    if "limit" in request.args and (limit is None or not 1 <= limit <= MAX_HISTORY_POINTS):
+        return jsonify({"error": f"limit must be between 1 and {MAX_HISTORY_POINTS}"}), 400
 
-    time_deltas = {
-        "1h": "-1 hour",
-        "24h": "-1 day",
-        "7d": "-7 days",
-    }
-
-    if timerange not in time_deltas:
-        return jsonify({"error": "Invalid timerange"}), 400
-
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT timestamp, status, bcharge, loadpct, timeleft, linev, battv FROM ups_data WHERE timestamp > datetime('now', ?) ORDER BY timestamp DESC",
-            (time_deltas[timerange],),
-        )
-        data = cursor.fetchall()
-        conn.close()
-        return jsonify(data)
+    try:
+        with read_pool.connection() as conn:
+            cursor = conn.cursor()
+            newest, version = history_version(cursor, ups_id)
+            key = (ups_id, start, end, points, limit, before, storage.HOLD_SECONDS, version)
+            etag = make_etag(key)
+            last_modified = None if newest is None else datetime.fromtimestamp(newest, timezone.utc)
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                def build() -> bytes:
+                    with history_seconds.time(stage="query"):
+                        rows = query_history(cursor, start, end, points, ups_id=ups_id, limit=limit, before=before)
+                    with history_seconds.time(stage="serialize"):
+                        return json.dumps(rows, separators=(",", ":")).encode()
+                body, gzipped = history_bodies.get(key, build)
+            else:
+                body = gzipped = None
     except Exception as e:
         logger.error(f"Error in /api/history: {e}")
         return jsonify({"error": str(e)}), 500
+
+    if body is None:
+        response = Response(status=304)
+    elif gzipped is not None and accepts_gzip(request):
+        response = Response(gzipped, mimetype="application/json", headers={"Content-Encoding": "gzip"})
+    else:
+        response = Response(body, mimetype="application/json")
+    # Clients may keep the response but must revalidate it, which costs two index lookups when unchanged
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if limit is not None:
+        # The first bucket of this page is the keyset the next page ends before
+        _, first, _ = history_page(start, end, points, limit, before)
+        if first > start:
+            response.headers["X-Next-Cursor"] = f"{start}:{end}:{points}:{first}"
+    return response
+
+@app.route("/api/export")
+def api_export() -> Response | tuple[dict, int]:
+    """Streams a UPS's raw samples between ?start= and ?end= (default now) as CSV or columnar binary."""
+    format_name = request.args.get("format", "csv")
+    if format_name not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    ups_id = _requested_ups()
+    if ups_id is None:
+        return jsonify({"error": "Unknown UPS"}), 404
+    try:
+        start = _parse_time(request.args["start"])
+        end = _parse_time(request.args["end"]) if "end" in request.args else int(time.time())
+    except (KeyError, ValueError):
+        return jsonify({"error": "start (and end) must be epoch seconds or ISO 8601 times"}), 400
+    if start >= end:
+        return jsonify({"error": "start must be before end"}), 400
+
+    encode, mimetype, extension = EXPORT_FORMATS[format_name]
+
+    def generate():
+        # Rows are stepped through one cursor and encoded a batch at a time, so memory stays flat
+        try:
+            with read_pool.connection() as conn:
+                yield from encode(iter_samples(conn.cursor(), start, end, ups_id))
+        except sqlite3.Error as e:
+            # Headers are already sent; dropping the connection tells the client the export is incomplete
+            logger.error(f"Error in /api/export: {e}")
+            raise
+
+    return Response(
+        generate(),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="apcmagic-{ups_id}-{start}-{end}.{extension}"'},
+    )
+
+@app.route("/api/events")
+def api_events() -> tuple[dict, int] | Response:
+    """Returns a UPS's power events that started between ?start= (default: ever) and ?end= (default: now).
+
+    Events are newest first, optionally of one ?kind=, at most ?limit=; the
+    summary totals every event in the window by kind.
+    """
+    ups_id = _requested_ups()
+    if ups_id is None:
+        return jsonify({"error": "Unknown UPS"}), 404
+    kind = request.args.get("kind")
+    if kind is not None and kind not in EVENT_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(EVENT_KINDS)}"}), 400
+    try:
+        start = _parse_time(request.args["start"]) if "start" in request.args else 0
+        end = _parse_time(request.args["end"]) if "end" in request.args else int(time.time())
+        limit = int(request.args.get("limit", DEFAULT_EVENTS_LIMIT))
+    except ValueError:
+        return jsonify({"error": "start and end must be epoch seconds or ISO 8601 times, limit a number"}), 400
+    if start > end:
+        return jsonify({"error": "start must not be after end"}), 400
+    if not 1 <= limit <= MAX_EVENTS_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_EVENTS_LIMIT}"}), 400
+
+    try:
+        with read_pool.connection() as conn:
+            cursor = conn.cursor()
+            events = query_events(cursor, start, end, ups_id, kind, limit)
+            summary = event_summary(cursor, start, end, ups_id)
+    except Exception as e:
+        logger.error(f"Error in /api/events: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"events": [event.to_dict() for event in events], "summary": summary})
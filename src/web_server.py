@@ -0,0 +1,173 @@
+import logging
+import queue
+import socket
+import threading
+import time
+
+from werkzeug.debug import DebuggedApplication
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+from broadcast import sample_broadcaster
+
+logger = logging.getLogger("apcmagic")
+
+# Serving modes: a bounded thread pool, or Werkzeug's development server with the debugger
+MODE_PRODUCTION = "production"
+MODE_DEVELOPMENT = "development"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+# Worker threads of the production server, each serving one connection at a time
+DEFAULT_THREADS = 16
+# Accepted connections waiting for a free worker; beyond this, clients get a 503
+DEFAULT_BACKLOG = 64
+# Seconds a client may take to send a request, or to accept a chunk of the response
+DEFAULT_REQUEST_TIMEOUT = 30.0
+# Seconds an idle keep-alive connection holds its worker before being closed
+DEFAULT_KEEPALIVE_TIMEOUT = 5.0
+# Seconds in-flight requests are given to finish on shutdown
+DEFAULT_DRAIN_SECONDS = 10.0
+
+_OVERLOADED = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+)
+
+
+class _PooledRequestHandler(WSGIRequestHandler):
+    """Serves keep-alive connections, with a shorter timeout while idle between requests."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self._served = 0
+
+    def handle_one_request(self) -> None:
+        timeout = self.server.keepalive_timeout if self._served else self.server.request_timeout
+        self.connection.settimeout(timeout)
+        super().handle_one_request()
+        self._served += 1
+
+    def parse_request(self) -> bool:
+        # The request line has arrived, so the client is no longer idle
+        self.connection.settimeout(self.server.request_timeout)
+        return super().parse_request()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server handing accepted connections to a fixed pool of worker threads.
+
+    At most `threads` connections are served at once and `backlog` more wait
+    for a worker; further clients get an immediate 503 rather than piling up
+    threads. Clients that stall while sending a request or reading the
+    response are dropped after request_timeout, and idle keep-alive
+    connections after keepalive_timeout.
+    """
+
+    multithread = True
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        app,
+        threads: int = DEFAULT_THREADS,
+        backlog: int = DEFAULT_BACKLOG,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+    ) -> None:
+        self.request_timeout = request_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.request_queue_size = max(self.request_queue_size, backlog)
+        self._pending: queue.Queue = queue.Queue(maxsize=backlog)
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        super().__init__(host, port, app, handler=_PooledRequestHandler)
+        for i in range(threads):
+            threading.Thread(target=self._work, name=f"apcmagic-web-{i}", daemon=True).start()
+
+    def process_request(self, request: socket.socket, client_address) -> None:
+        with self._idle:
+            self._in_flight += 1
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            logger.warning(f"Web server overloaded, refusing connection from {client_address[0]}.")
+            try:
+                request.settimeout(1.0)
+                request.sendall(_OVERLOADED)
+            except OSError:
+                pass
+            self._done(request)
+
+    def _work(self) -> None:
+        while True:
+            request, client_address = self._pending.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self._done(request)
+
+    def _done(self, request: socket.socket) -> None:
+        self.shutdown_request(request)
+        with self._idle:
+            self._in_flight -= 1
+            self._idle.notify_all()
+
+    def drain(self, timeout: float) -> int:
+        """Waits up to `timeout` seconds for accepted connections to finish and returns how many are left."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight and (remaining := deadline - time.monotonic()) > 0:
+                self._idle.wait(remaining)
+            return self._in_flight
+
+
+class WebServer:
+    """Serves the dashboard from a background thread in the configured mode."""
+
+    def __init__(
+        self,
+        app,
+        mode: str = MODE_PRODUCTION,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        threads: int = DEFAULT_THREADS,
+        backlog: int = DEFAULT_BACKLOG,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        drain_seconds: float = DEFAULT_DRAIN_SECONDS,
+    ) -> None:
+        if mode == MODE_PRODUCTION:
+            self._server = PooledWSGIServer(host, port, app, threads, backlog, request_timeout)
+        elif mode == MODE_DEVELOPMENT:
+            app.debug = True
+            self._server = make_server(host, port, DebuggedApplication(app, evalex=True), threaded=True)
+        else:
+            raise ValueError(f"Unknown web server mode {mode!r}")
+        self.mode = mode
+        self.drain_seconds = drain_seconds
+        self._thread = threading.Thread(target=self._server.serve_forever, name="apcmagic-web", daemon=True)
+
+    @property
+    def port(self) -> int:
+        """The port being listened on, useful when started on port 0."""
+        return self._server.port
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info(f"Serving the dashboard on http://{self._server.host}:{self.port} ({self.mode} mode).")
+
+    def stop(self) -> None:
+        """Stops accepting connections and lets in-flight requests finish, for up to drain_seconds."""
+        if self._thread.is_alive():
+            self._server.shutdown()
+        # Releases the listening socket, so the port can be bound again straight away
+        self._server.server_close()
+        sample_broadcaster.disconnect_all()
+        if isinstance(self._server, PooledWSGIServer):
+            left = self._server.drain(self.drain_seconds)
+            if left:
+                logger.warning(f"Web server stopped with {left} request(s) still in flight.")
+        logger.info("Web server stopped.")
@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+import pytest
+
+# Log to a scratch file rather than the checkout's logs/, here and in subprocesses the tests start
+os.environ["APCMAGIC_LOG_FILE"] = os.path.join(tempfile.mkdtemp(prefix="apcmagic-tests-"), "apcmagic.log")
+
+from broadcast import sample_broadcaster
+
+
+@pytest.fixture(autouse=True)
+def clear_latest_samples():
+    # The broadcaster is process-wide; samples one test publishes must not reach another's stream
+    sample_broadcaster.clear()
+    yield
+    sample_broadcaster.clear()
@@ -1,7 +1,15 @@
+import configparser
+import multiprocessing
+import queue
 import pytest
 import unittest.mock as mock
 from pathlib import Path
+import signal
 import sqlite3
+import subprocess
+import sys
+import threading
+import time
 import app
 
 # Mock the logger to prevent actual logging during tests
@@ -33,14 +41,21 @@ ssh_key_path =
     yield
     app.CONFIG_FILE = original_config_file # Restore original path
 
+@pytest.fixture(autouse=True)
+def reset_device_pool():
+    yield
+    app.device_pool.configure([])
+
 @pytest.fixture
 def mock_config():
     with mock.patch('app.configparser.ConfigParser') as MockConfigParser:
         mock_config_instance = MockConfigParser.return_value
-        mock_config_instance.getint.side_effect = lambda section, option: {
+        mock_config_instance.getint.side_effect = lambda section, option, fallback=None: {
             ('apcmagic', 'shutdown_threshold'): 20,
             ('apcmagic', 'monitor_interval_seconds'): 1,
-        }[(section, option)]
+        }.get((section, option), fallback)
+        mock_config_instance.getfloat.side_effect = lambda section, option, fallback=None: fallback
+        mock_config_instance.getboolean.side_effect = lambda section, option, fallback=None: fallback
         mock_config_instance.get.side_effect = lambda section, option, fallback=None: {
             ('ubiquiti', 'hosts'): '192.168.1.1',
             ('ubiquiti', 'username'): 'testuser',
@@ -50,9 +65,9 @@ def mock_config():
         yield
 
 @pytest.fixture
-def mock_apcaccess_get_parse():
-    with mock.patch('apcaccess.status.get') as _mock_get,          mock.patch('apcaccess.status.parse') as _mock_parse:
-        _mock_get.return_value = "raw_status_string"
+def mock_nis_fetch_parse():
+    with mock.patch('nis_client.NISClient.fetch') as _mock_fetch,          mock.patch('nis_client.parse_status') as _mock_parse:
+        _mock_fetch.return_value = "raw_status_string"
         _mock_parse.return_value = {
             'STATUS': 'ONLINE',
             'BCHARGE': '100.0',
@@ -61,7 +76,20 @@ def mock_apcaccess_get_parse():
             'LINEV': '120.0',
             'BATTV': '13.0',
         }
-        yield _mock_get, _mock_parse
+        yield _mock_fetch, _mock_parse
+
+def stop_after_polls(mock_fetch, polls=1):
+    """Returns a stop event for monitor_ups() that is set by the mocked NIS fetch on its polls-th call."""
+    stop = threading.Event()
+    outcome = mock_fetch.side_effect
+    def fetch(*args, **kwargs):
+        if mock_fetch.call_count >= polls:
+            stop.set()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return mock_fetch.return_value
+    mock_fetch.side_effect = fetch
+    return stop
 
 
 
@@ -87,21 +115,22 @@ def mock_paramiko_sshclient():
 
 @pytest.fixture
 def mock_sqlite3_connect():
-    with mock.patch('app.sqlite3.connect') as _mock_connect:
+    with mock.patch('app.sqlite3.connect') as _mock_connect, mock.patch('app.storage.migrate'):
         mock_conn = mock.Mock()
         mock_cursor = mock.Mock()
         mock_conn.cursor.return_value = mock_cursor
+        # No power events left open by a previous run
+        mock_conn.execute.return_value.fetchall.return_value = []
         _mock_connect.return_value = mock_conn
         yield _mock_connect
 
 
 def test_setup_database(mock_sqlite3_connect, mock_config):
     app._load_configuration()
-    app.setup_database()
+    with mock.patch('app.storage.migrate') as mock_migrate:
+        app.setup_database()
     mock_sqlite3_connect.assert_called_once_with(app.DATABASE_FILE)
-    mock_sqlite3_connect.return_value.cursor.assert_called_once()
-    mock_sqlite3_connect.return_value.cursor.return_value.execute.assert_called_once()
-    mock_sqlite3_connect.return_value.commit.assert_called_once()
+    mock_migrate.assert_called_once_with(mock_sqlite3_connect.return_value)
     mock_sqlite3_connect.return_value.close.assert_called_once()
 
 def test_shutdown_ubiquiti_devices_no_devices(mock_paramiko_sshclient, mock_logger, mock_config):
@@ -117,7 +146,7 @@ def test_shutdown_ubiquiti_devices_success_password(mock_paramiko_sshclient, moc
     app.UBIQUITI_DEVICES.append({'host': '192.168.1.1', 'username': 'testuser', 'password': 'testpass'})
     app.shutdown_ubiquiti_devices()
     mock_paramiko_sshclient.return_value.connect.assert_called_once_with(
-        '192.168.1.1', username='testuser', password='testpass', key_filename=None, timeout=10
+        '192.168.1.1', port=22, username='testuser', password='testpass', key_filename=None, timeout=10
     )
     mock_paramiko_sshclient.return_value.exec_command.assert_called_once_with("poweroff")
     mock_paramiko_sshclient.return_value.close.assert_called_once()
@@ -133,7 +162,7 @@ def test_shutdown_ubiquiti_devices_success_ssh_key(mock_paramiko_sshclient, mock
     app.UBIQUITI_DEVICES.append({'host': '192.168.1.2', 'username': 'testuser', 'key_filename': str(ssh_key_file)})
     app.shutdown_ubiquiti_devices()
     mock_paramiko_sshclient.return_value.connect.assert_called_once_with(
-        '192.168.1.2', username='testuser', password=None, key_filename=str(ssh_key_file), timeout=10
+        '192.168.1.2', port=22, username='testuser', password=None, key_filename=str(ssh_key_file), timeout=10
     )
     mock_paramiko_sshclient.return_value.exec_command.assert_called_once_with("poweroff")
     mock_paramiko_sshclient.return_value.close.assert_called_once()
@@ -176,10 +205,201 @@ def test_shutdown_ubiquiti_devices_no_auth_method(mock_paramiko_sshclient, mock_
     )
 
 
-def test_monitor_ups_normal_operation(mock_apcaccess_get_parse, mock_sqlite3_connect, mock_logger, mock_config):
+def test_shutdown_ubiquiti_devices_runs_in_parallel(mock_paramiko_sshclient, mock_logger, mock_config):
+    app._load_configuration()
+    app.UBIQUITI_DEVICES.clear()
+    app.UBIQUITI_DEVICES.extend(
+        {'host': f'192.168.1.{i}', 'username': 'testuser', 'password': 'testpass'} for i in range(10)
+    )
+    mock_paramiko_sshclient.return_value.connect.side_effect = lambda *args, **kwargs: time.sleep(0.2)
+
+    started = time.monotonic()
+    app.shutdown_ubiquiti_devices()
+
+    assert time.monotonic() - started < 1.0
+    assert mock_paramiko_sshclient.return_value.exec_command.call_count == 10
+
+def test_shutdown_ubiquiti_devices_respects_deadline(mock_paramiko_sshclient, mock_logger, mock_config):
+    app._load_configuration()
+    app.SHUTDOWN_DEADLINE = 0.1
+    app.UBIQUITI_DEVICES.clear()
+    app.UBIQUITI_DEVICES.append({'host': '192.168.1.9', 'username': 'testuser', 'password': 'testpass'})
+    release = threading.Event()
+
+    started = time.monotonic()
+    with mock.patch('app._shutdown_ubiquiti_device', side_effect=lambda device: release.wait(5)):
+        app.shutdown_ubiquiti_devices()
+    release.set()
+
+    assert time.monotonic() - started < 0.5
+    mock_logger.error.assert_any_call("Shutdown of 192.168.1.9 did not finish within 0.1s. Giving up.")
+
+def test_prearmed_sessions_skip_handshake_at_shutdown(mock_paramiko_sshclient, mock_logger, mock_config):
+    app._load_configuration()
+    app.UBIQUITI_DEVICES.clear()
+    app.UBIQUITI_DEVICES.append({'host': '192.168.1.1', 'username': 'testuser', 'password': 'testpass'})
+    app.device_pool.configure(app.UBIQUITI_DEVICES)
+
+    app.prearm_ubiquiti_sessions()
+    mock_paramiko_sshclient.return_value.connect.assert_called_once()
+
+    app.shutdown_ubiquiti_devices()
+    mock_paramiko_sshclient.return_value.connect.assert_called_once()
+    mock_paramiko_sshclient.return_value.exec_command.assert_called_once_with("poweroff")
+    assert not app.device_pool.health()[0]["connected"]
+
+def test_release_prearmed_sessions(mock_paramiko_sshclient, mock_config):
+    app._load_configuration()
+    app.prearm_ubiquiti_sessions()
+    app.release_prearmed_sessions()
+    mock_paramiko_sshclient.return_value.close.assert_called_once()
+    assert not app.device_pool.health()[0]["connected"]
+
+def test_load_ups_targets():
+    config = configparser.ConfigParser()
+    config.read_string(
+        "[ups:rack]\nhost = 10.0.0.5\ninterval_seconds = 2\nfast_interval_seconds = 0.5\nshutdown_threshold = 30\n"
+        "[ups:lab]\nhost = 10.0.0.6\nport = 3552\ntriggers_shutdown = no\n"
+    )
+    rack, lab = app._load_ups_targets(config)
+
+    assert (rack.ups_id, rack.host, rack.port, rack.interval, rack.shutdown_threshold) == (
+        "rack", "10.0.0.5", 3551, 2.0, 30.0
+    )
+    assert rack.fast_interval == 0.5
+    assert (lab.ups_id, lab.port, lab.shutdown_threshold, lab.fast_interval) == ("lab", 3552, None, None)
+
+def test_load_ups_targets_defaults_to_local_apcupsd():
+    [target] = app._load_ups_targets(configparser.ConfigParser())
+    assert (target.ups_id, target.host, target.port) == ("default", "localhost", 3551)
+
+def test_should_shut_down_uses_predicted_runtime():
+    target = app.UPSTarget(interval=10, shutdown_threshold=20)
+    predictor = mock.Mock()
+    sample = app.UPSSample(status=app.UPSStatus.ONBATT, bcharge=15.0, loadpct=10.0, timeleft=None, linev=0.0, battv=24.0)
+
+    # Without a trusted prediction the charge threshold applies
+    predictor.time_to_empty.return_value = None
+    assert app._should_shut_down(target, sample, predictor)
+
+    # Below the threshold but plenty of runtime left: keep going
+    with mock.patch.object(app, "SHUTDOWN_DURATION", 60.0), mock.patch.object(app, "PREDICTION_SAFETY_MARGIN", 0.1):
+        predictor.time_to_empty.return_value = 1000.0
+        assert not app._should_shut_down(target, sample, predictor)
+        # 0.9 * 80s - 60s leaves 12s to spare, more than the next 10s poll needs
+        predictor.time_to_empty.return_value = 80.0
+        assert not app._should_shut_down(target, sample, predictor)
+        # 0.9 * 75s - 60s leaves 7.5s, so waiting for the next poll would be too late
+        predictor.time_to_empty.return_value = 75.0
+        assert app._should_shut_down(target, sample, predictor)
+
+def test_import_defers_heavy_dependencies():
+    probe = (
+        "import sys, app; "
+        "print(sorted(m for m in ('rumps', 'flask', 'werkzeug') if m in sys.modules), "
+        "sorted(m for m in ('paramiko', 'numpy') if type(sys.modules[m]).__name__ == 'module'))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", probe], cwd=Path(app.__file__).parent, capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "[] []"
+
+def test_main_headless_runs_without_menu_bar_app(mock_config):
+    with mock.patch('app.threading.Thread'), \
+         mock.patch('app._start_web_server') as mock_start_web_server, \
+         mock.patch('app._wait_for_signal') as mock_wait_for_signal, \
+         mock.patch.dict(sys.modules, {'rumps_app': None}):
+        app.main(["--headless"])
+    mock_wait_for_signal.assert_called_once()
+    mock_start_web_server.return_value.stop.assert_called_once()
+
+def test_main_without_rumps_asks_for_headless(mock_config):
+    with mock.patch('app.threading.Thread') as mock_thread, \
+         mock.patch.dict(sys.modules, {'rumps_app': None}), \
+         pytest.raises(SystemExit):
+        app.main([])
+    mock_thread.assert_not_called()
+
+@pytest.fixture
+def monitor_processes(monkeypatch):
+    """Makes _supervise_monitor() fork children running `run` instead of the monitor; yields a queue of them."""
+    started = queue.Queue()
+    fork = multiprocessing.get_context("fork")
+
+    class Process(fork.Process):
+        def start(self):
+            super().start()
+            started.put(self)
+
+    monkeypatch.setattr(app, "multiprocessing", mock.Mock(**{"get_context.return_value.Process": Process}))
+    monkeypatch.setattr(app, "MONITOR_RESTART_DELAY", 0.01)
+    return started
+
+def test_supervisor_restarts_monitor_process_terminated_by_someone_else(monitor_processes, monkeypatch):
+    ready = multiprocessing.get_context("fork").Event()
+    def run_until_terminated(status_file):
+        # Exits cleanly on SIGTERM, as the real monitor process does
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        ready.set()
+        time.sleep(60)
+    monkeypatch.setattr(app, "_run_monitor_process", run_until_terminated)
+    stop = threading.Event()
+    supervisor = threading.Thread(target=app._supervise_monitor, args=(stop,))
+    supervisor.start()
+    try:
+        first = monitor_processes.get(timeout=5)
+        assert ready.wait(5)
+        first.terminate()
+        second = monitor_processes.get(timeout=5)
+        assert first.exitcode == 0
+    finally:
+        stop.set()
+        supervisor.join(10)
+    assert not supervisor.is_alive()
+    assert not second.is_alive()
+
+def test_supervisor_leaves_monitor_process_stopped_after_shutdown_sequence(monitor_processes, monkeypatch):
+    monkeypatch.setattr(app, "_run_monitor_process", lambda status_file: sys.exit(app.MONITOR_SHUTDOWN_EXIT))
+    supervisor = threading.Thread(target=app._supervise_monitor, args=(threading.Event(),))
+    supervisor.start()
+    supervisor.join(10)
+    assert not supervisor.is_alive()
+    assert monitor_processes.qsize() == 1
+
+def test_main_with_monitor_process_reports_no_devices(mock_config, monkeypatch):
+    load = app._load_configuration
+    def load_with_monitor_process():
+        load()
+        app.MONITOR_PROCESS = True
+    monkeypatch.setattr(app, "MONITOR_PROCESS", app.MONITOR_PROCESS)
+    monkeypatch.setattr(app, "_load_configuration", load_with_monitor_process)
+    with mock.patch('app.threading.Thread'), \
+         mock.patch('app._follow_monitor'), \
+         mock.patch('app._start_web_server'), \
+         mock.patch('app._wait_for_signal'), \
+         mock.patch.dict(sys.modules, {'rumps_app': None}):
+        app.main(["--headless"])
+    assert app.UBIQUITI_DEVICES
+    assert app.device_pool.health() == []
+
+def test_follow_monitor_serves_samples_published_by_monitor_process(mock_config, tmp_path, monkeypatch):
+    app._load_configuration()
+    monkeypatch.setattr(app, "STATUS_FILE", tmp_path / "status.shm")
+    follower = app._follow_monitor()
+    try:
+        app.SharedStatusWriter(app.STATUS_FILE).publish(
+            app.UPSSample.from_status({"STATUS": "ONBATT", "BCHARGE": "55.0 Percent"})
+        )
+        follower.poll()
+        assert app.status_caches[app.DEFAULT_UPS_ID].get().bcharge == 55.0
+        assert app.sample_broadcaster.latest["BCHARGE"] == 55.0
+    finally:
+        follower.stop()
+
+def test_monitor_ups_normal_operation(mock_nis_fetch_parse, mock_sqlite3_connect, mock_logger, mock_config):
     app._load_configuration()
-    mock_apcaccess_get_parse[0].return_value = "raw_status_string"
-    mock_apcaccess_get_parse[1].return_value = {
+    mock_nis_fetch_parse[0].return_value = "raw_status_string"
+    mock_nis_fetch_parse[1].return_value = {
         'STATUS': 'ONLINE',
         'BCHARGE': '100.0',
         'LOADPCT': '10.0',
@@ -187,22 +407,23 @@ def test_monitor_ups_normal_operation(mock_apcaccess_get_parse, mock_sqlite3_con
         'LINEV': '120.0',
         'BATTV': '13.0',
     }
-    # Simulate running the loop once and then exiting
-    with mock.patch('app.time.sleep', side_effect=InterruptedError):
-        with pytest.raises(InterruptedError):
-            app.monitor_ups()
-
-    mock_apcaccess_get_parse[0].assert_called_once()
-    mock_sqlite3_connect.return_value.cursor.return_value.execute.assert_called_once()
-    mock_sqlite3_connect.return_value.commit.assert_called_once()
-    mock_logger.debug.assert_called_with(f"UPS Status: {mock_apcaccess_get_parse[1].return_value}")
+    mock_logger.reset_mock()
+    # Run the loop for one poll
+    app.monitor_ups(stop=stop_after_polls(mock_nis_fetch_parse[0]))
+
+    mock_nis_fetch_parse[0].assert_called_once()
+    mock_sqlite3_connect.return_value.executemany.assert_called_once()
+    # Once when power events left open by a previous run are closed, once when the sample is written
+    assert mock_sqlite3_connect.return_value.commit.call_count == 2
+    mock_logger.debug.assert_called_once()
+    assert mock_logger.debug.call_args[0][0].startswith("UPS Status: UPSSample(status=<UPSStatus.ONLINE")
     mock_logger.warning.assert_not_called()
-    mock_logger.info.assert_not_called()
+    mock_logger.info.assert_called_once_with("Database setup complete.")
 
-def test_monitor_ups_shutdown_triggered(mock_apcaccess_get_parse, mock_sqlite3_connect, mock_subprocess_run, mock_logger, mock_config):
+def test_monitor_ups_shutdown_triggered(mock_nis_fetch_parse, mock_sqlite3_connect, mock_subprocess_run, mock_logger, mock_config):
     app._load_configuration()
-    mock_apcaccess_get_parse[0].return_value = "raw_status_string"
-    mock_apcaccess_get_parse[1].return_value = {
+    mock_nis_fetch_parse[0].return_value = "raw_status_string"
+    mock_nis_fetch_parse[1].return_value = {
         'STATUS': 'ONBATT',
         'BCHARGE': '15.0',
         'LOADPCT': '10.0',
@@ -215,30 +436,29 @@ def test_monitor_ups_shutdown_triggered(mock_apcaccess_get_parse, mock_sqlite3_c
 
     with mock.patch('app.sys.exit') as mock_sys_exit:
         with mock.patch('app.shutdown_ubiquiti_devices') as mock_shutdown_ubiquiti_devices:
-            app.monitor_ups()
+            # sys.exit is mocked, so the loop carries on until stopped
+            app.monitor_ups(stop=stop_after_polls(mock_nis_fetch_parse[0]))
 
             mock_logger.warning.assert_called_with("UPS power lost and battery threshold reached. Initiating shutdown sequence...")
             mock_shutdown_ubiquiti_devices.assert_called_once()
-            mock_logger.info.assert_called_with("Shutting down local machine...")
+            mock_logger.info.assert_any_call("Shutting down local machine...")
             # subprocess.run is commented out in app.py for safety, so we assert it's not called
             mock_subprocess_run.assert_not_called()
             mock_logger.info.assert_called_with("Shutdown sequence complete. Exiting.")
-            mock_sys_exit.assert_called_once_with(0)
+            mock_sys_exit.assert_called_once_with(app.MONITOR_SHUTDOWN_EXIT)
 
-def test_monitor_ups_apcaccess_failure(mock_apcaccess_get_parse, mock_logger, mock_config):
+def test_monitor_ups_nis_failure(mock_nis_fetch_parse, mock_sqlite3_connect, mock_logger, mock_config):
     app._load_configuration()
-    mock_apcaccess_get_parse[0].side_effect = Exception("Connection refused")
+    mock_nis_fetch_parse[0].side_effect = Exception("Connection refused")
 
-    with mock.patch('app.time.sleep', side_effect=InterruptedError):
-        with pytest.raises(InterruptedError):
-            app.monitor_ups()
+    app.monitor_ups(stop=stop_after_polls(mock_nis_fetch_parse[0]))
 
     mock_logger.error.assert_called_with("Failed to get status from apcupsd. Is it running? Error: Connection refused")
 
-def test_monitor_ups_sqlite_error(mock_apcaccess_get_parse, mock_sqlite3_connect, mock_logger, mock_config):
+def test_monitor_ups_sqlite_error(mock_nis_fetch_parse, mock_sqlite3_connect, mock_logger, mock_config):
     app._load_configuration()
-    mock_apcaccess_get_parse[0].return_value = "raw_status_string"
-    mock_apcaccess_get_parse[1].return_value = {
+    mock_nis_fetch_parse[0].return_value = "raw_status_string"
+    mock_nis_fetch_parse[1].return_value = {
         'STATUS': 'ONLINE',
         'BCHARGE': '100.0',
         'LOADPCT': '10.0',
@@ -246,12 +466,11 @@ def test_monitor_ups_sqlite_error(mock_apcaccess_get_parse, mock_sqlite3_connect
         'LINEV': '120.0',
         'BATTV': '13.0',
     }
-    mock_sqlite3_connect.return_value.cursor.return_value.execute.side_effect = sqlite3.Error("DB Error")
+    mock_sqlite3_connect.return_value.executemany.side_effect = sqlite3.Error("DB Error")
 
-    with mock.patch('app.time.sleep', side_effect=InterruptedError):
+    with mock.patch('app.storage.migrate', side_effect=sqlite3.Error("DB Error")):
         with mock.patch('app.sys.exit') as mock_sys_exit:
-            with pytest.raises(InterruptedError):
-                app.monitor_ups()
+            app.monitor_ups(stop=stop_after_polls(mock_nis_fetch_parse[0]))
     mock_sys_exit.assert_called_once_with(1)
 
-    mock_logger.error.assert_called_with("Database error in monitoring loop: DB Error")
+    mock_logger.error.assert_any_call("Database error in monitoring loop: DB Error")
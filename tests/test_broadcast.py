@@ -0,0 +1,48 @@
+from broadcast import SampleBroadcaster
+
+
+def test_publish_reaches_every_subscriber():
+    broadcaster = SampleBroadcaster()
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+    broadcaster.publish({'STATUS': 'ONLINE'})
+    assert first.get_nowait() == {'STATUS': 'ONLINE'}
+    assert second.get_nowait() == {'STATUS': 'ONLINE'}
+    assert broadcaster.latest == {'STATUS': 'ONLINE'}
+
+def test_unsubscribed_queue_receives_nothing():
+    broadcaster = SampleBroadcaster()
+    subscription = broadcaster.subscribe()
+    broadcaster.unsubscribe(subscription)
+    broadcaster.publish({'STATUS': 'ONLINE'})
+    assert subscription.empty()
+
+def test_slow_subscriber_drops_oldest_samples():
+    broadcaster = SampleBroadcaster(queue_size=2)
+    subscription = broadcaster.subscribe()
+    for i in range(5):
+        broadcaster.publish({'seq': i})
+    assert subscription.get_nowait() == {'seq': 3}
+    assert subscription.get_nowait() == {'seq': 4}
+
+def test_latest_sample_is_kept_per_ups():
+    broadcaster = SampleBroadcaster()
+    broadcaster.publish({'ups_id': 'a', 'seq': 0})
+    broadcaster.publish({'ups_id': 'b', 'seq': 1})
+    broadcaster.publish({'ups_id': 'a', 'seq': 2})
+    assert broadcaster.latest == {'ups_id': 'a', 'seq': 2}
+    assert broadcaster.latest_by_ups == [{'ups_id': 'a', 'seq': 2}, {'ups_id': 'b', 'seq': 1}]
+
+def test_clear_forgets_latest_samples():
+    broadcaster = SampleBroadcaster()
+    broadcaster.publish({'ups_id': 'a', 'seq': 0})
+    broadcaster.clear()
+    assert broadcaster.latest is None
+    assert broadcaster.latest_by_ups == []
+
+def test_disconnect_all_ends_every_subscription():
+    broadcaster = SampleBroadcaster(queue_size=1)
+    subscription = broadcaster.subscribe()
+    broadcaster.publish({'seq': 0})
+    broadcaster.disconnect_all()
+    assert subscription.get_nowait() is None
@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+import storage
+from events import EventDetector, EventRecorder, close_interrupted_events, event_summary, query_events
+from sample import UPSSample, UPSStatus
+
+START = 1_750_000_000
+FIELDS = {"NOMINV": "120 Volts", "NOMPOWER": "900 Watts"}
+
+
+def make_sample(t, status="ONLINE", bcharge=100.0, loadpct=50.0, linev=120.0, ups_id="default", fields=FIELDS):
+    return UPSSample(
+        status=UPSStatus.parse(status), bcharge=bcharge, loadpct=loadpct, timeleft=None, linev=linev, battv=27.0,
+        ups_id=ups_id, timestamp=START + t, monotonic=float(t), fields=fields,
+    )
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    storage.migrate(conn)
+    yield conn
+    conn.close()
+
+def kinds(events):
+    return sorted(event.kind for event in events)
+
+def test_outage_with_low_battery():
+    detector = EventDetector()
+    assert detector.observe(make_sample(0)) == ([], [])
+    started, _ = detector.observe(make_sample(10, "ONBATT", bcharge=90.0, linev=0.0))
+    assert kinds(started) == ["onbatt"]
+    started, _ = detector.observe(make_sample(20, "ONBATT LOWBATT", bcharge=20.0, linev=0.0))
+    assert kinds(started) == ["lowbatt"]
+    _, ended = detector.observe(make_sample(30, "ONLINE", bcharge=20.0))
+    assert kinds(ended) == ["lowbatt", "onbatt"]
+
+    onbatt = next(event for event in ended if event.kind == "onbatt")
+    assert (onbatt.start_time, onbatt.end_time, onbatt.min_bcharge, onbatt.min_linev) == (
+        START + 10, START + 30, 20.0, 0.0
+    )
+    # 20s at half of 900 W
+    assert onbatt.energy_wh == pytest.approx(450 * 20 / 3600)
+
+def test_no_energy_without_nominal_power():
+    detector = EventDetector()
+    detector.observe(make_sample(0, "ONBATT", fields={}))
+    _, [event] = detector.observe(make_sample(10, fields={}))
+    assert event.energy_wh is None
+
+    detector = EventDetector(nominal_power=1000.0)
+    detector.observe(make_sample(0, "ONBATT", fields={}))
+    _, [event] = detector.observe(make_sample(36, fields={}))
+    assert event.energy_wh == pytest.approx(5.0)
+
+def test_sag_and_swell_with_hysteresis():
+    detector = EventDetector(line_tolerance=0.1)
+    assert kinds(detector.observe(make_sample(0, linev=107.0))[0]) == ["sag"]
+    # Still 5% low: the sag goes on until the line is within half the tolerance
+    assert detector.observe(make_sample(5, linev=113.0)) == ([], [])
+    assert kinds(detector.observe(make_sample(10, linev=115.0))[1]) == ["sag"]
+    assert kinds(detector.observe(make_sample(15, linev=133.0))[0]) == ["swell"]
+    # Losing the line is an outage, not a sag
+    started, ended = detector.observe(make_sample(20, "ONBATT", linev=0.0))
+    assert (kinds(started), kinds(ended)) == (["onbatt"], ["swell"])
+
+def test_nominal_voltage_overrides_reported():
+    detector = EventDetector(nominal_voltage=230.0)
+    assert kinds(detector.observe(make_sample(0, linev=120.0))[0]) == ["sag"]
+
+def test_recorder_stores_events_as_they_start_and_end(conn):
+    recorder = EventRecorder(conn)
+    recorder.observe(make_sample(0))
+    recorder.observe(make_sample(10, "ONBATT OVERLOAD", bcharge=80.0, loadpct=110.0, linev=0.0))
+    recorder.observe(make_sample(10, "ONBATT", bcharge=70.0, linev=0.0, ups_id="rack"))
+
+    ongoing = query_events(conn.cursor(), START, START + 100)
+    assert kinds(ongoing) == ["onbatt", "overload"]
+    assert all(event.end_time is None for event in ongoing)
+
+    recorder.observe(make_sample(20, "ONBATT", bcharge=60.0, loadpct=90.0, linev=0.0))
+    recorder.observe(make_sample(70, bcharge=50.0))
+    [onbatt] = query_events(conn.cursor(), START, START + 100, kind="onbatt")
+    assert (onbatt.start_time, onbatt.end_time, onbatt.min_bcharge, onbatt.max_loadpct) == (
+        START + 10, START + 70, 60.0, 110.0
+    )
+    assert onbatt.to_dict()["duration"] == 60
+
+    summary = event_summary(conn.cursor(), START, START + 100)
+    assert summary["onbatt"]["count"] == 1
+    assert summary["onbatt"]["seconds"] == 60
+    assert summary["overload"]["seconds"] == 10
+    # The rack UPS is still on battery; ongoing events count up to the end of the window
+    assert event_summary(conn.cursor(), START, START + 100, "rack")["onbatt"]["seconds"] == 90
+
+def test_interrupted_events_are_closed_from_stored_samples(conn):
+    conn.execute("INSERT INTO power_events (ups_id, kind, start_time) VALUES ('default', 'onbatt', ?)", (START,))
+    conn.executemany(
+        "INSERT INTO ups_data (timestamp, ups_id, status, bcharge, loadpct, linev) VALUES (?, 'default', ?, ?, ?, ?)",
+        [(START - 10, "ONLINE", 100.0, 40.0, 120.0), (START, "ONBATT", 95.0, 40.0, 0.0),
+         (START + 30, "ONBATT", 80.0, 45.0, 0.0)],
+    )
+    assert close_interrupted_events(conn) == 1
+    [event] = query_events(conn.cursor(), START, START)
+    assert (event.end_time, event.min_bcharge, event.max_loadpct, event.energy_wh) == (START + 30, 80.0, 45.0, None)
+    assert close_interrupted_events(conn) == 0
+
+def test_query_events_pages_newest_first(conn):
+    conn.executemany(
+        "INSERT INTO power_events (ups_id, kind, start_time, end_time) VALUES ('default', ?, ?, ?)",
+        [("onbatt", START + i * 100, START + i * 100 + 10) for i in range(5)] + [("sag", START + 250, START + 260)],
+    )
+    events = query_events(conn.cursor(), START + 100, START + 400, limit=3)
+    assert [(event.kind, event.start_time) for event in events] == [
+        ("onbatt", START + 400), ("onbatt", START + 300), ("sag", START + 250),
+    ]
+    assert event_summary(conn.cursor(), START, START + 1000) == {
+        "onbatt": {"count": 5, "seconds": 50, "energy_wh": None},
+        "sag": {"count": 1, "seconds": 10, "energy_wh": None},
+    }
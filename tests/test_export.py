@@ -0,0 +1,99 @@
+import io
+import math
+import sqlite3
+
+import pytest
+
+import storage
+from export import EXPORT_COLUMNS, columnar_chunks, csv_chunks, read_columnar
+
+ROWS = [
+    (1_750_000_000, "default", "ONLINE", 100.0, 10.0, 60.0, 120.0, 27.1),
+    (1_750_000_005, "default", "ONBATT", 99.5, 12.5, 58.0, None, 26.8),
+    (1_750_000_010, "default", None, 99.0, 12.5, 57.5, 0.0, 26.5),
+]
+# Enough rows that keeping them, in any form, would outgrow the memory allowance of the export tests
+LARGE_ROWS = 300_000
+
+
+def current_rss() -> int | None:
+    """Returns this process's resident set size in bytes, where /proc exposes it."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * 4096
+    except OSError:
+        return None
+
+def test_csv_export():
+    text = "".join(csv_chunks([ROWS[:2], ROWS[2:]]))
+    assert text.splitlines() == [
+        ",".join(EXPORT_COLUMNS),
+        "2025-06-15 15:06:40,default,ONLINE,100.0,10.0,60.0,120.0,27.1",
+        "2025-06-15 15:06:45,default,ONBATT,99.5,12.5,58.0,,26.8",
+        "2025-06-15 15:06:50,default,,99.0,12.5,57.5,0.0,26.5",
+    ]
+
+def test_columnar_export_round_trip():
+    data = b"".join(columnar_chunks([ROWS[:2], ROWS[2:]]))
+    groups = list(read_columnar(io.BytesIO(data)))
+    assert [len(group["timestamp"]) for group in groups] == [2, 1]
+
+    decoded = [
+        tuple(group[column][i] for column in EXPORT_COLUMNS)
+        for group in groups
+        for i in range(len(group["timestamp"]))
+    ]
+    for row, expected in zip(decoded, ROWS):
+        assert row[:3] == expected[:3]
+        assert all(
+            math.isnan(value) if want is None else value == want for value, want in zip(row[3:], expected[3:])
+        )
+
+def test_columnar_export_detects_truncation():
+    data = b"".join(columnar_chunks([ROWS]))
+    with pytest.raises(ValueError):
+        list(read_columnar(io.BytesIO(data[:-4])))
+
+@pytest.fixture(scope="module")
+def large_database(tmp_path_factory):
+    """A database of LARGE_ROWS synthetic samples, shared by the memory tests."""
+    path = tmp_path_factory.mktemp("export") / "export.db"
+    conn = sqlite3.connect(path)
+    storage.migrate(conn)
+    conn.execute(
+        """
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO ups_data (timestamp, ups_id, status, bcharge, loadpct, timeleft, linev, battv)
+        SELECT 1700000000 + i * 5, 'default', CASE WHEN i % 1000 < 50 THEN 'ONBATT' ELSE 'ONLINE' END,
+            100 - i % 100, 20 + i % 7, 60, 120 + i % 3, 27.0
+        FROM n
+        """,
+        (LARGE_ROWS - 1,),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+@pytest.mark.parametrize("encode", [csv_chunks, columnar_chunks])
+def test_export_memory_stays_flat(large_database, encode):
+    if current_rss() is None:
+        pytest.skip("needs /proc to read the resident set size")
+    conn = sqlite3.connect(large_database)
+    exported = 0
+
+    def counted(batches):
+        nonlocal exported
+        for batch in batches:
+            exported += len(batch)
+            yield batch
+
+    # Sample RSS every 20k rows; it must stop growing once the export is under way
+    rss = []
+    for chunk in encode(counted(storage.iter_samples(conn.cursor(), 0, 2**40))):
+        if exported % 20_000 == 0:
+            rss.append(current_rss())
+    conn.close()
+
+    assert exported == LARGE_ROWS
+    # Growth well below a single copy of the rows shows nothing accumulates
+    assert max(rss) - rss[1] < 8 * 2**20
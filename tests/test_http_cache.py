@@ -0,0 +1,32 @@
+import gzip
+
+from http_cache import GZIP_MIN_BYTES, BodyCache, make_etag
+
+
+def test_body_cache_builds_once_per_key():
+    cache = BodyCache()
+    builds = []
+    def build():
+        builds.append(1)
+        return b"x" * GZIP_MIN_BYTES
+
+    body, gzipped = cache.get("a", build)
+    assert cache.get("a", build) == (body, gzipped)
+    assert len(builds) == 1
+    assert gzip.decompress(gzipped) == body
+
+def test_body_cache_skips_gzip_for_small_bodies():
+    assert BodyCache().get("a", lambda: b"[]") == (b"[]", None)
+
+def test_body_cache_evicts_least_recently_used():
+    cache = BodyCache(max_entries=2)
+    cache.get("a", lambda: b"a")
+    cache.get("b", lambda: b"b")
+    cache.get("a", lambda: b"stale")
+    cache.get("c", lambda: b"c")
+    assert cache.get("a", lambda: b"rebuilt") == (b"a", None)
+    assert cache.get("b", lambda: b"rebuilt") == (b"rebuilt", None)
+
+def test_make_etag_depends_on_every_part_of_key():
+    assert make_etag(("default", 1, (5, None))) == make_etag(("default", 1, (5, None)))
+    assert make_etag(("default", 1, (5, None))) != make_etag(("default", 1, (6, None)))
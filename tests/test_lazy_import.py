@@ -0,0 +1,26 @@
+import sys
+
+import pytest
+
+from lazy_import import lazy_import
+
+
+@pytest.fixture
+def probe(tmp_path, monkeypatch):
+    (tmp_path / "lazy_probe.py").write_text(
+        "from pathlib import Path\nPath(__file__).with_suffix('.loaded').touch()\nVALUE = 42\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield tmp_path / "lazy_probe.loaded"
+    sys.modules.pop("lazy_probe", None)
+
+def test_module_is_loaded_on_first_attribute_access(probe):
+    module = lazy_import("lazy_probe")
+    assert not probe.exists()
+    assert module.VALUE == 42
+    assert probe.exists()
+    assert lazy_import("lazy_probe") is sys.modules["lazy_probe"]
+
+def test_missing_module_fails_immediately():
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("no_such_module_anywhere")
@@ -0,0 +1,55 @@
+import pytest
+
+from metrics import Counter, GaugeCallback, Histogram, Registry
+
+
+def test_counter_renders_per_label_set():
+    counter = Counter("polls_total", "Polls.", ["ups"])
+    counter.inc(ups="rack")
+    counter.inc(2, ups='a"b')
+    assert counter.value(ups="rack") == 1
+    assert counter.render() == (
+        '# HELP polls_total Polls.\n'
+        '# TYPE polls_total counter\n'
+        'polls_total{ups="rack"} 1\n'
+        'polls_total{ups="a\\"b"} 2\n'
+    )
+
+def test_counter_without_labels_starts_at_zero():
+    assert Counter("writes_total", "Writes.").render().endswith("writes_total 0\n")
+
+def test_wrong_labels_are_rejected():
+    with pytest.raises(ValueError):
+        Counter("polls_total", "Polls.", ["ups"]).inc(host="x")
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("poll_seconds", "Poll time.", ["ups"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ups="rack")
+    assert histogram.count(ups="rack") == 4
+    assert histogram.render().splitlines()[2:] == [
+        'poll_seconds_bucket{ups="rack",le="0.1"} 2',
+        'poll_seconds_bucket{ups="rack",le="1.0"} 3',
+        'poll_seconds_bucket{ups="rack",le="+Inf"} 4',
+        'poll_seconds_sum{ups="rack"} 3.65',
+        'poll_seconds_count{ups="rack"} 4',
+    ]
+
+def test_histogram_times_blocks_that_raise():
+    histogram = Histogram("poll_seconds", "Poll time.")
+    with pytest.raises(OSError):
+        with histogram.time():
+            raise OSError
+    assert histogram.count() == 1
+
+def test_gauge_callback_skips_missing_values():
+    gauge = GaugeCallback("charge", "Charge.", ["ups"], lambda: [(("rack",), 90.0), (("spare",), None)])
+    assert gauge.render().splitlines()[2:] == ['charge{ups="rack"} 90.0']
+
+def test_registry_renders_in_order_and_rejects_duplicates():
+    registry = Registry()
+    registry.register(Counter("b_total", "B."))
+    registry.register(Counter("a_total", "A."))
+    assert registry.render().index("b_total") < registry.render().index("a_total")
+    with pytest.raises(ValueError):
+        registry.register(Counter("a_total", "A again."))
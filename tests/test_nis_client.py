@@ -0,0 +1,136 @@
+import asyncio
+import struct
+import threading
+import time
+
+import pytest
+
+from nis_client import BackgroundLoop, NISClient, nis_loop, parse_status
+from sample import UPSStatus
+
+STATUS_LINES = [
+    "APC      : 001,036,0879",
+    "UPSNAME  : rack",
+    "STATUS   : ONBATT ",
+    "LINEV    : 0.0 Volts",
+    "LOADPCT  : 12.0 Percent",
+    "BCHARGE  : 87.0 Percent",
+    "TIMELEFT : 45.5 Minutes",
+    "BATTV    : 13.1 Volts",
+    "END APC  : 2025-06-27 10:00:00 +0000",
+]
+
+
+class FakeNISServer:
+    """A minimal apcupsd NIS that answers "status" with STATUS_LINES."""
+
+    def __init__(self) -> None:
+        self.port = None
+        self.connections = 0
+        self.requests = 0
+        # Mimic daemons that close the connection after every response
+        self.close_after_response = False
+        # Seconds to stall before answering, to exercise read timeouts
+        self.delay = 0.0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                (size,) = struct.unpack(">H", await reader.readexactly(2))
+                assert await reader.readexactly(size) == b"status"
+                self.requests += 1
+                await asyncio.sleep(self.delay)
+                for line in STATUS_LINES:
+                    data = f"{line}\n".encode()
+                    writer.write(struct.pack(">H", len(data)) + data)
+                writer.write(b"\x00\x00")
+                await writer.drain()
+                if self.close_after_response:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+@pytest.fixture
+def nis_server():
+    fake = FakeNISServer()
+    loop = BackgroundLoop()
+    server = loop.run(asyncio.start_server(fake.handle, "127.0.0.1", 0))
+    fake.port = server.sockets[0].getsockname()[1]
+    yield fake
+
+    async def stop():
+        server.close()
+        await server.wait_closed()
+    loop.run(stop())
+
+def test_parse_status_strips_units():
+    status = parse_status(STATUS_LINES)
+    assert status["BCHARGE"] == "87.0"
+    assert status["TIMELEFT"] == "45.5"
+    assert status["END APC"] == "2025-06-27 10:00:00 +0000"
+    assert parse_status(["LINEV : 120.0 Volts"], strip_units=False) == {"LINEV": "120.0 Volts"}
+
+def test_parse_status_keeps_free_text_fields():
+    status = parse_status(["MODEL    : Smart-UPS 1500 C", "NOMPOWER : 900 Watts", "LINEV    : 120.0 Volts"])
+    assert status == {"MODEL": "Smart-UPS 1500 C", "NOMPOWER": "900 Watts", "LINEV": "120.0"}
+
+def test_sample_is_typed(nis_server):
+    client = NISClient("127.0.0.1", nis_server.port)
+    sample = nis_loop.run(client.sample("rack"))
+
+    assert sample.ups_id == "rack"
+    assert sample.status == UPSStatus.ONBATT
+    assert (sample.bcharge, sample.loadpct, sample.timeleft, sample.linev, sample.battv) == (87.0, 12.0, 45.5, 0.0, 13.1)
+    assert sample.fields["UPSNAME"] == "rack"
+    nis_loop.run(client.close())
+
+def test_connection_is_reused(nis_server):
+    client = NISClient("127.0.0.1", nis_server.port)
+    for _ in range(3):
+        nis_loop.run(client.fetch())
+    assert (nis_server.connections, nis_server.requests) == (1, 3)
+    nis_loop.run(client.close())
+
+def test_reconnects_when_daemon_closes_connection(nis_server):
+    nis_server.close_after_response = True
+    client = NISClient("127.0.0.1", nis_server.port)
+    for _ in range(3):
+        assert nis_loop.run(client.fetch()) == STATUS_LINES
+    assert nis_server.connections == 3
+    nis_loop.run(client.close())
+
+def test_read_timeout(nis_server):
+    nis_server.delay = 1.0
+    client = NISClient("127.0.0.1", nis_server.port, read_timeout=0.1)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        nis_loop.run(client.fetch())
+    assert time.monotonic() - started < 0.5
+
+    # The half-read connection is dropped and the next poll starts cleanly
+    nis_server.delay = 0.0
+    assert nis_loop.run(client.fetch()) == STATUS_LINES
+    assert nis_server.connections == 2
+
+def test_connection_refused():
+    client = NISClient("127.0.0.1", 1)
+    with pytest.raises(ConnectionRefusedError):
+        nis_loop.run(client.fetch())
+
+def test_many_endpoints_share_one_thread(nis_server):
+    clients = [NISClient("127.0.0.1", nis_server.port) for _ in range(200)]
+    threads = threading.active_count()
+
+    async def poll_all():
+        return await asyncio.gather(*(client.sample(str(i)) for i, client in enumerate(clients)))
+
+    async def close_all():
+        await asyncio.gather(*(client.close() for client in clients))
+
+    samples = nis_loop.run(poll_all())
+    assert len(samples) == 200
+    assert threading.active_count() == threads
+    nis_loop.run(close_all())
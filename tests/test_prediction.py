@@ -0,0 +1,105 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import storage
+from prediction import DischargeModel, RuntimePredictor, discharge_sums, load_discharge_history
+from sample import UPSSample, UPSStatus
+
+
+def make_sample(monotonic, bcharge, loadpct=50.0, battv=26.0, status="ONBATT"):
+    return UPSSample(
+        status=UPSStatus.parse(status), bcharge=bcharge, loadpct=loadpct, timeleft=None,
+        linev=0.0, battv=battv, monotonic=monotonic,
+    )
+
+def discharge(predictor, start, seconds, load, rate, volt_rate=0.0, step=5):
+    """Feeds an outage draining `rate` % of charge per second at `load` into the predictor."""
+    for t in range(0, seconds + 1, step):
+        predictor.observe(make_sample(start + t, 100.0 - rate * t, load, 26.0 - volt_rate * t))
+    predictor.observe(make_sample(start + seconds + step, 100.0, load, status="ONLINE"))
+
+def test_single_load_is_taken_as_proportional():
+    model = DischargeModel()
+    t = np.arange(0, 600, 5.0)
+    model.add(discharge_sums(t, np.full_like(t, 40.0), 100.0 - 0.08 * t))
+    assert model.seconds == pytest.approx(595)
+    assert model.rate(40.0) == pytest.approx(0.08)
+    assert model.rate(20.0) == pytest.approx(0.04)
+
+def test_fits_drain_versus_load():
+    model = DischargeModel()
+    # Drain 0.01 + 0.002·load %/s, observed at 20% and 60% load
+    for load in (20.0, 60.0):
+        t = np.arange(0, 300, 5.0)
+        model.add(discharge_sums(t, np.full_like(t, load), 100.0 - (0.01 + 0.002 * load) * t))
+    assert model.rate(40.0) == pytest.approx(0.09)
+    assert model.rate(0.0) == pytest.approx(0.01)
+
+def test_segments_across_gaps_are_ignored():
+    t = np.array([0.0, 5.0, 10.0, 4000.0, 4005.0])
+    sums = discharge_sums(t, np.full(5, 50.0), np.array([100.0, 99.5, 99.0, 100.0, 99.5]))
+    assert sums[0] == 15.0
+    assert sums[3] == pytest.approx(1.5)
+
+def test_no_prediction_until_enough_discharge_seen():
+    predictor = RuntimePredictor(min_fit_seconds=300)
+    discharge(predictor, 0, 200, 50.0, 0.05)
+    assert predictor.time_to_empty(make_sample(1000, 80.0)) is None
+    discharge(predictor, 1000, 200, 50.0, 0.05)
+    assert predictor.time_to_empty(make_sample(2000, 80.0)) == pytest.approx(1600)
+    # Half the load lasts twice as long
+    assert predictor.time_to_empty(make_sample(2000, 80.0, loadpct=25.0)) == pytest.approx(3200)
+
+def test_cutoff_voltage_shortens_runtime():
+    predictor = RuntimePredictor(min_fit_seconds=60, cutoff_battv=23.0)
+    discharge(predictor, 0, 300, 50.0, 0.05, volt_rate=0.002)
+    # Charge would last 1600s, but 25.0 V falls to 23.0 V in 1000s
+    assert predictor.time_to_empty(make_sample(1000, 80.0, battv=25.0)) == pytest.approx(1000)
+
+def test_new_outage_decays_earlier_ones():
+    predictor = RuntimePredictor(history_decay=0.5, min_fit_seconds=0)
+    discharge(predictor, 0, 300, 50.0, 0.1)
+    discharge(predictor, 1000, 300, 50.0, 0.05)
+    # The older, faster outage weighs half as much as the newer one
+    assert predictor.charge.rate(50.0) == pytest.approx((0.5 * 0.1 + 0.05) / 1.5)
+
+def test_history_fit_matches_incremental_fit():
+    live = RuntimePredictor(history_decay=0.5)
+    discharge(live, 0, 300, 50.0, 0.1)
+    discharge(live, 1000, 300, 30.0, 0.05)
+
+    t = np.concatenate((np.arange(0, 301, 5.0), np.arange(1000, 1301, 5.0)))
+    load = np.where(t < 1000, 50.0, 30.0)
+    bcharge = 100.0 - np.where(t < 1000, 0.1 * t, 0.05 * (t - 1000))
+    stored = RuntimePredictor(history_decay=0.5)
+    stored.fit_history(t, load, bcharge, np.full_like(t, 26.0))
+
+    np.testing.assert_allclose(stored.charge.sums, live.charge.sums)
+
+def test_load_discharge_history():
+    conn = sqlite3.connect(":memory:")
+    storage.migrate(conn)
+    conn.executemany(
+        "INSERT INTO ups_data (timestamp, ups_id, status, bcharge, loadpct, battv) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (1000, "default", "ONLINE", 100.0, 40.0, 27.0),
+            (1005, "default", "ONBATT", 99.0, 40.0, 26.0),
+            (1010, "default", "ONBATT LOWBATT", 98.0, 40.0, 25.0),
+            (1010, "rack", "ONBATT", 50.0, 10.0, 25.0),
+        ],
+    )
+    # Minute rollups older than the raw samples fill in, if spent entirely on battery
+    conn.executemany(
+        "INSERT INTO ups_rollup_1m (bucket, ups_id, samples, status, bcharge_avg, loadpct_avg, battv_avg) "
+        "VALUES (?, 'default', 12, ?, ?, 40.0, 26.5)",
+        [(0, "ONBATT", 90.0), (60, "ONLINE,ONBATT", 95.0), (960, "ONBATT", 99.5)],
+    )
+    t, load, bcharge, battv = load_discharge_history(conn.cursor(), "default")
+    assert t.tolist() == [30, 1005, 1010]
+    assert bcharge.tolist() == [90.0, 99.0, 98.0]
+    assert battv.tolist() == [26.5, 26.0, 25.0]
+
+    t, *_ = load_discharge_history(conn.cursor(), "lab")
+    assert len(t) == 0
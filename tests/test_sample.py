@@ -0,0 +1,60 @@
+import pytest
+
+from sample import UPSSample, UPSStatus
+
+STATUS = {
+    'STATUS': 'ONBATT LOWBATT',
+    'BCHARGE': '15.0 Percent',
+    'LOADPCT': '10.0',
+    'TIMELEFT': '5.0 Minutes',
+    'LINEV': '0.0 Volts',
+    'MODEL': 'Back-UPS RS 1500MS2',
+}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ONLINE", UPSStatus.ONLINE),
+    ("ONBATT LOWBATT", UPSStatus.ONBATT | UPSStatus.LOWBATT),
+    ("SHUTTING DOWN", UPSStatus.SHUTTING_DOWN),
+    ("ONLINE MYSTERY", UPSStatus.ONLINE),
+    ("", UPSStatus.NONE),
+    (None, UPSStatus.NONE),
+])
+def test_status_parse(text, expected):
+    assert UPSStatus.parse(text) == expected
+
+def test_status_str_round_trips():
+    assert str(UPSStatus.parse("ONBATT LOWBATT")) == "ONBATT LOWBATT"
+    assert str(UPSStatus.SHUTTING_DOWN) == "SHUTTING DOWN"
+
+def test_from_status_parses_numbers_and_flags():
+    sample = UPSSample.from_status(STATUS)
+    assert sample.on_battery
+    assert UPSStatus.LOWBATT in sample.status
+    assert sample.bcharge == 15.0
+    assert sample.timeleft == 5.0
+    assert sample.linev == 0.0
+    assert sample.battv is None
+
+def test_number_parses_any_field():
+    sample = UPSSample.from_status({**STATUS, 'NOMPOWER': '900 Watts'})
+    assert sample.number('NOMPOWER') == 900.0
+    assert sample.number('NOMINV') is None
+
+def test_to_dict():
+    sample = UPSSample.from_status(STATUS)
+    assert sample.to_dict()["MODEL"] == 'Back-UPS RS 1500MS2'
+    assert sample.to_dict(include_raw=False) == {
+        'STATUS': 'ONBATT LOWBATT',
+        'BCHARGE': 15.0,
+        'LOADPCT': 10.0,
+        'TIMELEFT': 5.0,
+        'LINEV': 0.0,
+        'BATTV': None,
+    }
+
+def test_sample_is_immutable_and_slotted():
+    sample = UPSSample.from_status(STATUS)
+    with pytest.raises(AttributeError):
+        sample.bcharge = 50.0
+    assert not hasattr(sample, '__dict__')
@@ -0,0 +1,68 @@
+from sample import UPSSample, UPSStatus
+from sampling import AdaptiveSampler
+
+
+def make_sample(monotonic, status="ONLINE", bcharge=100.0, loadpct=10.0, linev=120.0):
+    return UPSSample(
+        status=UPSStatus.parse(status), bcharge=bcharge, loadpct=loadpct, timeleft=60.0,
+        linev=linev, battv=13.0, monotonic=monotonic,
+    )
+
+def test_fixed_interval_without_fast_interval():
+    sampler = AdaptiveSampler(60)
+    assert sampler.observe(make_sample(0, status="ONBATT")) == 60
+
+def test_fast_on_battery_until_hold_expires():
+    sampler = AdaptiveSampler(60, 1, fast_hold=30)
+    assert sampler.observe(make_sample(0)) == 60
+    assert sampler.observe(make_sample(60, status="ONBATT", bcharge=99.0)) == 1
+    assert sampler.observe(make_sample(61)) == 1
+    assert sampler.observe(make_sample(89)) == 1
+    assert sampler.observe(make_sample(91)) == 60
+
+def test_fast_when_readings_change_quickly():
+    sampler = AdaptiveSampler(60, 1, rate_thresholds={"loadpct": 5.0}, fast_hold=30)
+    sampler.observe(make_sample(0))
+    # 4% in a minute stays slow; 10% in a minute speeds up
+    assert sampler.observe(make_sample(60, loadpct=14.0)) == 60
+    assert sampler.observe(make_sample(120, loadpct=24.0)) == 1
+
+def test_store_on_change_skips_unchanged_samples_until_heartbeat():
+    sampler = AdaptiveSampler(60, 1, store_on_change=True, heartbeat=300)
+    stored = []
+    for t in range(0, 420, 60):
+        sample = make_sample(t, loadpct=12.0 if t == 120 else 10.0)
+        sampler.observe(sample)
+        if sampler.should_store(sample):
+            stored.append(t)
+    # First sample, the change at 120 and back at 180, then the heartbeat 300s after that
+    assert stored == [0, 120, 180]
+
+    sample = make_sample(480)
+    sampler.observe(sample)
+    assert sampler.should_store(sample)
+
+def test_store_on_change_keeps_every_fast_sample():
+    sampler = AdaptiveSampler(60, 1, store_on_change=True)
+    for t in range(5):
+        sample = make_sample(t, status="ONBATT")
+        sampler.observe(sample)
+        assert sampler.should_store(sample)
+
+def test_stores_everything_by_default():
+    sampler = AdaptiveSampler(60)
+    for t in range(3):
+        sample = make_sample(t * 60)
+        sampler.observe(sample)
+        assert sampler.should_store(sample)
+
+def test_deadband_ignores_small_changes():
+    sampler = AdaptiveSampler(60, store_on_change=True, deadbands={"linev": 1.0})
+    stored = []
+    for t, linev in enumerate([120.0, 120.4, 119.2, 121.0, 122.1]):
+        sample = make_sample(t * 60, linev=linev)
+        sampler.observe(sample)
+        if sampler.should_store(sample):
+            stored.append(linev)
+    # Compared with the last stored value, not the previous sample
+    assert stored == [120.0, 122.1]
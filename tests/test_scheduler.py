@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from metrics import polls_skipped
+from scheduler import OVERRUN_CATCH_UP, PollScheduler, UPSTarget
+
+
+def collect(scheduler, count):
+    results = []
+    for result in scheduler.results():
+        results.append(result)
+        if len(results) == count:
+            break
+    scheduler.shutdown()
+    return results
+
+async def echo(target, scheduled):
+    return target.ups_id
+
+def test_polls_each_target_on_its_interval():
+    slow = UPSTarget(ups_id="slow", interval=1.0)
+    fast = UPSTarget(ups_id="fast", interval=0.05)
+    scheduler = PollScheduler([slow, fast], echo, jitter=0)
+    results = collect(scheduler, 6)
+
+    # The slow target polls first; the fast one is staggered by half its interval
+    assert [ups_id for _, ups_id, _ in results] == ["slow"] + ["fast"] * 5
+    assert all(error is None for _, _, error in results)
+
+def test_hung_target_does_not_delay_others():
+    hung = UPSTarget(ups_id="hung", interval=0.05)
+    healthy = UPSTarget(ups_id="healthy", interval=0.05)
+
+    async def poll(target, scheduled):
+        if target is hung:
+            await asyncio.sleep(5)
+        return target.ups_id
+
+    scheduler = PollScheduler([hung, healthy], poll, jitter=0)
+    started = time.monotonic()
+    results = collect(scheduler, 5)
+
+    assert [ups_id for _, ups_id, _ in results] == ["healthy"] * 5
+    assert time.monotonic() - started < 1.0
+
+def test_polls_share_one_thread():
+    threads = set()
+
+    async def poll(target, scheduled):
+        threads.add(threading.get_ident())
+        await asyncio.sleep(0.5)
+        return target.ups_id
+
+    # Polls outlast the interval, so each target is polled exactly once before its first poll returns
+    targets = [UPSTarget(ups_id=str(i), interval=0.2) for i in range(100)]
+    scheduler = PollScheduler(targets, poll, jitter=0)
+    started = time.monotonic()
+    results = collect(scheduler, 100)
+
+    assert len({ups_id for _, ups_id, _ in results}) == 100
+    assert len(threads) == 1
+    # The polls overlapped instead of running one after another
+    assert time.monotonic() - started < 2.0
+
+def test_poll_errors_are_yielded():
+    async def poll(target, scheduled):
+        raise ConnectionRefusedError("Connection refused")
+
+    scheduler = PollScheduler([UPSTarget(interval=0.05)], poll)
+    [(target, result, error)] = collect(scheduler, 1)
+    assert result is None
+    assert isinstance(error, ConnectionRefusedError)
+
+def test_requires_a_target():
+    with pytest.raises(ValueError):
+        PollScheduler([], echo)
+
+def test_set_interval_reschedules_next_poll():
+    target = UPSTarget(interval=60)
+    scheduler = PollScheduler([target], echo, jitter=0)
+    started = time.monotonic()
+    results = []
+    for result in scheduler.results():
+        results.append(result)
+        if len(results) == 1:
+            # Without this the second poll would be a minute away
+            scheduler.set_interval(target, 0.05)
+        if len(results) == 3:
+            break
+    scheduler.shutdown()
+    assert time.monotonic() - started < 1.0
+
+async def stamp(target, scheduled):
+    return scheduled
+
+def gaps(times):
+    return [b - a for a, b in zip(times, times[1:])]
+
+def test_scheduled_times_stay_on_grid_despite_slow_polls():
+    async def poll(target, scheduled):
+        await asyncio.sleep(0.03)
+        return scheduled
+
+    # Jitter, poll and handling take at most 0.09s of each 0.2s slot, so no poll is ever late enough to be skipped
+    scheduler = PollScheduler([UPSTarget(interval=0.2)], poll, jitter=0.25)
+    results = []
+    for result in scheduler.results():
+        # Slow handling of each result must not push later polls back either
+        time.sleep(0.01)
+        results.append(result[1])
+        if len(results) == 6:
+            break
+    scheduler.shutdown()
+    assert gaps(results) == pytest.approx([0.2] * 5, abs=1e-5)
+
+def test_poll_exceeding_deadline_is_cancelled():
+    cancelled = []
+
+    async def poll(target, scheduled):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(target.ups_id)
+            raise
+
+    started = time.monotonic()
+    [(_, result, error)] = collect(PollScheduler([UPSTarget(interval=0.05, deadline=0.1)], poll), 1)
+    assert isinstance(error, TimeoutError)
+    assert cancelled == ["default"]
+    assert time.monotonic() - started < 1.0
+
+def overrunning(duration):
+    async def poll(target, scheduled):
+        await asyncio.sleep(duration)
+        return scheduled
+    return poll
+
+def test_skip_policy_drops_overdue_polls():
+    skipped = polls_skipped.value(ups="skip")
+    scheduler = PollScheduler([UPSTarget(ups_id="skip", interval=0.05)], overrunning(0.12), jitter=0)
+    scheduled = [result for _, result, _ in collect(scheduler, 3)]
+
+    # Each poll takes two slots more than its own, which are skipped
+    assert gaps(scheduled) == pytest.approx([0.15] * 2, abs=1e-5)
+    assert polls_skipped.value(ups="skip") - skipped >= 4
+
+def test_catch_up_policy_makes_up_overdue_polls():
+    scheduler = PollScheduler([UPSTarget(interval=0.05)], overrunning(0.08), jitter=0, overrun=OVERRUN_CATCH_UP, max_catch_up=100)
+    scheduled = [result for _, result, _ in collect(scheduler, 4)]
+
+    # Every slot is polled, back to back once behind
+    assert gaps(scheduled) == pytest.approx([0.05] * 3, abs=1e-5)
+
+def test_aligned_polls_land_on_wall_clock_multiples():
+    scheduler = PollScheduler([UPSTarget(interval=0.05)], stamp, jitter=0, align=True)
+    scheduled = [result for _, result, _ in collect(scheduler, 4)]
+
+    # The first poll goes out immediately; the rest are aligned
+    for time_ in scheduled[1:]:
+        assert time_ / 0.05 == pytest.approx(round(time_ / 0.05), abs=1e-3)
+
+def test_unknown_overrun_policy_is_rejected():
+    with pytest.raises(ValueError):
+        PollScheduler([UPSTarget()], echo, overrun="wait")
+
+def test_results_end_once_stop_is_set():
+    stop = threading.Event()
+    scheduler = PollScheduler([UPSTarget(interval=60)], echo, jitter=0, stop=stop)
+    threading.Timer(0.1, stop.set).start()
+    started = time.monotonic()
+    # The first poll is due at once; the next would be a minute away
+    assert len(list(scheduler.results())) == 1
+    assert time.monotonic() - started < 1.0
@@ -0,0 +1,122 @@
+import struct
+import time
+
+import pytest
+
+from sample import UPSSample, UPSStatus
+from shared_status import (
+    SharedStatusFollower,
+    SharedStatusReader,
+    SharedStatusWriter,
+    StaleStatusError,
+    decode_sample,
+    encode_sample,
+    initialize_status_file,
+)
+
+
+def make_sample(ups_id="rack", bcharge=90.0, **kwargs):
+    return UPSSample(
+        status=kwargs.pop("status", UPSStatus.ONLINE),
+        bcharge=bcharge,
+        loadpct=25.0,
+        timeleft=None,
+        linev=120.0,
+        battv=13.5,
+        ups_id=ups_id,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def status_file(tmp_path):
+    return tmp_path / "status.shm"
+
+
+def test_encoding_round_trips_every_field():
+    sample = make_sample(status=UPSStatus.ONBATT | UPSStatus.LOWBATT, scheduled=100.0, fields={"MODEL": "BR1500MS2"})
+    decoded = decode_sample(encode_sample(sample))
+    assert decoded == sample
+    assert decoded.timeleft is None
+    assert decoded.fields == {"MODEL": "BR1500MS2"}
+
+def test_oversized_raw_fields_are_dropped():
+    sample = make_sample(fields={"NOTE": "x" * 5000})
+    decoded = decode_sample(encode_sample(sample))
+    assert decoded == sample
+    assert decoded.fields == {}
+
+def test_reader_sees_latest_sample_of_each_ups(status_file):
+    writer = SharedStatusWriter(status_file, slots=8, slot_size=512)
+    reader = SharedStatusReader(status_file)
+    assert reader.latest("rack") is None
+    for charge in (90.0, 80.0):
+        writer.publish(make_sample("rack", charge))
+    writer.publish(make_sample("spare", 50.0))
+    assert reader.latest("rack").bcharge == 80.0
+    assert reader.latest("spare").bcharge == 50.0
+
+def test_read_since_skips_samples_overwritten_by_the_writer(status_file):
+    writer = SharedStatusWriter(status_file, slots=4, slot_size=512)
+    reader = SharedStatusReader(status_file)
+    for charge in range(10):
+        writer.publish(make_sample(bcharge=float(charge)))
+    samples, cursor = reader.read_since(0)
+    assert [sample.bcharge for sample in samples] == [6.0, 7.0, 8.0, 9.0]
+    assert cursor == 10
+    writer.publish(make_sample(bcharge=10.0))
+    assert [sample.bcharge for sample in reader.read_since(cursor)[0]] == [10.0]
+
+def test_slot_being_written_is_never_read(status_file, monkeypatch):
+    writer = SharedStatusWriter(status_file, slots=4, slot_size=512)
+    writer.publish(make_sample(bcharge=90.0))
+    writer.publish(make_sample(bcharge=80.0))
+    # Leave the second slot's sequence odd, as a writer interrupted mid-publish would
+    struct.pack_into("<Q", writer._map, 64 + 512, 1)
+    monkeypatch.setattr("shared_status.READ_RETRIES", 3)
+    reader = SharedStatusReader(status_file)
+    assert reader.read(1) is None
+    assert reader.latest("rack").bcharge == 90.0
+
+def test_reopened_writer_continues_the_sequence(status_file):
+    SharedStatusWriter(status_file, slots=4, slot_size=512).publish(make_sample(bcharge=90.0))
+    reader = SharedStatusReader(status_file)
+    _, cursor = reader.read_since(0)
+    writer = SharedStatusWriter(status_file, slots=4, slot_size=512)
+    writer.publish(make_sample(bcharge=80.0))
+    assert writer.published == 2
+    assert [sample.bcharge for sample in reader.read_since(cursor)[0]] == [80.0]
+
+def test_reader_rejects_other_files(status_file):
+    status_file.write_bytes(b"\0" * 4096)
+    with pytest.raises(ValueError):
+        SharedStatusReader(status_file)
+
+def test_fetcher_reports_missing_and_stale_samples(status_file):
+    writer = SharedStatusWriter(status_file, slots=4, slot_size=512)
+    fetch = SharedStatusReader(status_file).fetcher("rack", stale_after=30)
+    with pytest.raises(StaleStatusError):
+        fetch()
+    writer.publish(make_sample(bcharge=90.0))
+    assert fetch().bcharge == 90.0
+    writer.publish(make_sample(bcharge=80.0, timestamp=time.time() - 60))
+    with pytest.raises(StaleStatusError):
+        fetch()
+
+def test_follower_hands_over_each_new_sample_once(status_file):
+    writer = SharedStatusWriter(status_file, slots=4, slot_size=512)
+    writer.publish(make_sample(bcharge=90.0))
+    received = []
+    follower = SharedStatusFollower(SharedStatusReader(status_file), received.append)
+    assert follower.poll() == 0
+    writer.publish(make_sample(bcharge=80.0))
+    assert follower.poll() == 1
+    assert follower.poll() == 0
+    assert [sample.bcharge for sample in received] == [80.0]
+
+def test_reset_empties_a_status_file_left_by_an_earlier_run(status_file):
+    SharedStatusWriter(status_file, slots=4, slot_size=512).publish(make_sample(bcharge=90.0))
+    initialize_status_file(status_file, slots=4, slot_size=512, reset=True)
+    reader = SharedStatusReader(status_file)
+    assert reader.published == 0
+    assert reader.latest("rack") is None
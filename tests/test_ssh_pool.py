@@ -0,0 +1,109 @@
+import unittest.mock as mock
+
+import paramiko
+import pytest
+
+import ssh_pool
+from ssh_pool import SSHDevicePool
+
+DEVICES = [
+    {'host': '192.168.1.1', 'username': 'ubnt', 'password': 'ubnt'},
+    {'host': '192.168.1.2', 'username': 'ubnt', 'password': 'ubnt'},
+]
+
+
+@pytest.fixture
+def mock_sshclient():
+    with mock.patch('ssh_pool.paramiko.SSHClient') as MockSSHClient:
+        MockSSHClient.side_effect = lambda: mock.MagicMock()
+        yield MockSSHClient
+
+@pytest.fixture
+def pool():
+    pool = SSHDevicePool()
+    pool.configure(DEVICES)
+    yield pool
+    pool.stop()
+
+def by_host(pool):
+    return {entry['host']: entry for entry in pool.health()}
+
+
+def test_connect_all_opens_sessions_with_keepalive(mock_sshclient, pool):
+    pool.connect_all()
+    health = by_host(pool)
+    assert all(entry['connected'] and entry['state'] == 'connected' for entry in health.values())
+    assert health['192.168.1.1']['connect_latency_ms'] is not None
+    assert mock_sshclient.call_count == 2
+
+def test_take_hands_over_live_session_once(mock_sshclient, pool):
+    pool.connect_all()
+    session = pool.take('192.168.1.1')
+    assert session is not None
+    assert pool.take('192.168.1.1') is None
+    assert pool.take('10.0.0.1') is None
+
+def test_take_discards_dead_session(mock_sshclient, pool):
+    pool.connect_all()
+    session = pool._devices['192.168.1.1'].session
+    session.get_transport.return_value.is_active.return_value = False
+    assert pool.take('192.168.1.1') is None
+    session.close.assert_called_once()
+
+def test_failed_connect_backs_off(mock_sshclient, pool):
+    mock_sshclient.side_effect = None
+    mock_sshclient.return_value.connect.side_effect = OSError("No route to host")
+    with mock.patch('ssh_pool.time.monotonic') as monotonic:
+        monotonic.return_value = 1000.0
+        pool.check_all()
+        monotonic.return_value = 1010.0
+        pool.check_all()
+        assert mock_sshclient.return_value.connect.call_count == 4
+
+        health = by_host(pool)['192.168.1.1']
+        assert health['state'] == 'unreachable'
+        assert health['last_error'] == "No route to host"
+        assert health['consecutive_failures'] == 2
+        assert health['retry_in_seconds'] == 10.0
+
+        # Within the backoff window nothing is retried, unless forced
+        mock_sshclient.return_value.connect.reset_mock()
+        monotonic.return_value = 1015.0
+        pool.check_all()
+        mock_sshclient.return_value.connect.assert_not_called()
+        pool.connect_all()
+    assert mock_sshclient.return_value.connect.call_count == 2
+
+def test_auth_failure_is_reported(mock_sshclient, pool):
+    mock_sshclient.side_effect = None
+    mock_sshclient.return_value.connect.side_effect = paramiko.AuthenticationException("bad password")
+    pool.check_all()
+    assert by_host(pool)['192.168.1.2']['state'] == 'auth_failed'
+
+def test_failed_probe_drops_session(mock_sshclient, pool):
+    pool.connect_all()
+    session = pool._devices['192.168.1.2'].session
+    session.get_transport.return_value.open_session.side_effect = paramiko.SSHException("channel refused")
+    pool.check_all()
+
+    health = by_host(pool)
+    assert health['192.168.1.1']['connected']
+    assert health['192.168.1.1']['probe_latency_ms'] is not None
+    assert not health['192.168.1.2']['connected']
+    assert health['192.168.1.2']['last_error'] == "channel refused"
+    session.close.assert_called_once()
+
+def test_backoff_is_capped():
+    state = ssh_pool._DeviceState(DEVICES[0])
+    pool = SSHDevicePool()
+    with mock.patch('ssh_pool.time.monotonic', return_value=0.0):
+        for _ in range(20):
+            pool._record_failure(state, 'unreachable', OSError())
+    assert state.retry_at == ssh_pool.BACKOFF_MAX_SECONDS
+
+def test_configure_closes_removed_hosts(mock_sshclient, pool):
+    pool.connect_all()
+    session = pool._devices['192.168.1.2'].session
+    pool.configure(DEVICES[:1])
+    session.close.assert_called_once()
+    assert [entry['host'] for entry in pool.health()] == ['192.168.1.1']
@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest.mock as mock
+
+import pytest
+
+from status_cache import StatusCache
+
+STATUS = {'STATUS': 'ONLINE', 'BCHARGE': '100.0'}
+
+
+def test_get_serves_fresh_snapshot_from_cache():
+    fetcher = mock.Mock(return_value=STATUS)
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    assert cache.get() == STATUS
+    assert cache.get() == STATUS
+    fetcher.assert_called_once()
+
+def test_get_refetches_after_ttl_expires():
+    fetcher = mock.Mock(return_value=STATUS)
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    with mock.patch('status_cache.time.monotonic', side_effect=[100.0, 100.0, 200.0, 200.0]):
+        cache.get()
+        cache.get()
+        cache.get()
+    assert fetcher.call_count == 2
+
+def test_refresh_always_fetches():
+    fetcher = mock.Mock(return_value=STATUS)
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    cache.get()
+    cache.refresh()
+    assert fetcher.call_count == 2
+
+def test_update_feeds_readers():
+    fetcher = mock.Mock()
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    cache.update(STATUS)
+    assert cache.get() == STATUS
+    fetcher.assert_not_called()
+
+def test_latest_never_fetches():
+    fetcher = mock.Mock()
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    assert cache.latest() is None
+    with mock.patch('status_cache.time.monotonic', side_effect=[100.0, 130.0]):
+        cache.update(STATUS)
+        assert cache.latest() == (STATUS, 30.0)
+    fetcher.assert_not_called()
+
+def test_concurrent_readers_share_one_fetch():
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        release.wait(5)
+        return STATUS
+
+    cache = StatusCache(ttl=60, fetcher=slow_fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [STATUS] * 10
+
+def test_fetch_error_propagates_and_is_not_cached():
+    fetcher = mock.Mock(side_effect=[ConnectionRefusedError("down"), STATUS])
+    cache = StatusCache(ttl=60, fetcher=fetcher)
+    with pytest.raises(ConnectionRefusedError):
+        cache.get()
+    assert cache.get() == STATUS
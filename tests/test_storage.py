@@ -0,0 +1,373 @@
+import sqlite3
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+
+import storage
+from metrics import db_write_seconds, samples_written
+from sample import UPSSample, UPSStatus
+
+DAY = 24 * 60 * 60
+NOW = 1_750_000_000 // DAY * DAY
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    storage.migrate(conn)
+    yield conn
+    conn.close()
+
+@pytest.fixture(autouse=True)
+def retention():
+    original = dict(storage.RETENTION_DAYS)
+    yield storage.RETENTION_DAYS
+    storage.RETENTION_DAYS.clear()
+    storage.RETENTION_DAYS.update(original)
+
+def insert_samples(conn, start, count, step=1, status=lambda i: "ONLINE", ups_id="default"):
+    conn.executemany(
+        "INSERT INTO ups_data (timestamp, ups_id, status, bcharge, loadpct, timeleft, linev, battv) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (start + i * step, ups_id, status(i), 100.0 - i / 100, i % 50, 60.0, 120.0, 13.0)
+            for i in range(count)
+        ],
+    )
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_migrate_converts_legacy_text_timestamps():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE ups_data (timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, status TEXT, "
+        "bcharge REAL, loadpct REAL, timeleft REAL, linev REAL, battv REAL)"
+    )
+    conn.execute(
+        "INSERT INTO ups_data VALUES ('2025-06-27 10:00:00', 'ONLINE', 100.0, 10.0, 60.0, 120.0, 13.0)"
+    )
+    storage.migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+    assert conn.execute("SELECT timestamp, status, bcharge FROM ups_data").fetchall() == [
+        (1751018400, 'ONLINE', 100.0),
+    ]
+    columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(ups_data)")}
+    assert columns["timestamp"] == "INTEGER"
+
+def test_migrate_adds_ups_id_to_single_ups_databases():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        "CREATE TABLE ups_data (timestamp INTEGER NOT NULL, status TEXT, "
+        "bcharge REAL, loadpct REAL, timeleft REAL, linev REAL, battv REAL);"
+        "INSERT INTO ups_data VALUES (1751018400, 'ONLINE', 100.0, 10.0, 60.0, 120.0, 13.0);"
+        "CREATE TABLE ups_rollup_1m (bucket INTEGER PRIMARY KEY, samples INTEGER NOT NULL, status TEXT, "
+        + ", ".join(f"{m}_min REAL, {m}_max REAL, {m}_avg REAL" for m in storage.METRICS)
+        + ");"
+        "INSERT INTO ups_rollup_1m (bucket, samples, status, bcharge_avg) VALUES (1751018400, 1, 'ONLINE', 100.0);"
+        "PRAGMA user_version = 1;"
+    )
+    storage.migrate(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+    assert conn.execute("SELECT ups_id, timestamp FROM ups_data").fetchall() == [("default", 1751018400)]
+    assert conn.execute("SELECT ups_id, bucket, bcharge_avg FROM ups_rollup_1m").fetchall() == [
+        ("default", 1751018400, 100.0),
+    ]
+
+def test_migrate_adds_scheduled_time():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        "CREATE TABLE ups_data (timestamp INTEGER NOT NULL, ups_id TEXT NOT NULL DEFAULT 'default', status TEXT, "
+        "bcharge REAL, loadpct REAL, timeleft REAL, linev REAL, battv REAL);"
+        "INSERT INTO ups_data VALUES (1751018400, 'default', 'ONLINE', 100.0, 10.0, 60.0, 120.0, 13.0);"
+        "PRAGMA user_version = 2;"
+    )
+    storage.migrate(conn)
+    storage.SampleWriter(conn, batch_size=1).add(make_sample(timestamp=1751018410, scheduled=1751018409.5))
+
+    assert conn.execute("SELECT timestamp, scheduled FROM ups_data ORDER BY timestamp").fetchall() == [
+        (1751018400, None), (1751018410, 1751018409.5),
+    ]
+
+def test_migrate_is_idempotent(conn):
+    insert_samples(conn, NOW, 10)
+    storage.migrate(conn)
+    assert count(conn, "ups_data") == 10
+
+def test_history_range_scan_uses_timestamp_index(conn):
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM ups_data WHERE timestamp >= ? AND timestamp < ?", (0, 1)
+    ).fetchall()
+    assert any("ups_data_timestamp" in row[-1] for row in plan)
+
+def test_query_history_bounds_result_size(conn):
+    start = NOW - 3600
+    insert_samples(conn, start + 1, 3600, status=lambda i: "ONBATT" if i >= 3000 else "ONLINE")
+    buckets = storage.query_history(conn.cursor(), start, NOW, 10, now=NOW)
+
+    assert len(buckets) == 10
+    assert sum(bucket["samples"] for bucket in buckets) == 3600
+    newest = buckets[0]
+    assert newest["status"] == "ONBATT"
+    assert newest["loadpct"]["min"] == 0
+    assert newest["loadpct"]["max"] == 49
+    assert newest["bcharge"]["min"] == pytest.approx(64.01)
+    # ISO 8601 in UTC, so browsers don't read bucket times as local time
+    times = [datetime.fromisoformat(bucket["timestamp"]) for bucket in buckets]
+    assert all(moment.tzinfo == timezone.utc and start <= moment.timestamp() < NOW for moment in times)
+
+def test_query_history_pages_line_up_with_full_query(conn, retention):
+    start = NOW - 3 * DAY
+    insert_samples(conn, start, 3 * 24 * 60, step=60)
+    storage.compact(conn, now=NOW - DAY)
+    full = storage.query_history(conn.cursor(), start, NOW, 100, now=NOW)
+
+    pages, before = [], None
+    while True:
+        page = storage.query_history(conn.cursor(), start, NOW, 100, now=NOW, limit=30, before=before)
+        _, first, _ = storage.history_page(start, NOW, 100, 30, before)
+        assert len(page) <= 30
+        pages += page
+        if first == start:
+            break
+        before = first
+
+    assert pages == full
+    assert storage.query_history(conn.cursor(), start, NOW, 100, now=NOW, limit=30, before=start) == []
+
+def test_query_history_is_per_ups(conn):
+    insert_samples(conn, NOW - 60, 60)
+    insert_samples(conn, NOW - 60, 30, ups_id="rack", status=lambda i: "ONBATT")
+
+    assert storage.query_history(conn.cursor(), NOW - 60, NOW, 1, now=NOW)[0]["samples"] == 60
+    rack = storage.query_history(conn.cursor(), NOW - 60, NOW, 1, now=NOW, ups_id="rack")
+    assert rack[0]["samples"] == 30
+    assert rack[0]["status"] == "ONBATT"
+
+def insert_values(conn, rows):
+    conn.executemany(
+        "INSERT INTO ups_data (timestamp, status, bcharge, loadpct, timeleft, linev, battv) "
+        "VALUES (?, 'ONLINE', ?, 10.0, 60.0, 120.0, 13.0)",
+        rows,
+    )
+
+def test_query_history_reconstructs_stored_on_change_series(conn):
+    # Stored on change: 100% until NOW - 300, then 90%
+    insert_values(conn, [(NOW - 900, 100.0), (NOW - 300, 90.0)])
+    buckets = storage.query_history(conn.cursor(), NOW - 600, NOW - 1, 10, now=NOW, hold=600)[::-1]
+
+    assert len(buckets) == 10
+    assert [bucket["bcharge"]["avg"] for bucket in buckets] == [100.0] * 5 + [90.0] * 5
+    assert [bucket["samples"] for bucket in buckets] == [0] * 5 + [1] + [0] * 4
+    # The bucket with the step reports both sides of it
+    assert buckets[5]["bcharge"] == {"min": 90.0, "max": 100.0, "avg": 90.0}
+
+def test_query_history_holds_values_only_for_hold_seconds(conn):
+    insert_values(conn, [(NOW - 600, 100.0)])
+    buckets = storage.query_history(conn.cursor(), NOW - 600, NOW - 1, 10, now=NOW, hold=150)
+    assert len(buckets) == 3
+
+def test_query_history_without_hold_leaves_gaps(conn):
+    insert_values(conn, [(NOW - 600, 100.0)])
+    assert len(storage.query_history(conn.cursor(), NOW - 600, NOW - 1, 10, now=NOW)) == 1
+
+def test_compact_builds_every_tier(conn):
+    insert_samples(conn, NOW - 2 * DAY, 2 * 24 * 60, step=60)
+    storage.compact(conn, now=NOW)
+
+    assert count(conn, "ups_rollup_1m") == 2 * 24 * 60
+    assert count(conn, "ups_rollup_1h") == 2 * 24
+    assert count(conn, "ups_rollup_1d") == 2
+    samples, avg = conn.execute(
+        "SELECT SUM(samples), SUM(bcharge_avg * samples) FROM ups_rollup_1d"
+    ).fetchone()
+    raw_sum = conn.execute("SELECT SUM(bcharge) FROM ups_data").fetchone()[0]
+    assert samples == 2 * 24 * 60
+    assert avg == pytest.approx(raw_sum)
+
+def test_compact_is_incremental(conn):
+    insert_samples(conn, NOW - 600, 300)
+    storage.compact(conn, now=NOW - 300)
+    first = count(conn, "ups_rollup_1m")
+    insert_samples(conn, NOW - 300, 300)
+    storage.compact(conn, now=NOW)
+
+    assert first == 5
+    assert count(conn, "ups_rollup_1m") == 10
+    assert conn.execute("SELECT SUM(samples) FROM ups_rollup_1m").fetchone()[0] == 600
+
+def test_compact_keeps_ups_apart(conn):
+    insert_samples(conn, NOW - 120, 120)
+    insert_samples(conn, NOW - 120, 60, step=2, ups_id="rack")
+    storage.compact(conn, now=NOW)
+
+    assert conn.execute(
+        "SELECT ups_id, SUM(samples) FROM ups_rollup_1m GROUP BY ups_id ORDER BY ups_id"
+    ).fetchall() == [("default", 120), ("rack", 60)]
+
+def test_compact_waits_for_buckets_to_settle(conn):
+    insert_samples(conn, NOW - 120, 120)
+    storage.compact(conn, now=NOW, settle=60)
+    assert count(conn, "ups_rollup_1m") == 1
+
+def test_compact_prunes_only_rolled_up_data(conn, retention):
+    retention["ups_data"] = 1
+    insert_samples(conn, NOW - 3 * DAY, 3 * 24 * 60, step=60)
+    storage.compact(conn, now=NOW)
+
+    oldest = conn.execute("SELECT MIN(timestamp) FROM ups_data").fetchone()[0]
+    assert oldest >= NOW - DAY
+    assert conn.execute("SELECT SUM(samples) FROM ups_rollup_1m").fetchone()[0] == 3 * 24 * 60
+
+def test_query_history_uses_rollups_for_long_ranges(conn, retention):
+    retention["ups_data"] = 1
+    insert_samples(conn, NOW - 3 * DAY, 3 * 24 * 60, step=60)
+    storage.compact(conn, now=NOW)
+    insert_samples(conn, NOW, 30, step=60)
+
+    buckets = storage.query_history(conn.cursor(), NOW - 3 * DAY, NOW + 1800, 72, now=NOW + 1800)
+
+    # Rolled-up history plus the raw tail that has not been compacted yet
+    assert sum(bucket["samples"] for bucket in buckets) == 3 * 24 * 60 + 30
+    assert len(buckets) <= 72
+
+@pytest.mark.parametrize("width, expected", [
+    (10, None),
+    (60, ("ups_rollup_1m", 60)),
+    (7200, ("ups_rollup_1h", 3600)),
+    (2 * DAY, ("ups_rollup_1d", DAY)),
+])
+def test_choose_tier_picks_coarsest_resolving_tier(conn, width, expected):
+    assert storage._choose_tier(conn.cursor(), NOW - DAY, width, NOW) == expected
+
+def test_choose_tier_falls_back_to_coarser_tier_past_retention(conn, retention):
+    retention["ups_data"] = 1
+    retention["ups_rollup_1m"] = 2
+    assert storage._choose_tier(conn.cursor(), NOW - 10 * DAY, 10, NOW) == ("ups_rollup_1h", 3600)
+
+def make_sample(status="ONLINE", bcharge=100.0, timestamp=NOW, monotonic=0.0, scheduled=None):
+    return UPSSample(
+        status=UPSStatus.parse(status), bcharge=bcharge, loadpct=10.0, timeleft=60.0,
+        linev=120.0, battv=13.0, timestamp=timestamp, monotonic=monotonic, scheduled=scheduled,
+    )
+
+def test_sample_writer_batches_commits(conn):
+    writer = storage.SampleWriter(conn, batch_size=5, flush_interval=3600)
+    flushed = [writer.add(make_sample(timestamp=NOW + i, monotonic=i)) for i in range(10)]
+
+    # The first sample establishes the status and is written immediately
+    assert flushed == [True, False, False, False, False, True, False, False, False, False]
+    assert count(conn, "ups_data") == 6
+    writer.flush()
+    assert count(conn, "ups_data") == 10
+
+def test_sample_writer_records_write_metrics(conn):
+    written, commits = samples_written.value(), db_write_seconds.count(operation="commit")
+    writer = storage.SampleWriter(conn, batch_size=3, flush_interval=3600)
+    for i in range(4):
+        writer.add(make_sample(timestamp=NOW + i, monotonic=i))
+    assert samples_written.value() - written == 4
+    assert db_write_seconds.count(operation="commit") - commits == 2
+
+def test_sample_writer_flushes_after_interval(conn):
+    writer = storage.SampleWriter(conn, batch_size=100, flush_interval=30)
+    writer.add(make_sample(monotonic=0))
+    assert not writer.add(make_sample(monotonic=10))
+    assert writer.add(make_sample(monotonic=45))
+
+def test_sample_writer_flushes_transitions_and_battery_samples(conn):
+    writer = storage.SampleWriter(conn, batch_size=100, flush_interval=3600)
+    writer.add(make_sample())
+    assert not writer.add(make_sample())
+    assert writer.add(make_sample(status="ONBATT", bcharge=99.0))
+    assert writer.add(make_sample(status="ONBATT", bcharge=98.0))
+    assert writer.add(make_sample(status="ONLINE"))
+    assert count(conn, "ups_data") == 5
+
+def test_sample_writer_tracks_transitions_per_ups(conn):
+    writer = storage.SampleWriter(conn, batch_size=100, flush_interval=3600)
+    writer.add(make_sample())
+    # Another UPS's first sample is its own transition; returning to the first UPS is not
+    assert writer.add(replace(make_sample(), ups_id="rack"))
+    assert not writer.add(make_sample())
+    assert conn.execute("SELECT DISTINCT ups_id FROM ups_data ORDER BY ups_id").fetchall() == [
+        ("default",), ("rack",),
+    ]
+
+def test_sample_writer_keeps_samples_after_failed_commit(conn):
+    writer = storage.SampleWriter(conn, batch_size=1, flush_interval=3600)
+    conn.execute("ALTER TABLE ups_data RENAME TO ups_data_gone")
+    with pytest.raises(sqlite3.Error):
+        writer.add(make_sample())
+    conn.execute("ALTER TABLE ups_data_gone RENAME TO ups_data")
+    writer.flush()
+    assert count(conn, "ups_data") == 1
+
+def test_enable_wal(tmp_path):
+    conn = sqlite3.connect(tmp_path / "wal.db")
+    storage.enable_wal(conn)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+def test_read_pool_reuses_read_only_connections(tmp_path):
+    path = tmp_path / "pool.db"
+    writable = sqlite3.connect(path)
+    storage.migrate(writable)
+    pool = storage.ReadConnectionPool(path, size=1)
+
+    with pool.connection() as first:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            first.execute("INSERT INTO ups_data (status) VALUES ('ONLINE')")
+    with pool.connection() as second:
+        assert second is first
+        with pool.connection() as overflow:
+            assert overflow is not first
+    pool.close_all()
+
+def test_read_pool_discards_connection_after_error(tmp_path):
+    path = tmp_path / "pool.db"
+    storage.migrate(sqlite3.connect(path))
+    pool = storage.ReadConnectionPool(path)
+
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as broken:
+            broken.execute("SELECT * FROM missing_table")
+    with pool.connection() as conn:
+        assert conn is not broken
+
+def test_read_pool_closes_connection_of_abandoned_reader(tmp_path):
+    path = tmp_path / "pool.db"
+    storage.migrate(sqlite3.connect(path))
+    pool = storage.ReadConnectionPool(path)
+    borrowed = []
+
+    def rows():
+        with pool.connection() as conn:
+            borrowed.append(conn)
+            yield from conn.execute("SELECT 1 UNION ALL SELECT 2")
+
+    # Like a client disconnecting from a streamed response
+    stream = rows()
+    next(stream)
+    stream.close()
+    with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+        borrowed[0].execute("SELECT 1")
+    with pool.connection() as conn:
+        assert conn is not borrowed[0]
+
+def test_history_version_changes_with_samples_and_compaction(conn):
+    assert storage.history_version(conn.cursor()) == (None, (None, None, None, None))
+    insert_samples(conn, NOW - 120, 120)
+    newest, version = storage.history_version(conn.cursor())
+    assert newest == NOW - 1
+    assert storage.history_version(conn.cursor(), "rack")[0] is None
+
+    storage.compact(conn, now=NOW)
+    _, compacted = storage.history_version(conn.cursor())
+    assert compacted != version
+    insert_samples(conn, NOW, 1)
+    assert storage.history_version(conn.cursor())[1] != compacted
@@ -1,8 +1,13 @@
+import gzip
+
 import pytest
 import unittest.mock as mock
 import json
 
-from web_app import app, DATABASE_FILE
+from broadcast import sample_broadcaster
+from sample import UPSSample, UPSStatus
+from status_cache import StatusCache, status_cache, status_caches
+from web_app import DEFAULT_MAX_STREAMS, app, configure_streams, history_bodies, read_pool
 
 @pytest.fixture
 def client():
@@ -11,10 +16,11 @@ def client():
         yield client
 
 @pytest.fixture(autouse=True)
-def mock_apcaccess_get_status():
-    with mock.patch('web_app.get') as _mock_get, \
-         mock.patch('web_app.parse') as _mock_parse:
-        _mock_get.return_value = "raw_status_string"
+def mock_nis_fetch_status():
+    status_cache.clear()
+    with mock.patch('nis_client.NISClient.fetch') as _mock_fetch, \
+         mock.patch('nis_client.parse_status') as _mock_parse:
+        _mock_fetch.return_value = "raw_status_string"
         _mock_parse.return_value = {
             'STATUS': 'ONLINE',
             'BCHARGE': '100.0',
@@ -23,28 +29,62 @@ def mock_apcaccess_get_status():
             'LINEV': '120.0',
             'BATTV': '13.0',
         }
-        yield _mock_get, _mock_parse
+        yield _mock_fetch, _mock_parse
 
 @pytest.fixture(autouse=True)
 def mock_sqlite3_connect():
-    with mock.patch('web_app.sqlite3.connect') as _mock_connect:
+    read_pool.close_all()
+    history_bodies.clear()
+    with mock.patch('storage.sqlite3.connect') as _mock_connect:
         mock_conn = mock.Mock()
         mock_cursor = mock.Mock()
         mock_conn.cursor.return_value = mock_cursor
         _mock_connect.return_value = mock_conn
+        # Newest sample time and data version for history_version(); rollup watermarks read the first
+        mock_cursor.fetchone.return_value = (None, 1, None, None, None)
 
-        # Mock execute for history data
+        # Mock execute for bucketed history data
         mock_cursor.fetchall.return_value = [
-            ("2025-06-27 10:00:00", "ONLINE", 100.0, 10.0, 60.0, 120.0, 13.0),
-            ("2025-06-27 09:00:00", "ONLINE", 90.0, 12.0, 55.0, 119.0, 12.5),
+            (1, 3, "ONLINE", 100.0, 100.0, 100.0, 10.0, 12.0, 11.0, 60.0, 60.0, 60.0,
+             119.0, 121.0, 120.0, 13.0, 13.0, 13.0),
+            (0, 2, "ONLINE", 90.0, 92.0, 91.0, 12.0, 12.0, 12.0, 55.0, 56.0, 55.5,
+             119.0, 119.0, 119.0, 12.5, 12.5, 12.5),
         ]
         yield _mock_connect
+    read_pool.close_all()
 
 def test_api_status(client):
     response = client.get('/api/status')
     assert response.status_code == 200
     data = json.loads(response.data)
     assert "STATUS" in data
+    assert data["BCHARGE"] == 100.0
+
+def test_api_status_served_from_cache(client, mock_nis_fetch_status):
+    client.get('/api/status')
+    client.get('/api/status')
+    mock_nis_fetch_status[0].assert_called_once()
+
+def test_api_status_for_named_ups(client):
+    rack = UPSSample(
+        status=UPSStatus.ONBATT, bcharge=55.0, loadpct=30.0, timeleft=12.0, linev=0.0, battv=12.0, ups_id="rack",
+    )
+    with mock.patch.dict(status_caches, {"rack": StatusCache(fetcher=lambda: rack)}):
+        assert json.loads(client.get('/api/ups').data) == ["default", "rack"]
+        data = json.loads(client.get('/api/status?ups=rack').data)
+    assert data["STATUS"] == "ONBATT"
+    assert data["BCHARGE"] == 55.0
+
+def test_api_unknown_ups(client):
+    assert client.get('/api/status?ups=nope').status_code == 404
+    assert client.get('/api/history?ups=nope').status_code == 404
+
+def test_api_devices(client):
+    health = [{'host': '192.168.1.1', 'state': 'connected', 'connect_latency_ms': 12.5}]
+    with mock.patch('web_app.device_pool.health', return_value=health):
+        response = client.get('/api/devices')
+    assert response.status_code == 200
+    assert json.loads(response.data) == health
 
 def test_api_history_default(client):
     response = client.get('/api/history')
@@ -52,6 +92,15 @@ def test_api_history_default(client):
     data = json.loads(response.data)
     assert isinstance(data, list)
     assert len(data) > 0
+    assert data[0]["samples"] == 3
+    assert data[0]["loadpct"] == {"min": 10.0, "max": 12.0, "avg": 11.0}
+
+def test_api_history_reuses_pooled_connection(client, mock_sqlite3_connect):
+    client.get('/api/history')
+    client.get('/api/history?timerange=24h')
+    mock_sqlite3_connect.assert_called_once()
+    assert mock_sqlite3_connect.call_args[0][0].endswith("apc_data.db?mode=ro")
+    assert mock_sqlite3_connect.call_args[1]["uri"] is True
 
 def test_api_history_invalid_timerange(client):
     response = client.get('/api/history?timerange=invalid')
@@ -59,3 +108,180 @@ def test_api_history_invalid_timerange(client):
     data = json.loads(response.data)
     assert "error" in data
     assert data["error"] == "Invalid timerange"
+
+@pytest.mark.parametrize("points", ["0", "100000", "abc"])
+def test_api_history_invalid_points(client, points):
+    response = client.get(f'/api/history?points={points}')
+    assert response.status_code == 400
+
+def test_api_history_pages_with_cursor(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    response = client.get('/api/history?start=1000&end=1999&points=100&limit=40')
+    assert response.status_code == 200
+    # 10s buckets from 1000; this page is the newest 40, from 1600 on
+    assert response.headers["X-Next-Cursor"] == "1000:1999:100:1600"
+    assert cursor.execute.call_args[0][1][-2:] == (1600, 1999)
+
+    response = client.get('/api/history?cursor=1000:1999:100:1600&limit=40')
+    assert response.headers["X-Next-Cursor"] == "1000:1999:100:1200"
+    assert cursor.execute.call_args[0][1][-2:] == (1200, 1599)
+
+    response = client.get('/api/history?cursor=1000:1999:100:1200&limit=40')
+    assert "X-Next-Cursor" not in response.headers
+    assert cursor.execute.call_args[0][1][-2:] == (1000, 1199)
+
+def test_api_history_revalidates_with_etag(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    response = client.get('/api/history')
+    etag = response.headers["ETag"]
+    executes = cursor.execute.call_count
+
+    response = client.get('/api/history', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    # Only the version was looked up
+    assert cursor.execute.call_count == executes + 1
+
+    # New data changes the version, and the ETag with it
+    cursor.fetchone.return_value = (None, 2, None, None, None)
+    response = client.get('/api/history', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_api_history_body_shared_between_clients(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    first = client.get('/api/history').data
+    executes = cursor.execute.call_count
+    assert client.get('/api/history').data == first
+    assert cursor.execute.call_count == executes + 1
+
+def test_api_history_gzipped_when_accepted(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    cursor.fetchall.return_value = [
+        (i, 3, "ONLINE") + (100.0,) * 15 for i in range(100)
+    ]
+    plain = client.get('/api/history')
+    assert "Content-Encoding" not in plain.headers
+    response = client.get('/api/history', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
+
+@pytest.mark.parametrize("query", ["timerange=2d", "start=200&end=100", "cursor=abc", "start=0&limit=0"])
+def test_api_history_invalid_window(client, query):
+    assert client.get(f'/api/history?{query}').status_code == 400
+
+# Windows reaching before 1970 or past what a datetime (or SQLite integer) can hold
+OUT_OF_RANGE_WINDOWS = [
+    "start=100&end=99999999999999999999",
+    "start=-100&end=100",
+    "start=1900-01-01T00:00:00&end=100",
+    "start=100&end=9999-12-31T23:59:59-12:00",
+]
+
+@pytest.mark.parametrize("query", OUT_OF_RANGE_WINDOWS + ["cursor=0:99999999999999999999:100:99999999999999999999"])
+def test_api_history_rejects_out_of_range_times(client, mock_sqlite3_connect, query):
+    response = client.get(f'/api/history?{query}')
+    assert response.status_code == 400
+    mock_sqlite3_connect.assert_not_called()
+
+def test_api_export_streams_csv(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    cursor.fetchmany.side_effect = [
+        [(1_750_000_000, "default", "ONLINE", 100.0, 10.0, 60.0, 120.0, 13.0)],
+        [(1_750_000_005, "default", "ONBATT", 99.0, 12.0, 58.0, 0.0, 12.9)],
+        [],
+    ]
+    response = client.get('/api/export?start=2025-06-15T00:00:00&end=1750100000')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert 'filename="apcmagic-default-1749945600-1750100000.csv"' in response.headers["Content-Disposition"]
+    assert response.get_data(as_text=True).splitlines()[1:] == [
+        "2025-06-15 15:06:40,default,ONLINE,100.0,10.0,60.0,120.0,13.0",
+        "2025-06-15 15:06:45,default,ONBATT,99.0,12.0,58.0,0.0,12.9",
+    ]
+    assert cursor.execute.call_args[0][1] == ("default", 1749945600, 1750100000)
+
+@pytest.mark.parametrize("query", ["", "start=yesterday", "start=100&end=50", "start=0&format=xml"])
+def test_api_export_invalid_arguments(client, query):
+    assert client.get(f'/api/export?{query}').status_code == 400
+
+@pytest.mark.parametrize("query", OUT_OF_RANGE_WINDOWS)
+def test_api_export_rejects_out_of_range_times(client, mock_sqlite3_connect, query):
+    response = client.get(f'/api/export?{query}')
+    assert response.status_code == 400
+    mock_sqlite3_connect.assert_not_called()
+
+def test_api_stream_pushes_published_samples(client):
+    first = {'timestamp': '2025-06-27T10:00:00Z', 'STATUS': 'ONLINE', 'BCHARGE': '100.0'}
+    second = {'timestamp': '2025-06-27T10:01:00Z', 'STATUS': 'ONBATT', 'BCHARGE': '99.0'}
+    sample_broadcaster.publish(first)
+    response = client.get('/api/stream')
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.iter_encoded()
+    assert json.loads(next(chunks).decode()[len("data: "):]) == first
+    sample_broadcaster.publish(second)
+    assert json.loads(next(chunks).decode()[len("data: "):]) == second
+    response.close()
+
+def test_api_stream_limits_concurrent_clients(client):
+    configure_streams(1)
+    # Gives each stream a sample to open with, rather than a keepalive after STREAM_KEEPALIVE_SECONDS
+    sample_broadcaster.publish({"ups_id": "default", "BCHARGE": 90.0})
+    try:
+        first = client.get('/api/stream')
+        assert first.status_code == 200
+        assert client.get('/api/stream').status_code == 503
+        first.close()
+        second = client.get('/api/stream')
+        assert second.status_code == 200
+        # Draining the server ends open streams after the latest samples
+        chunks = second.iter_encoded()
+        assert next(chunks).startswith(b"data: ")
+        sample_broadcaster.disconnect_all()
+        assert list(chunks) == []
+        second.close()
+    finally:
+        configure_streams(DEFAULT_MAX_STREAMS)
+
+def test_api_events(client, mock_sqlite3_connect):
+    cursor = mock_sqlite3_connect.return_value.cursor.return_value
+    cursor.execute.side_effect = [
+        [(7, "default", "onbatt", 1_750_000_000, 1_750_000_600, 40.0, 0.0, 0.0, 55.0, 45.0)],
+        [("onbatt", 1, 600, 45.0)],
+    ]
+    response = client.get('/api/events?start=1749945600&end=1750100000&kind=onbatt&limit=10')
+
+    assert response.status_code == 200
+    assert response.json["events"] == [{
+        "id": 7, "ups_id": "default", "kind": "onbatt", "start": 1_750_000_000, "end": 1_750_000_600,
+        "duration": 600, "min_bcharge": 40.0, "min_linev": 0.0, "max_linev": 0.0, "max_loadpct": 55.0,
+        "energy_wh": 45.0,
+    }]
+    assert response.json["summary"] == {"onbatt": {"count": 1, "seconds": 600, "energy_wh": 45.0}}
+    assert cursor.execute.call_args_list[0][0][1] == ("default", 1749945600, 1750100000, "onbatt", 10)
+
+@pytest.mark.parametrize("query", ["kind=blackout", "start=yesterday", "start=100&end=50", "limit=0", "limit=9999"])
+def test_api_events_invalid_arguments(client, query):
+    assert client.get(f'/api/events?{query}').status_code == 400
+
+@pytest.mark.parametrize("query", OUT_OF_RANGE_WINDOWS)
+def test_api_events_rejects_out_of_range_times(client, mock_sqlite3_connect, query):
+    response = client.get(f'/api/events?{query}')
+    assert response.status_code == 400
+    mock_sqlite3_connect.assert_not_called()
+
+def test_metrics_reads_cached_snapshots_without_polling(client, mock_nis_fetch_status):
+    status_cache.update(UPSSample.from_status({'STATUS': 'ONBATT', 'BCHARGE': '90.0', 'TIMELEFT': '12.5'}))
+    client.get('/api/history?timerange=1h')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+    assert 'apcmagic_ups_battery_charge_percent{ups="default"} 90.0' in body
+    assert 'apcmagic_ups_time_left_seconds{ups="default"} 750.0' in body
+    assert 'apcmagic_ups_on_battery{ups="default"} 1' in body
+    assert 'apcmagic_history_seconds_count{stage="serialize"}' in body
+    mock_nis_fetch_status[0].assert_not_called()
@@ -0,0 +1,122 @@
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from flask import Flask
+
+from web_server import MODE_DEVELOPMENT, WebServer
+
+
+@pytest.fixture
+def release():
+    release = threading.Event()
+    yield release
+    release.set()
+
+@pytest.fixture
+def slow_app(release):
+    app = Flask(__name__)
+    app.started = threading.Semaphore(0)
+
+    @app.route("/slow")
+    def slow():
+        app.started.release()
+        release.wait(5)
+        return "done"
+
+    @app.route("/fast")
+    def fast():
+        return "ok"
+
+    return app
+
+def start(app, **options):
+    server = WebServer(app, port=0, **options)
+    server.start()
+    return server, f"http://127.0.0.1:{server.port}"
+
+def get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+def test_serves_requests_concurrently(slow_app, release):
+    server, url = start(slow_app, threads=2)
+    results = []
+    clients = [threading.Thread(target=lambda: results.append(get(f"{url}/slow"))) for _ in range(2)]
+    for client in clients:
+        client.start()
+    assert slow_app.started.acquire(timeout=5) and slow_app.started.acquire(timeout=5)
+    release.set()
+    for client in clients:
+        client.join(5)
+    assert results == [b"done", b"done"]
+    server.stop()
+
+def test_refuses_connections_beyond_backlog(slow_app):
+    server, url = start(slow_app, threads=1, backlog=1, drain_seconds=0.1)
+    busy = threading.Thread(target=lambda: get(f"{url}/slow"), daemon=True)
+    busy.start()
+    assert slow_app.started.acquire(timeout=5)
+    # One connection waits for the worker; the next is turned away
+    waiting = socket.create_connection(("127.0.0.1", server.port))
+    time.sleep(0.2)
+    with pytest.raises(urllib.error.HTTPError) as refused:
+        get(f"{url}/fast")
+    assert refused.value.code == 503
+    waiting.close()
+    server.stop()
+
+def test_drops_stalled_clients(slow_app):
+    server, url = start(slow_app, threads=1, request_timeout=0.2)
+    stalled = socket.create_connection(("127.0.0.1", server.port))
+    stalled.sendall(b"GET /fast HTTP/1.1\r\n")
+    stalled.settimeout(5)
+    # The worker gives up on the half-sent request and is free again
+    assert stalled.recv(1024) == b""
+    assert get(f"{url}/fast") == b"ok"
+    server.stop()
+
+def test_stop_drains_in_flight_requests(slow_app, release):
+    server, url = start(slow_app, threads=2)
+    results = []
+    client = threading.Thread(target=lambda: results.append(get(f"{url}/slow")))
+    client.start()
+    assert slow_app.started.acquire(timeout=5)
+    threading.Timer(0.2, release.set).start()
+    server.stop()
+    client.join(5)
+    assert results == [b"done"]
+    # No longer accepting connections
+    with pytest.raises(OSError):
+        get(f"{url}/fast", timeout=1)
+
+def test_stop_gives_up_after_drain_seconds(slow_app):
+    server, url = start(slow_app, threads=1, drain_seconds=0.2)
+    threading.Thread(target=lambda: get(f"{url}/slow"), daemon=True).start()
+    assert slow_app.started.acquire(timeout=5)
+    started = time.monotonic()
+    server.stop()
+    assert time.monotonic() - started < 2
+
+def test_stop_releases_the_port(slow_app):
+    server, url = start(slow_app)
+    assert get(f"{url}/fast") == b"ok"
+    server.stop()
+    with pytest.raises(OSError):
+        get(f"{url}/fast", timeout=1)
+    restarted = WebServer(slow_app, port=server.port)
+    restarted.start()
+    assert get(f"{url}/fast") == b"ok"
+    restarted.stop()
+
+def test_development_mode_serves_app(slow_app):
+    server, url = start(slow_app, mode=MODE_DEVELOPMENT)
+    assert get(f"{url}/fast") == b"ok"
+    server.stop()
+
+def test_unknown_mode_is_rejected(slow_app):
+    with pytest.raises(ValueError):
+        WebServer(slow_app, mode="turbo", port=0)